@@ -0,0 +1,283 @@
+import os
+import json
+import asyncio
+import argparse
+import aiomysql
+import numpy as np
+import pandas as pd
+from db_pool import close_pools, get_pool
+from history_store import cached_history
+from instruments import DEFAULT_SYMBOL, instrument
+from peaks import DEFAULT_WINDOW, PeakTroughTracker
+from signals import (OPTION_BUYING_SIGNALS, TRADING_BOT_SIGNALS, option_buying_masks, option_buying_strike,
+                     option_buying_triggers, trading_bot_masks, trading_bot_strike, trading_bot_triggers)
+from timeframes import indicator_table
+
+# Replays an indicators table through the strategies' own signal functions.
+# The signal masks run over the whole frame, and np.maximum.accumulate gives
+# the latest row of each signal at every bar. The scalar trigger and strike
+# functions of the live strategies run once per distinct set of latest rows
+# and are broadcast to every bar sharing it; only the entry check against the
+# bar's low/high is per bar.
+#
+# P&L is in index points of the underlying, one unit: a call entry goes long
+# and a put entry short at the close of the signal bar (live orders go out a
+# few seconds later). The position is held until an entry the other way or
+# the session close. Option premiums are not recorded, so results rank the
+# signals rather than option returns.
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+config_path = os.path.join(project_root, 'config', 'config.json')
+
+STRATEGIES = ('option_buying', 'trading_bot')
+
+
+def load_indicators_file(path):
+    if path.endswith('.parquet'):
+        data = pd.read_parquet(path)  # needs pyarrow or fastparquet
+    elif path.endswith('.pkl'):
+        data = pd.read_pickle(path)
+    else:
+        data = pd.read_csv(path)
+    data['datetime'] = pd.to_datetime(data['datetime'])
+    return data.sort_values(by='datetime', ignore_index=True)
+
+
+async def load_indicators_db(config, table_name, since=None, until=None):
+    pool = await get_pool(config)
+    data = await cached_history(config, pool, table_name, since, until)
+    if data is not None:
+        return data
+    conditions, args = [], []
+    if since is not None:
+        conditions.append('`datetime` >= %s')
+        args.append(since)
+    if until is not None:
+        conditions.append('`datetime` < %s')
+        args.append(until)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(f'SELECT * FROM `{table_name}`{where} ORDER BY `datetime`', args or None)
+            result = await cur.fetchall()
+    data = pd.DataFrame(result)
+    if not data.empty:
+        data['datetime'] = pd.to_datetime(data['datetime'])
+    return data
+
+
+def latest_index(mask):
+    # Index of the last True at or before each position, -1 before the first
+    mask = np.asarray(mask, dtype=bool)
+    return np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+
+
+def state_groups(keys):
+    # Start position of every run of bars that share the same key columns
+    changed = np.ones(len(keys), dtype=bool)
+    changed[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    starts = np.flatnonzero(changed)
+    return starts, np.cumsum(changed) - 1
+
+
+class RowView:
+    # Rows of a frame as dicts, built only for the positions that are asked for
+    def __init__(self, data):
+        self.columns = {col: data[col].tolist() if col == 'datetime' else data[col].to_numpy()
+                        for col in data.columns}
+
+    def __call__(self, i):
+        if i < 0:
+            return None
+        return {col: values[i] for col, values in self.columns.items()}
+
+
+def option_buying_entries(data, step):
+    masks = option_buying_masks(data)
+    latest = np.column_stack([latest_index(masks[name]) for name in OPTION_BUYING_SIGNALS])
+    starts, group = state_groups(latest)
+    row = RowView(data)
+
+    calls = np.full(len(starts), np.nan)
+    puts = np.full(len(starts), np.nan)
+    strikes = np.full(len(starts), np.nan)
+    sides = np.zeros(len(starts), dtype=np.int8)
+    for g, start in enumerate(starts):
+        if (latest[start] < 0).any():
+            continue
+        call_entry_trigger, put_entry_trigger = option_buying_triggers(
+            {name: row(i) for name, i in zip(OPTION_BUYING_SIGNALS, latest[start])})
+        try:
+            strike_price, option_type = option_buying_strike(call_entry_trigger, put_entry_trigger, step)
+        except ValueError:
+            # NaN trigger: the live strategy cannot size a strike either
+            continue
+        calls[g] = np.nan if call_entry_trigger is None else call_entry_trigger
+        puts[g] = np.nan if put_entry_trigger is None else put_entry_trigger
+        strikes[g] = np.nan if strike_price is None else strike_price
+        sides[g] = {'call': 1, 'put': -1}.get(option_type, 0)
+
+    call, put, side = calls[group], puts[group], sides[group]
+    has_strike = ~np.isnan(strikes[group])
+    # Same checks as OptionBuying.decide
+    direction = np.where((side == 1) & has_strike & (call >= data['low'].to_numpy()), 1,
+                         np.where((side == -1) & has_strike & (put <= data['high'].to_numpy()), -1, 0))
+    return pd.DataFrame({'datetime': data['datetime'], 'call_entry_trigger': call, 'put_entry_trigger': put,
+                         'strike_price': strikes[group], 'direction': direction})
+
+
+def peak_trough_states(data, window=DEFAULT_WINDOW, min_prominence=1):
+    # Stream the frame through the live tracker; per bar the position of the
+    # latest peak and trough row in `peaks`/`troughs`
+    tracker = PeakTroughTracker(window, min_prominence)
+    peaks, troughs = [], []
+    peak_at = np.full(len(data), -1)
+    trough_at = np.full(len(data), -1)
+    for i, (dt, high, low) in enumerate(zip(data['datetime'], data['highsma5'], data['lowsma5'])):
+        tracker.add(dt, high, low)
+        peak = tracker.peaks.latest_peak()
+        if peak is not None:
+            if not peaks or peaks[-1][0] != peak[0]:
+                peaks.append(peak)
+            peak_at[i] = len(peaks) - 1
+        trough = tracker.troughs.latest_peak()
+        if trough is not None:
+            if not troughs or troughs[-1][0] != trough[0]:
+                troughs.append(trough)
+            trough_at[i] = len(troughs) - 1
+    peak_rows = [{'Datetime': dt, 'PeakValue': value, 'PeakProm': prom} for dt, value, prom in peaks]
+    trough_rows = [{'Datetime': dt, 'TroughValue': -value, 'TroughProm': prom} for dt, value, prom in troughs]
+    return peak_rows, peak_at, trough_rows, trough_at
+
+
+def trading_bot_entries(data, step, window=DEFAULT_WINDOW, min_prominence=1, min_range=None):
+    peak_rows, peak_at, trough_rows, trough_at = peak_trough_states(data, window, min_prominence)
+    masks = trading_bot_masks(data)
+    crosses = np.column_stack([latest_index(masks[name]) for name in TRADING_BOT_SIGNALS])
+    starts, group = state_groups(np.column_stack([peak_at, trough_at, crosses]))
+    row = RowView(data)
+
+    calls = np.full(len(starts), np.nan)
+    puts = np.full(len(starts), np.nan)
+    strikes = np.full(len(starts), np.nan)
+    sides = np.zeros(len(starts), dtype=np.int8)
+    for g, start in enumerate(starts):
+        if peak_at[start] < 0 or trough_at[start] < 0:
+            continue
+        peak_row, trough_row = peak_rows[peak_at[start]], trough_rows[trough_at[start]]
+        call_entry_trigger, put_entry_trigger, _ = trading_bot_triggers(
+            peak_row, trough_row, row(crosses[start][0]), row(crosses[start][1]))
+        strike_price, option_type, _ = trading_bot_strike(peak_row, trough_row, step, min_range)
+        # Falsy triggers never enter, as in TradingBot.decide
+        calls[g] = call_entry_trigger if call_entry_trigger else np.nan
+        puts[g] = put_entry_trigger if put_entry_trigger else np.nan
+        strikes[g] = np.nan if strike_price is None else strike_price
+        sides[g] = {'call': 1, 'put': -1}.get(option_type, 0)
+
+    call, put, side = calls[group], puts[group], sides[group]
+    has_strike = ~np.isnan(strikes[group])
+    direction = np.where((side == 1) & has_strike & (call > data['low'].to_numpy()), 1,
+                         np.where((side == -1) & has_strike & (put < data['high'].to_numpy()), -1, 0))
+    return pd.DataFrame({'datetime': data['datetime'], 'call_entry_trigger': call, 'put_entry_trigger': put,
+                         'strike_price': strikes[group], 'direction': direction})
+
+
+def simulate(data, entries, cost=0.0):
+    # One-unit position on the underlying from the entry directions; flat at
+    # every session close. Returns per-bar P&L and the list of trades.
+    close = data['close'].to_numpy(dtype=float)
+    session = data['datetime'].dt.normalize().to_numpy()
+    last_bar = np.ones(len(data), dtype=bool)
+    last_bar[:-1] = session[1:] != session[:-1]
+
+    direction = entries['direction'].to_numpy()
+    desired = pd.Series(np.where(direction != 0, direction, np.nan))
+    position = desired.groupby(session).ffill().fillna(0).to_numpy(copy=True)
+    position[last_bar] = 0
+
+    held = np.zeros(len(data))
+    held[1:] = position[:-1]
+    moves = np.zeros(len(data))
+    moves[1:] = np.diff(close)
+    turnover = np.abs(np.diff(np.r_[0.0, position]))
+    pnl = held * moves - cost * turnover
+
+    changes = np.flatnonzero(np.diff(np.r_[0.0, position]) != 0)
+    opened = changes[position[changes] != 0]
+    closed = changes[np.searchsorted(changes, opened, side='right')]
+    trades = pd.DataFrame({
+        'entry_time': data['datetime'].to_numpy()[opened],
+        'exit_time': data['datetime'].to_numpy()[closed],
+        'side': np.where(position[opened] > 0, 'call', 'put'),
+        'strike_price': entries['strike_price'].to_numpy()[opened],
+        'entry_price': close[opened],
+        'exit_price': close[closed],
+    })
+    trades['points'] = position[opened] * (close[closed] - close[opened]) - 2 * cost
+    return pd.Series(pnl, index=data['datetime']), trades
+
+
+def summarize(pnl, trades):
+    equity = pnl.cumsum()
+    wins = trades['points'] > 0
+    gross_loss = -trades.loc[~wins, 'points'].sum()
+    return {
+        'trades': len(trades),
+        'win_rate': float(wins.mean()) if len(trades) else float('nan'),
+        'total_points': float(pnl.sum()),
+        'avg_points': float(trades['points'].mean()) if len(trades) else float('nan'),
+        'profit_factor': float(trades.loc[wins, 'points'].sum() / gross_loss) if gross_loss > 0 else float('inf'),
+        'max_drawdown': float((equity.cummax() - equity).max()) if len(equity) else 0.0,
+    }
+
+
+def backtest(data, strategy, step, window=DEFAULT_WINDOW, min_prominence=1, min_range=None, cost=0.0):
+    data = data.reset_index(drop=True)
+    if strategy == 'option_buying':
+        entries = option_buying_entries(data, step)
+    elif strategy == 'trading_bot':
+        entries = trading_bot_entries(data, step, window, min_prominence, min_range)
+    else:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    pnl, trades = simulate(data, entries, cost)
+    return summarize(pnl, trades), trades
+
+
+async def main(config, args):
+    if args.file:
+        data = load_indicators_file(args.file)
+    else:
+        try:
+            data = await load_indicators_db(config, indicator_table(args.timeframe, args.symbol), args.since, args.until)
+        finally:
+            await close_pools()
+    if data.empty:
+        print("No indicator rows to backtest")
+        return
+    settings = config.get('peak_trough', {})
+    summary, trades = backtest(data, args.strategy, instrument(config, args.symbol)['strike_step'],
+                               settings.get('window', DEFAULT_WINDOW), settings.get('min_prominence', 1),
+                               settings.get('min_range'), args.cost)
+    print(f"{args.strategy} {args.symbol} {args.timeframe}: {len(data)} bars "
+          f"{data['datetime'].iloc[0]} .. {data['datetime'].iloc[-1]}")
+    for key, value in summary.items():
+        print(f"  {key}: {value:.2f}" if isinstance(value, float) else f"  {key}: {value}")
+    if args.trades:
+        trades.to_csv(args.trades, index=False)
+        print(f"Trades written to {args.trades}")
+
+
+if __name__ == "__main__":
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    parser = argparse.ArgumentParser(description='Backtest a strategy over an indicators table or file')
+    parser.add_argument('strategy', choices=STRATEGIES)
+    parser.add_argument('--file', help='CSV, parquet or pickle export of an indicators table')
+    parser.add_argument('--timeframe', default=config.get('timeframe', '1m'))
+    parser.add_argument('--symbol', default=DEFAULT_SYMBOL)
+    parser.add_argument('--since', help='first datetime to load from MySQL')
+    parser.add_argument('--until', help='datetime to stop loading from MySQL (exclusive)')
+    parser.add_argument('--cost', type=float, default=0.0, help='cost per position change, in points')
+    parser.add_argument('--trades', help='write the trade list to this CSV file')
+    asyncio.run(main(config, parser.parse_args()))
@@ -0,0 +1,107 @@
+import math
+import pandas as pd
+
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'ohlc4']
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+# Folds 1-second bars into 1-minute bars one tick at a time with the same
+# aggregation as resample(...).agg({'open': 'first', 'high': 'max', 'low': 'min',
+# 'close': 'last', 'ohlc4': 'mean'}): NaNs are skipped per column and a minute
+# without any data comes out as zeros, up to the close of the day's session in
+# the market calendar (special sessions included).
+
+
+class MinuteBar:
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'ohlc4_sum', 'ohlc4_count')
+
+    def __init__(self, start):
+        self.start = start
+        self.open = self.high = self.low = self.close = math.nan
+        self.ohlc4_sum = 0.0
+        self.ohlc4_count = 0
+
+    @property
+    def is_empty(self):
+        return (math.isnan(self.open) and math.isnan(self.high) and math.isnan(self.low)
+                and math.isnan(self.close) and not self.ohlc4_count)
+
+    def add(self, open, high, low, close, ohlc4):
+        if math.isnan(self.open):
+            self.open = open
+        if not math.isnan(high) and not high <= self.high:
+            self.high = high
+        if not math.isnan(low) and not low >= self.low:
+            self.low = low
+        if not math.isnan(close):
+            self.close = close
+        if not math.isnan(ohlc4):
+            self.ohlc4_sum += ohlc4
+            self.ohlc4_count += 1
+
+    def row(self):
+        ohlc4 = self.ohlc4_sum / self.ohlc4_count if self.ohlc4_count else math.nan
+        values = (self.open, self.high, self.low, self.close, ohlc4)
+        return [self.start] + [0.0 if math.isnan(value) else value for value in values]
+
+
+class MinuteBarAggregator:
+    def __init__(self, calendar):
+        self.calendar = calendar
+        self.bar = None
+        self.last_tick = None
+        self.late_ticks = 0
+
+    def session_close(self, minute):
+        # Close of the session on `minute`'s date; on a day without one only
+        # the open bar itself is closed
+        session = self.calendar.session(minute)
+        return minute + ONE_MINUTE if session is None else session[1]
+
+    def start_at(self, minute):
+        self.bar = MinuteBar(pd.Timestamp(minute).floor('min'))
+
+    def advance(self, minute):
+        # Close the open bar and every empty minute before `minute`, without
+        # running past the session close of the bar's day
+        if self.bar is None or minute <= self.bar.start:
+            return []
+        closed = [self.bar.row()]
+        start = self.bar.start + ONE_MINUTE
+        end = min(minute, self.session_close(self.bar.start))
+        while start < end:
+            closed.append(MinuteBar(start).row())
+            start += ONE_MINUTE
+        self.bar = MinuteBar(minute)
+        return closed
+
+    def add(self, dt, open, high, low, close, ohlc4):
+        dt = pd.Timestamp(dt)
+        minute = dt.floor('min')
+        if self.bar is None:
+            self.start_at(minute)
+        if minute < self.bar.start:
+            # Seconds for an already emitted minute are not folded back in
+            self.late_ticks += 1
+            return []
+        closed = self.advance(minute)
+        self.bar.add(open, high, low, close, ohlc4)
+        self.last_tick = dt if self.last_tick is None else max(self.last_tick, dt)
+        return closed
+
+    def add_frame(self, data):
+        closed = []
+        values = data[['datetime'] + BAR_COLUMNS].astype({col: float for col in BAR_COLUMNS})
+        for row in values.itertuples(index=False):
+            closed.extend(self.add(*row))
+        return closed
+
+    def partial(self):
+        if self.bar is None or self.bar.is_empty:
+            return None
+        return self.bar.row()
+
+    @staticmethod
+    def to_frame(rows):
+        bars = pd.DataFrame(rows, columns=['datetime'] + BAR_COLUMNS)
+        bars['ohlc4'] = bars['ohlc4'].round(2)
+        return bars
@@ -0,0 +1,270 @@
+import sys
+import json
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+from multiprocessing import resource_tracker, shared_memory
+from bars import FLAG_COLUMNS, FLAG_NULL, Bars
+from market_calendar import SESSION_MINUTES
+
+# Fixed-size ring of the most recent bars in shared memory, so the live
+# processes see each other's newest rows without a MySQL round trip. Two rings
+# per symbol, each with a single writer:
+#
+#   algo_ohlc_<symbol>_1m        1m OHLC bars, written by datasampling.py
+#   algo_indicators_<symbol>_1m  indicators_data rows, written by indicator_update.py
+#
+# Enabled by a "ring_buffer" section in config.json ({"sessions": 5} keeps the
+# last five sessions of 1m bars). Readers attach when the writer is running and
+# fall back to MySQL otherwise, or when the rows they need have already left
+# the ring.
+#
+# Layout: an int64 header (magic, capacity, column counts, head = bars ever
+# appended, writes = append/revision count), the column names as JSON, then
+# per slot the epoch minute, the bar's sequence number and a version counter,
+# and the float32 value and int8 flag columns slot-major by column (the Bars
+# types). Bar `seq` lives in slot seq % capacity.
+#
+# Readers take no lock. The writer makes a slot's version odd before touching
+# it and even again afterwards; a reader copies the slots it wants and keeps
+# the copy only if every version is even and unchanged and every slot still
+# holds the expected sequence, otherwise it retries. A revision of a bar
+# already in the ring (same minute) is written in place under the same
+# protocol. A bar older than the newest one that is not in the ring is dropped
+# from the ring; it still reaches MySQL.
+
+MAGIC = 0x42415252
+HEADER = ('magic', 'capacity', 'values', 'flags', 'head', 'writes', 'dropped', 'reserved')
+HEAD, WRITES, DROPPED = HEADER.index('head'), HEADER.index('writes'), HEADER.index('dropped')
+NAMES_SIZE = 2048
+
+
+def ring_name(kind, symbol, timeframe='1m'):
+    return f'algo_{kind}_{symbol}_{timeframe}'
+
+
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Before 3.13 an attaching process registers the block too and its
+    # resource tracker would unlink it when the reader exits
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class BarRing:
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((len(HEADER),), dtype=np.int64, buffer=shm.buf)
+        if self.header[0] != MAGIC:
+            raise ValueError(f"{shm.name} is not a bar ring")
+        capacity, n_values, n_flags = (int(value) for value in self.header[1:4])
+        offset = self.header.nbytes
+        names = json.loads(bytes(shm.buf[offset:offset + NAMES_SIZE]).rstrip(b'\0'))
+        self.value_columns, self.flag_columns = names['values'], names['flags']
+        self.capacity = capacity
+
+        offset += NAMES_SIZE
+        self.minutes = np.ndarray((capacity,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.minutes.nbytes
+        self.slot_seq = np.ndarray((capacity,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.slot_seq.nbytes
+        self.slot_version = np.ndarray((capacity,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.slot_version.nbytes
+        self.values = np.ndarray((n_values, capacity), dtype=np.float32, buffer=shm.buf, offset=offset)
+        offset += self.values.nbytes
+        self.flags = np.ndarray((n_flags, capacity), dtype=np.int8, buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def size(capacity, n_values, n_flags):
+        return len(HEADER) * 8 + NAMES_SIZE + capacity * (3 * 8 + 4 * n_values + n_flags)
+
+    @classmethod
+    def create(cls, name, columns, capacity):
+        # Writer side; a block left behind by a previous writer is replaced
+        values = [column for column in columns if column != 'datetime' and column not in FLAG_COLUMNS]
+        flags = [column for column in columns if column in FLAG_COLUMNS]
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            stale = None
+        if stale is not None:
+            # Readers still attached to it see the cleared magic and re-attach
+            if stale.size >= 8:
+                magic = np.ndarray((1,), dtype=np.int64, buffer=stale.buf)
+                magic[0] = 0
+                del magic
+            stale.close()
+            stale.unlink()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(capacity, len(values), len(flags)))
+        header = np.ndarray((len(HEADER),), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        names = json.dumps({'values': values, 'flags': flags}).encode()
+        if len(names) > NAMES_SIZE:
+            raise ValueError("Too many ring columns")
+        offset = header.nbytes
+        shm.buf[offset:offset + NAMES_SIZE] = names.ljust(NAMES_SIZE, b'\0')
+        header[1:4] = capacity, len(values), len(flags)
+        header[0] = MAGIC
+        ring = cls(shm, owner=True)
+        ring.slot_seq[:] = -1
+        ring.slot_version[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def columns(self):
+        return ['datetime'] + self.value_columns + self.flag_columns
+
+    @property
+    def live(self):
+        # False once the writer has closed or replaced the block
+        return int(self.header[0]) == MAGIC
+
+    @property
+    def head(self):
+        return int(self.header[HEAD])
+
+    @property
+    def writes(self):
+        return int(self.header[WRITES])
+
+    @property
+    def oldest(self):
+        return max(self.head - self.capacity, 0)
+
+    def _store(self, slots, bars, rows, seqs=None):
+        self.slot_version[slots] += 1
+        if seqs is not None:
+            self.slot_seq[slots] = seqs
+        self.minutes[slots] = bars.minutes[rows]
+        for i, column in enumerate(self.value_columns):
+            self.values[i, slots] = bars.values[column][rows] if column in bars.values else np.nan
+        for i, column in enumerate(self.flag_columns):
+            self.flags[i, slots] = bars.values[column][rows] if column in bars.values else FLAG_NULL
+        self.slot_version[slots] += 1
+
+    def find(self, minute):
+        # Slot holding `minute`, or None
+        for slot in np.flatnonzero(self.minutes == minute):
+            if self.slot_seq[slot] >= self.oldest:
+                return int(slot)
+        return None
+
+    def write(self, bars):
+        # Appends bars newer than the last one and revises those still in the
+        # ring; single writer only
+        if bars.empty:
+            return
+        head = self.head
+        last = self.minutes[(head - 1) % self.capacity] if head else None
+        newer = np.arange(len(bars)) if last is None else np.flatnonzero(bars.minutes > last)
+        older = np.setdiff1d(np.arange(len(bars)), newer)
+
+        for row in older:
+            slot = self.find(bars.minutes[row])
+            if slot is None:
+                self.header[DROPPED] += 1
+                continue
+            self._store(np.array([slot]), bars, np.array([row]))
+            self.header[WRITES] += 1
+
+        if len(newer):
+            # A batch longer than the ring keeps only its last `capacity` bars
+            end = head + len(newer)
+            newer = newer[-self.capacity:]
+            seqs = np.arange(end - len(newer), end)
+            self._store(seqs % self.capacity, bars, newer, seqs)
+            self.header[HEAD] = end
+            self.header[WRITES] += 1
+
+    def read(self, start=None, retries=1000):
+        # Copy of bars start..head-1 (default: the whole ring) and the head it
+        # was read at; LookupError when `start` has been overwritten
+        for _ in range(retries):
+            head = self.head
+            oldest = max(head - self.capacity, 0)
+            first = oldest if start is None else start
+            if first < oldest:
+                raise LookupError(f"Bar {first} has left the ring (oldest is {oldest})")
+            seqs = np.arange(first, head)
+            slots = seqs % self.capacity
+            before = self.slot_version[slots]
+            if (before & 1).any():
+                time.sleep(0)
+                continue
+            minutes = self.minutes[slots]
+            values = {column: self.values[i, slots] for i, column in enumerate(self.value_columns)}
+            values.update({column: self.flags[i, slots] for i, column in enumerate(self.flag_columns)})
+            if (self.slot_version[slots] == before).all() and (self.slot_seq[slots] == seqs).all():
+                return Bars(minutes, values), head
+            time.sleep(0)
+        raise RuntimeError(f"{self.shm.name}: writer kept overwriting the requested bars")
+
+    def since(self, dt):
+        # Bars from minute `dt` on, or None when the ring does not reach back that far
+        if self.head == 0:
+            return None
+        bars, _ = self.read()
+        if len(bars) == 0 or bars.datetimes[0] > pd.Timestamp(dt).floor('min'):
+            return None
+        return bars.since(dt)
+
+    async def wait(self, seen, timeout, interval=0.05):
+        # Returns the write count once it moves past `seen`, or after `timeout` seconds
+        deadline = time.monotonic() + timeout
+        while self.writes == seen and self.live and time.monotonic() < deadline:
+            await asyncio.sleep(interval)
+        return self.writes
+
+    def close(self):
+        if self.owner:
+            # Tells attached readers to let go of this block and re-attach
+            self.header[0] = 0
+        self.header = self.minutes = self.slot_seq = self.slot_version = self.values = self.flags = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def ring_capacity(config):
+    return int(config['ring_buffer'].get('sessions', 5)) * SESSION_MINUTES
+
+
+def create_ring(config, kind, symbol, columns):
+    # Writer side; None when the ring buffer is not configured
+    if not config.get('ring_buffer'):
+        return None
+    return BarRing.create(ring_name(kind, symbol), columns, ring_capacity(config))
+
+
+def attach_ring(config, kind, symbol, ring=None):
+    # Reader side; keeps `ring` while its writer is alive. None when not
+    # configured or the writer is not running
+    if ring is not None:
+        if ring.live:
+            return ring
+        ring.close()
+    if not config.get('ring_buffer'):
+        return None
+    try:
+        return BarRing.attach(ring_name(kind, symbol))
+    except FileNotFoundError:
+        return None
+
+
+def ring_since(ring, since):
+    # Rows since `since`, or None when the caller should read MySQL instead
+    if ring is None or not ring.live:
+        return None
+    try:
+        return ring.since(since)
+    except (LookupError, RuntimeError) as e:
+        print(f"{e}, reading from the database")
+        return None
@@ -0,0 +1,150 @@
+import os
+import json
+import asyncio
+import pytz
+import pandas as pd
+from bulk_writer import OHLC_COLUMNS, bulk_upsert
+from db_pool import close_pools, get_pool, pool_manager
+from gap_tracker import GapTracker
+from fanout import run_per_symbol
+from instruments import DEFAULT_SYMBOL, configured_symbols
+from market_calendar import market_calendar
+from timeframes import TIMEFRAMES, bucket_ends, bucket_starts, ohlc_table, rollup, timeframe_minutes
+
+# Get the absolute path of the project root
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Reference to config.json
+config_path = os.path.join(project_root, 'config', 'config.json')
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+class BarRollup:
+    # Derives 3m/5m/15m/1h bars from ohlctick_1mdata into ohlctick_<tf>data.
+    # Each timeframe keeps a cursor at the oldest bucket that may still change
+    # (the open bucket, or one holding a 1m gap), so a cycle only re-reads the
+    # 1m bars from that bucket onwards.
+    def __init__(self, config, timeframes=None, symbol=DEFAULT_SYMBOL):
+        self.config = config
+        self.calendar = market_calendar(config)
+        self.symbol = symbol
+        timeframes = timeframes or config.get('timeframes', list(TIMEFRAMES))
+        self.timeframes = [tf for tf in timeframes if timeframe_minutes(tf) > 1]
+        self.cursors = {}
+        self.source_gaps = GapTracker(ohlc_table('1m', symbol), calendar=self.calendar)
+
+    async def get_mysql_pool(self):
+        return await get_pool(self.config)
+
+    async def create_tables_if_not_exists(self, pool):
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for timeframe in self.timeframes:
+                    await cursor.execute(f'''CREATE TABLE IF NOT EXISTS {ohlc_table(timeframe, self.symbol)} (
+                    datetime DATETIME,
+                    open FLOAT,
+                    high FLOAT,
+                    low FLOAT,
+                    close FLOAT,
+                    ohlc4 FLOAT,
+                    PRIMARY KEY (datetime)
+                )''')
+            await conn.commit()
+
+    async def initial_cursor(self, pool, timeframe):
+        # Resume at the last bucket already written; an empty table is rolled
+        # up from the first 1m bar
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f'SELECT MAX(datetime) FROM {ohlc_table(timeframe, self.symbol)}')
+                result = await cur.fetchone()
+                if not result or result[0] is None:
+                    await cur.execute(f"SELECT MIN(datetime) FROM {ohlc_table('1m', self.symbol)}")
+                    result = await cur.fetchone()
+        if not result or result[0] is None:
+            return None
+        return bucket_starts([result[0]], timeframe_minutes(timeframe), self.calendar)[0]
+
+    async def fetch_1m_data(self, pool, since, until):
+        query = f"SELECT * FROM {ohlc_table('1m', self.symbol)} WHERE datetime >= %s AND datetime < %s ORDER BY datetime"
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (since.to_pydatetime(), until.to_pydatetime()))
+                result = await cur.fetchall()
+                columns = [col[0] for col in cur.description]
+        data = pd.DataFrame(result, columns=columns)
+        data['datetime'] = pd.to_datetime(data['datetime'])
+        return data
+
+    async def rollup_once(self, pool):
+        now = pd.Timestamp.now().floor('min')  # every 1m bar before this is closed
+        for timeframe in self.timeframes:
+            if self.cursors.get(timeframe) is None:
+                self.cursors[timeframe] = await self.initial_cursor(pool, timeframe)
+        cursors = [cursor for cursor in self.cursors.values() if cursor is not None]
+        if not cursors:
+            print(f"{self.symbol}: no 1m data to roll up")
+            return
+        await self.source_gaps.refresh(pool)
+        gaps = self.source_gaps.missing_ranges()
+        hold = min(now, gaps[0][0]) if gaps else now
+        data = await self.fetch_1m_data(pool, min(cursors), now)
+
+        for timeframe in self.timeframes:
+            cursor = self.cursors[timeframe]
+            if cursor is None:
+                continue
+            minutes = timeframe_minutes(timeframe)
+            rolled = rollup(data[data['datetime'] >= cursor], minutes, self.calendar)
+            closed = rolled[bucket_ends(rolled['datetime'], minutes, self.calendar) <= now]
+            if not closed.empty:
+                await bulk_upsert(pool, ohlc_table(timeframe, self.symbol), closed, OHLC_COLUMNS)
+            # Buckets still open or holding a 1m gap are derived again next cycle
+            self.cursors[timeframe] = max(cursor, bucket_starts([hold], minutes, self.calendar)[0])
+
+    async def run(self):
+        try:
+            await self.run_loop()
+        finally:
+            await close_pools()
+
+    async def run_loop(self):
+        pool = await self.get_mysql_pool()
+        await self.create_tables_if_not_exists(pool)
+        try:
+            while True:
+                if self.calendar.is_open():
+                    while self.calendar.is_open():
+                        await self.rollup_once(pool)
+                        pool_manager.log_stats()
+                        current_time = pd.Timestamp.now(IST)
+                        period_now = pd.Period.now('1min')
+                        next_period_start = (period_now + 1).start_time.replace(tzinfo=IST)
+                        # After the 1m writers (+2/+3s) have committed the bar
+                        next_execution = (next_period_start + pd.Timedelta(seconds=4))
+                        sleep_duration = (next_execution - current_time).total_seconds()
+                        if sleep_duration > 0 and sleep_duration < 60:
+                            await asyncio.sleep(sleep_duration)
+                    # The last bucket of the day closes with the session
+                    await self.rollup_once(pool)
+                else:
+                    time_until_open = self.calendar.seconds_until_open()
+                    print(f"Market closed. Sleeping for {time_until_open} seconds.")
+                    await asyncio.sleep(time_until_open)
+        except KeyboardInterrupt:
+            print("Process interrupted")
+
+
+async def run_all(config):
+    rollups = [BarRollup(config, symbol=symbol) for symbol in configured_symbols(config)]
+    try:
+        await run_per_symbol(rollups, 'run_loop')
+    finally:
+        await close_pools()
+
+
+if __name__ == "__main__":
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    asyncio.run(run_all(config))
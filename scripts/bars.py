@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from indicators import ROUNDED_COLUMNS
+
+# Compact array-backed bars: the bar's minute as int64 minutes since the epoch
+# (naive exchange time, like the tables), prices and indicator values as
+# float32 and the 0/1 signal columns as int8. A 1m OHLC bar takes 28 bytes and
+# an indicators_data row 88, against several hundred for a DataFrame row with
+# an object datetime column straight from aiomysql.
+#
+# float32 is the storage type of the OHLC tables, and keeps two-decimal values
+# below 131072 distinct and ordered. Columns that hold two-decimal values
+# (prices, the rounded indicators, and Max/Min, which are always a close) are
+# rounded back to two decimals when they are widened again, so to_frame()
+# returns the same float64 values the rows had and comparisons between them
+# come out as they would on the float64 rows. NULL values decode to NaN; a
+# NULL flag is stored as FLAG_NULL and widened back to NaN.
+#
+# Bars support the small part of the DataFrame interface the indicator engine
+# uses (len(), column selection and itertuples()), so fetchers can hand them
+# to it without building a frame.
+
+FLAG_COLUMNS = ('BuyCall', 'BuyPut', 'TrendUp2', 'TrendUp3')
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'ohlc4')
+TWO_DECIMAL_COLUMNS = frozenset(PRICE_COLUMNS) | frozenset(ROUNDED_COLUMNS) | {'Max', 'Min'}
+FLAG_NULL = -1
+SECONDS_PER_MINUTE = 60
+
+
+def _compact(name, values):
+    if name in FLAG_COLUMNS:
+        values = np.asarray(values)
+        if values.dtype == np.int8:
+            return values
+        return np.nan_to_num(values.astype(np.float32), nan=FLAG_NULL).astype(np.int8)
+    return np.asarray(values, dtype=np.float32)
+
+
+def _widen(name, values):
+    if name in FLAG_COLUMNS:
+        if (values == FLAG_NULL).any():
+            return np.where(values == FLAG_NULL, np.nan, values)
+        return values.astype(np.int64)
+    if name in TWO_DECIMAL_COLUMNS:
+        return values.astype(np.float64).round(2)
+    return values.astype(np.float64)
+
+
+def _epoch_minutes(datetimes):
+    seconds = np.asarray(datetimes, dtype='datetime64[s]').astype(np.int64)
+    if (seconds % SECONDS_PER_MINUTE).any():
+        raise ValueError("Bars hold whole minutes only")
+    return seconds // SECONDS_PER_MINUTE
+
+
+class Bars:
+    __slots__ = ('minutes', 'values')
+
+    def __init__(self, minutes, values):
+        self.minutes = np.asarray(minutes, dtype=np.int64)
+        self.values = {name: _compact(name, column) for name, column in values.items()}
+
+    @classmethod
+    def from_rows(cls, rows, columns):
+        # Tuples from a plain cursor or dicts from a DictCursor, in table order
+        if rows and isinstance(rows[0], dict):
+            rows = [tuple(row[column] for column in columns) for row in rows]
+        data = list(zip(*rows)) if rows else [()] * len(columns)
+        position = columns.index('datetime')
+        return cls(_epoch_minutes(data[position]),
+                   {column: data[i] for i, column in enumerate(columns) if i != position})
+
+    @classmethod
+    def from_frame(cls, data):
+        return cls(_epoch_minutes(pd.to_datetime(data['datetime']).to_numpy()),
+                   {column: data[column].to_numpy() for column in data.columns if column != 'datetime'})
+
+    @property
+    def columns(self):
+        return ['datetime'] + list(self.values)
+
+    @property
+    def datetimes(self):
+        return (self.minutes * SECONDS_PER_MINUTE).astype('datetime64[s]').astype('datetime64[ns]')
+
+    @property
+    def nbytes(self):
+        return self.minutes.nbytes + sum(values.nbytes for values in self.values.values())
+
+    @property
+    def empty(self):
+        return len(self.minutes) == 0
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __getitem__(self, key):
+        # A list of column names selects columns, anything else indexes rows
+        if isinstance(key, list):
+            return Bars(self.minutes, {column: self.values[column] for column in key if column != 'datetime'})
+        return Bars(self.minutes[key], {column: values[key] for column, values in self.values.items()})
+
+    def since(self, dt):
+        start = np.searchsorted(self.minutes, _epoch_minutes([pd.Timestamp(dt).floor('min')])[0])
+        return self[start:]
+
+    def tail(self, n):
+        return self[max(len(self) - n, 0):]
+
+    def to_frame(self, compact=False):
+        data = {'datetime': self.datetimes}
+        for column, values in self.values.items():
+            data[column] = values if compact else _widen(column, values)
+        return pd.DataFrame(data)
+
+    def itertuples(self, index=False, name=None):
+        # Rows as (Timestamp, value, ...) tuples with widened values
+        columns = [pd.DatetimeIndex(self.datetimes)] + [_widen(column, values).tolist()
+                                                        for column, values in self.values.items()]
+        return zip(*columns)
+
+    @staticmethod
+    def concat(parts):
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return Bars([], {})
+        return Bars(np.concatenate([part.minutes for part in parts]),
+                    {column: np.concatenate([part.values[column] for part in parts]) for column in parts[0].values})
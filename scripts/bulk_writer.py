@@ -0,0 +1,44 @@
+import time
+import pandas as pd
+
+OHLC_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'ohlc4']
+
+
+def frame_to_rows(data, columns):
+    # Vectorized NaN -> NULL and NumPy -> Python scalar conversion, instead of a
+    # per-cell pd.isna check over to_numpy()/to_dict() output.
+    values = data[columns].astype(object)
+    values = values.where(data[columns].notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+
+def upsert_query(table_name, columns, num_rows, key_columns=('datetime',)):
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    updates = ', '.join(f'`{col}` = VALUES(`{col}`)' for col in columns if col not in key_columns)
+    return (f"INSERT INTO `{table_name}` ({', '.join(f'`{col}`' for col in columns)}) "
+            f"VALUES {', '.join([placeholders] * num_rows)} "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+async def bulk_upsert(pool, table_name, data, columns=None, key_columns=('datetime',), chunk_size=1000):
+    # Multi-row INSERT ... ON DUPLICATE KEY UPDATE in bounded chunks. Unlike
+    # REPLACE this updates rows in place rather than delete + insert.
+    columns = list(columns or data.columns)
+    rows = frame_to_rows(data, columns) if isinstance(data, pd.DataFrame) else list(data)
+    if not rows:
+        return 0
+
+    start = time.monotonic()
+    batches = 0
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            for offset in range(0, len(rows), chunk_size):
+                chunk = rows[offset:offset + chunk_size]
+                args = [value for row in chunk for value in row]
+                await cur.execute(upsert_query(table_name, columns, len(chunk), key_columns), args)
+                batches += 1
+        await conn.commit()
+    elapsed = time.monotonic() - start
+    rate = len(rows) / elapsed if elapsed > 0 else float('inf')
+    print(f"Upserted {len(rows)} rows into {table_name} in {batches} batch(es), {rate:.0f} rows/s")
+    return len(rows)
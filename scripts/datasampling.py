@@ -1,12 +1,20 @@
 import os
 import json
 import asyncio
-import aiomysql
+from time import monotonic
 import pytz
 import pandas as pd
-import numpy as np
-from datetime import datetime, time, timedelta
+from datetime import datetime
 from breeze_connect import BreezeConnect
+from metrics import LatencyHistogram
+from bulk_writer import OHLC_COLUMNS, bulk_upsert
+from bar_aggregator import MinuteBarAggregator
+from bar_ring import create_ring
+from bars import Bars
+from db_pool import close_pools, get_pool
+from instruments import configured_symbols, feed_code, instrument, table_name
+from market_calendar import market_calendar
+from timeframes import ohlc_table
 
 # Get the absolute path of the project root
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,30 +26,35 @@ IST = pytz.timezone('Asia/Kolkata')
 
 
 class Get1Mtickdata:
-    def __init__(self, config):
+    def __init__(self, config, api=None, symbols=None):
         self.config = config
-        self.api = BreezeConnect(api_key=config['api_key'])
-        self.api.generate_session(
-            api_secret=config['secret_key'], session_token=config['api_session'])
+        self.calendar = market_calendar(config)
+        self.symbols = list(symbols or configured_symbols(config))
+        self.instruments = {symbol: instrument(config, symbol) for symbol in self.symbols}
+        self.feed_symbols = {feed_code(inst): symbol for symbol, inst in self.instruments.items()}
+        if api is None:
+            api = BreezeConnect(api_key=config['api_key'])
+            api.generate_session(
+                api_secret=config['secret_key'], session_token=config['api_session'])
+        self.api = api
+        self.pool = None
+        self.loop = None
+        self.tick_queue = None
+        self.resamplers = {}
+        self.rings = {}
+        self.commit_latency = {symbol: LatencyHistogram(f'{symbol} tick_to_commit') for symbol in self.symbols}
         # self.default_expiry_date = config.get('default_expiry_date', '2024-09-04')
 
     async def get_mysql_pool(self):
-        db_config = self.config['db_config']
-        pool = await aiomysql.create_pool(
-            host=db_config['host'],
-            port=int(db_config['port']),
-            user=db_config['user'],
-            password=db_config['password'],
-            db=db_config['database'],
-            autocommit=True,
-            minsize=5,
-            maxsize=20
-        )
-        return pool
+        return await get_pool(self.config)
 
     async def create_tables_if_not_exists(self, pool):
-        create_1s_table_query = '''
-            CREATE TABLE IF NOT EXISTS ohlctick_1sdata (
+        for symbol in self.symbols:
+            await self.create_symbol_tables(pool, symbol)
+
+    async def create_symbol_tables(self, pool, symbol):
+        create_1s_table_query = f'''
+            CREATE TABLE IF NOT EXISTS {table_name('ohlctick_1sdata', symbol)} (
                 datetime DATETIME,
                 open FLOAT,
                 high FLOAT,
@@ -51,8 +64,8 @@ class Get1Mtickdata:
                 PRIMARY KEY (datetime)
             )
         '''
-        create_1m_table_query = '''
-            CREATE TABLE IF NOT EXISTS ohlctick_1mdata (
+        create_1m_table_query = f'''
+            CREATE TABLE IF NOT EXISTS {ohlc_table('1m', symbol)} (
                 datetime DATETIME,
                 open FLOAT,
                 high FLOAT,
@@ -74,152 +87,211 @@ class Get1Mtickdata:
 
     async def insert_tick_dataframe(self, pool, table_name, tick_df):
         try:
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    insert_query = f'''
-                        REPLACE INTO {table_name} (datetime, open, high, low, close, ohlc4)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    '''
-                    records = tick_df.to_dict(orient='records')
-                    for record in records:
-                        datetime_value = record['datetime']
-                        if isinstance(datetime_value, str):
-                            datetime_value = pd.to_datetime(
-                                datetime_value, errors='coerce')
-                        await cur.execute(insert_query, (
-                            datetime_value, record['open'], record['high'],
-                            record['low'], record['close'], record['ohlc4']
-                        ))
-                await conn.commit()
+            tick_df = tick_df.assign(datetime=pd.to_datetime(tick_df['datetime'], errors='coerce'))
+            await bulk_upsert(pool, table_name, tick_df, OHLC_COLUMNS)
         except Exception as e:
             print(f"Error inserting data into {table_name} table: {e}")
             raise
 
+    async def resample_start(self, pool, symbol, session_open, session_close):
+        # Catch-up after a restart starts at the last 1m bar already written
+        # today (it may have closed with seconds still missing), else at the open
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"SELECT MAX(datetime) FROM {ohlc_table('1m', symbol)} "
+                    "WHERE datetime >= %s AND datetime < %s",
+                    (session_open.to_pydatetime(), session_close.to_pydatetime()))
+                result = await cur.fetchone()
+        last_written = result[0] if result else None
+        return pd.Timestamp(last_written) if last_written is not None else session_open
+
+    async def fetch_1s_data_since(self, pool, symbol, since, until, inclusive):
+        op = '>=' if inclusive else '>'
+        query = (f"SELECT * FROM {table_name('ohlctick_1sdata', symbol)} "
+                 f"WHERE datetime {op} %s AND datetime < %s ORDER BY datetime")
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (since.to_pydatetime(), until.to_pydatetime()))
+                data = await cur.fetchall()
+                columns = [desc[0] for desc in cur.description]
+        ohlc_1s_df = pd.DataFrame(data, columns=columns)
+        ohlc_1s_df['datetime'] = pd.to_datetime(ohlc_1s_df['datetime'], errors='coerce')
+        return ohlc_1s_df
+
     async def fetch_and_resample_data(self, pool):
+        # Folds ohlctick_1sdata into the 1m table. Opt-in ("resample_1s": true in
+        # config.json) for deployments where something records 1s bars; the
+        # Breeze feed here subscribes to 1-minute candles and writes them directly
+        await asyncio.gather(*(self.resample_symbol(pool, symbol) for symbol in self.symbols))
+
+    async def resample_symbol(self, pool, symbol):
         try:
-            now = datetime.now(IST)
-            market_open_time = datetime.combine(now.date(), time(9, 15))
-            market_close_time = datetime.combine(now.date(), time(15, 30))
-            period_now = pd.Period.now('1min')
-            open_time_datetime64 = pd.Period(
-                market_open_time, '1min').start_time
-            close_time_datetime64 = pd.Period(
-                market_close_time, '1min').end_time
-            period_now_datetime64 = period_now.start_time
-            min_datetime = min(close_time_datetime64, period_now_datetime64)
+            resampler = self.resamplers.get(symbol)
+            period_now = pd.Period.now('1min').start_time
+            session = self.calendar.session(period_now)
+            if session is None:
+                return
+            session_open, session_close = session
+            if resampler is None or resampler.bar.start.date() != period_now.date():
+                start = await self.resample_start(pool, symbol, session_open, session_close)
+                resampler = self.resamplers[symbol] = MinuteBarAggregator(self.calendar)
+                resampler.start_at(start)
+                ohlc_1s_df = await self.fetch_1s_data_since(pool, symbol, start, session_close, inclusive=True)
+            else:
+                since = resampler.last_tick or resampler.bar.start
+                inclusive = resampler.last_tick is None
+                ohlc_1s_df = await self.fetch_1s_data_since(pool, symbol, since, session_close, inclusive)
 
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    query = 'SELECT * FROM ohlctick_1sdata ORDER BY datetime'
-                    await cur.execute(query)
-                    data = await cur.fetchall()
-                    columns = [desc[0] for desc in cur.description]
-
-                    ohlc_1s_df = pd.DataFrame(data, columns=columns)
-                    ohlc_1s_df['datetime'] = pd.to_datetime(
-                        ohlc_1s_df['datetime'], errors='coerce')
-                    ohlc_1s_df.set_index('datetime', inplace=True)
-
-                    period_index = pd.date_range(start=open_time_datetime64, end=min_datetime, freq='s')
-                    ohlc_1s_df = ohlc_1s_df.reindex(period_index)
-
-                    ohlc_dict = {
-                        'open': 'first',
-                        'high': 'max',
-                        'low': 'min',
-                        'close': 'last',
-                        'ohlc4': 'mean'
-                    }
-
-                    ohlc_1m_df = ohlc_1s_df.resample(
-                        '1min', closed='left', label='left').agg(ohlc_dict).reset_index()
-                    ohlc_1m_df.fillna({
-                        'open': 0.0,
-                        'high': 0.0,
-                        'low': 0.0,
-                        'close': 0.0,
-                        'ohlc4': 0.0
-                    }, inplace=True)
-                    ohlc_1m_df.rename(
-                        columns={'index': 'datetime'}, inplace=True)
-                    ohlc_1m_df['ohlc4'] = ohlc_1m_df['ohlc4'].round(2)
-                    two_rows = ohlc_1m_df.tail(2)
-                    await self.insert_tick_dataframe(pool, 'ohlctick_1mdata', two_rows)
+            closed = resampler.add_frame(ohlc_1s_df)
+            closed.extend(resampler.advance(min(period_now, session_close)))
+            if closed:
+                bars_df = MinuteBarAggregator.to_frame(closed)
+                self.publish(symbol, bars_df)
+                await self.insert_tick_dataframe(pool, ohlc_table('1m', symbol), bars_df)
         except Exception as e:
-            print(f"Error fetching and resampling data: {e}")
+            print(f"Error fetching and resampling data for {symbol}: {e}")
+
+    def build_tick_dataframe(self, tick):
+        if isinstance(tick, dict):
+            tick = [tick]
+        tick_df = pd.DataFrame(tick)
+        if 'datetime' in tick_df.columns:
+            tick_df['datetime'] = pd.to_datetime(
+                tick_df['datetime'], errors='coerce')
+        else:
+            raise ValueError(
+                "'datetime' column is missing in the tick data")
+
+        for col in ['open', 'high', 'low', 'close']:
+            tick_df[col] = pd.to_numeric(tick_df[col], errors='coerce')
+
+        if all(col in tick_df.columns for col in ['open', 'high', 'low', 'close']):
+            tick_df['ohlc4'] = (
+                tick_df['open'] + tick_df['high'] + tick_df['low'] + tick_df['close']) / 4
+            tick_df['ohlc4'] = tick_df['ohlc4'].round(2)
+            selected_columns = ['datetime', 'open',
+                                'high', 'low', 'close', 'ohlc4']
+            return tick_df[selected_columns]
+        print("Error: Missing required columns in tick data")
+        return None
+
+    def symbol_for(self, tick):
+        # Ticks for every subscribed index arrive on one websocket
+        if len(self.symbols) == 1:
+            return self.symbols[0]
+        first = tick[0] if isinstance(tick, list) and tick else tick
+        return self.feed_symbols.get(first.get('stock_code')) if isinstance(first, dict) else None
 
     async def on_ticks(self, tick):
         try:
-            if isinstance(tick, dict):
-                tick = [tick]
-            tick_df = pd.DataFrame(tick)
-            if 'datetime' in tick_df.columns:
-                tick_df['datetime'] = pd.to_datetime(
-                    tick_df['datetime'], errors='coerce')
-            else:
-                raise ValueError(
-                    "'datetime' column is missing in the tick data")
-
-            for col in ['open', 'high', 'low', 'close']:
-                tick_df[col] = pd.to_numeric(tick_df[col], errors='coerce')
-
-            if all(col in tick_df.columns for col in ['open', 'high', 'low', 'close']):
-                tick_df['ohlc4'] = (
-                    tick_df['open'] + tick_df['high'] + tick_df['low'] + tick_df['close']) / 4
-                tick_df['ohlc4'] = tick_df['ohlc4'].round(2)
-                selected_columns = ['datetime', 'open',
-                                    'high', 'low', 'close', 'ohlc4']
-                tick_df = tick_df[selected_columns]
-                pool = await self.get_mysql_pool()
-                await self.insert_tick_dataframe(pool, 'ohlctick_1mdata', tick_df)
-                pool.close()
-                await pool.wait_closed()
-            else:
-                print("Error: Missing required columns in tick data")
+            symbol = self.symbol_for(tick)
+            tick_df = self.build_tick_dataframe(tick)
+            if symbol is not None and tick_df is not None:
+                await self.insert_tick_dataframe(self.pool, ohlc_table('1m', symbol), tick_df)
         except Exception as e:
             print(f"Error processing tick data: {e}")
 
     def async_on_ticks(self, tick):
-        asyncio.run(self.on_ticks(tick))
+        # Runs on the Breeze websocket thread: hand the tick to the long-running
+        # loop instead of spinning up a loop and a pool per tick.
+        if self.loop is None or self.tick_queue is None:
+            print("Tick received before the tick writer started, dropping it")
+            return
+        self.loop.call_soon_threadsafe(self.tick_queue.put_nowait, (tick, monotonic()))
+
+    async def tick_writer(self, pool, max_batch=500):
+        while True:
+            batch = [await self.tick_queue.get()]
+            while len(batch) < max_batch and not self.tick_queue.empty():
+                batch.append(self.tick_queue.get_nowait())
+            try:
+                by_symbol = {}
+                for tick, received in batch:
+                    symbol = self.symbol_for(tick)
+                    if symbol is None:
+                        print(f"Tick for an unsubscribed instrument, dropping it: {tick}")
+                        continue
+                    by_symbol.setdefault(symbol, []).append((tick, received))
+                await asyncio.gather(*(self.write_symbol_ticks(pool, symbol, ticks)
+                                       for symbol, ticks in by_symbol.items()))
+            except Exception as e:
+                print(f"Error processing tick data: {e}")
+            finally:
+                for _ in batch:
+                    self.tick_queue.task_done()
+
+    async def write_symbol_ticks(self, pool, symbol, ticks):
+        frames = [self.build_tick_dataframe(tick) for tick, _ in ticks]
+        frames = [frame for frame in frames if frame is not None]
+        if not frames:
+            return
+        tick_df = pd.concat(frames, ignore_index=True).drop_duplicates(
+            subset='datetime', keep='last')
+        self.publish(symbol, tick_df)
+        await self.insert_tick_dataframe(pool, ohlc_table('1m', symbol), tick_df)
+        committed = monotonic()
+        for _, received in ticks:
+            self.commit_latency[symbol].observe(committed - received)
+        print(f"Committed {len(tick_df)} bars from {len(ticks)} ticks; {self.commit_latency[symbol].summary()}")
+
+    def open_rings(self):
+        # Shared-memory copies of the newest 1m bars for indicator_update.py;
+        # only the live feed process writes them
+        for symbol in self.symbols:
+            ring = create_ring(self.config, 'ohlc', symbol, OHLC_COLUMNS)
+            if ring is not None:
+                self.rings[symbol] = ring
 
-    async def connect_to_websocket(self):
+    def publish(self, symbol, tick_df):
+        ring = self.rings.get(symbol)
+        if ring is None:
+            return
+        try:
+            ring.write(Bars.from_frame(tick_df.dropna(subset=['datetime']).sort_values('datetime')))
+        except Exception as e:
+            print(f"Error publishing {symbol} bars to the ring buffer: {e}")
+
+    def close_rings(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+    async def connect_to_websocket(self, on_ticks=None):
         print("Connecting to WebSocket...")
         self.api.ws_connect()
-        self.api.on_ticks = self.async_on_ticks
-        self.api.subscribe_feeds(
-            stock_token='4.1!NIFTY BANK', interval="1minute")
-        print("Subscribed to data feed")
+        self.api.on_ticks = on_ticks or self.async_on_ticks
+        for inst in self.instruments.values():
+            self.api.subscribe_feeds(
+                stock_token=inst['feed_token'], interval="1minute")
+        print(f"Subscribed to data feed for {', '.join(self.symbols)}")
 
     async def disconnect_from_websocket(self):
         print("Unsubscribing from data feed...")
-        self.api.unsubscribe_feeds(
-            stock_token='4.1!NIFTY BANK', interval="1minute")
+        for inst in self.instruments.values():
+            self.api.unsubscribe_feeds(
+                stock_token=inst['feed_token'], interval="1minute")
         disconnected = self.api.ws_disconnect()
         if disconnected:
             print("WebSocket disconnected")
         else:
             print("Error disconnecting WebSocket")
 
-    def is_business_day(self, date):
-        return np.is_busday(date.date())
-
-    def is_market_open(self):
-        # now = pd.Timestamp.now(IST)
-        now = datetime.now(IST)
-        market_open_time = datetime.combine(now.date(), time(9, 15)).replace(tzinfo=IST)
-        market_close_time = datetime.combine(now.date(), time(15, 30)).replace(tzinfo=IST)
-        return market_open_time <= now <= market_close_time
-
     async def run(self):
         pool = await self.get_mysql_pool()
+        self.pool = pool
         await self.create_tables_if_not_exists(pool)
+        self.loop = asyncio.get_running_loop()
+        self.tick_queue = asyncio.Queue()
+        self.open_rings()
+        writer = asyncio.create_task(self.tick_writer(pool))
         try:
             while True:
-                now = datetime.now(IST)
-                if self.is_market_open() and self.is_business_day(now):
+                if self.calendar.is_open():
                     await self.connect_to_websocket()
-                    while self.is_market_open():
-                        # await self.fetch_and_resample_data(pool)
+                    while self.calendar.is_open():
+                        if self.config.get('resample_1s'):
+                            await self.fetch_and_resample_data(pool)
                         # current_time = pd.Timestamp.now(IST)
                         current_time = datetime.now(IST)
                         period_now = pd.Period.now('1min')
@@ -231,19 +303,17 @@ class Get1Mtickdata:
                             await asyncio.sleep(sleep_duration)
                     await self.disconnect_from_websocket()
                 else:
-                    now = datetime.now(IST)
-                    next_market_open = (
-                        now + timedelta(days=1)).replace(hour=9, minute=15, second=0, microsecond=0)
-                    # sleep_duration = (next_market_open - now).total_seconds()
-                    time_until_open = (next_market_open - now).total_seconds()
+                    time_until_open = self.calendar.seconds_until_open()
                     print(
                         f"Market closed. Sleeping for {time_until_open} seconds.")
                     await asyncio.sleep(time_until_open)
         except Exception as e:
             print(f"Error in run loop: {e}")
         finally:
-            pool.close()
-            await pool.wait_closed()
+            await self.tick_queue.join()
+            writer.cancel()
+            self.close_rings()
+            await close_pools()
 
 if __name__ == "__main__":
     with open(config_path, 'r') as f:
@@ -0,0 +1,162 @@
+import os
+import ssl
+import time
+import asyncio
+import aiomysql
+from metrics import LatencyHistogram
+
+# Get the absolute path of the project root
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+config_dir = os.path.join(project_root, 'config')
+
+# One long-lived aiomysql pool per config section ('db_config' for the local
+# database, 'mysql_config' for Azure with SSL), created lazily and shared by
+# every class in the process. Pool sizing comes from the section itself:
+#   "pool_minsize": 5, "pool_maxsize": 20, "pool_recycle": 3600,
+#   "health_check_interval": 60
+
+
+class TrackedPool:
+    def __init__(self, name, pool, health_check_interval):
+        self.name = name
+        self.pool = pool
+        self.health_check_interval = health_check_interval
+        self.acquire_latency = LatencyHistogram(f'{name}.acquire')
+        self.waits = 0
+        self.last_checked = time.monotonic()
+
+    def acquire(self):
+        return _TrackedAcquire(self)
+
+    @property
+    def in_use(self):
+        return self.pool.size - self.pool.freesize
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'size': self.pool.size,
+            'in_use': self.in_use,
+            'free': self.pool.freesize,
+            'maxsize': self.pool.maxsize,
+            'waits': self.waits,
+            'acquire_p95_ms': self.acquire_latency.percentile(95),
+        }
+
+    def summary(self):
+        return (f"pool {self.name}: size={self.pool.size}/{self.pool.maxsize} in_use={self.in_use} "
+                f"waits={self.waits} {self.acquire_latency.summary()}")
+
+
+class _TrackedAcquire:
+    def __init__(self, tracked):
+        self.tracked = tracked
+        self.conn = None
+
+    async def __aenter__(self):
+        pool = self.tracked.pool
+        if pool.freesize == 0 and pool.size >= pool.maxsize:
+            self.tracked.waits += 1
+        start = time.monotonic()
+        self.conn = await pool.acquire()
+        self.tracked.acquire_latency.observe(time.monotonic() - start)
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.tracked.pool.release(self.conn)
+        return False
+
+
+def ssl_context(ssl_config):
+    if not ssl_config:
+        return None
+    ca = ssl_config.get('ca')
+    if ca and not os.path.isabs(ca) and os.path.exists(os.path.join(config_dir, ca)):
+        ca = os.path.join(config_dir, ca)
+    context = ssl.create_default_context(cafile=ca)
+    if not ssl_config.get('verify_cert', True):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class PoolManager:
+    def __init__(self):
+        self.pools = {}
+        self.loop = None
+        self.lock = None
+
+    async def get_pool(self, config, name='db_config'):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Pools are bound to the loop that created them
+            self.pools = {}
+            self.loop = loop
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            tracked = self.pools.get(name)
+            if tracked is not None and time.monotonic() - tracked.last_checked > tracked.health_check_interval:
+                if not await self.health_check(tracked):
+                    print(f"Pool {name} failed its health check, recreating it")
+                    await self.close_pool(name)
+                    tracked = None
+            if tracked is None:
+                tracked = await self.create_pool(config, name)
+                self.pools[name] = tracked
+            return tracked
+
+    async def create_pool(self, config, name):
+        db_config = config[name]
+        pool = await aiomysql.create_pool(
+            host=db_config['host'],
+            port=int(db_config['port']),
+            user=db_config['user'],
+            password=db_config['password'],
+            db=db_config['database'],
+            autocommit=True,
+            minsize=int(db_config.get('pool_minsize', 5)),
+            maxsize=int(db_config.get('pool_maxsize', 20)),
+            pool_recycle=int(db_config.get('pool_recycle', 3600)),
+            ssl=ssl_context(db_config.get('ssl'))
+        )
+        print(f"Created MySQL pool {name} ({db_config['host']}/{db_config['database']})")
+        return TrackedPool(name, pool, float(db_config.get('health_check_interval', 60)))
+
+    async def health_check(self, tracked):
+        try:
+            async with tracked.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute('SELECT 1')
+                    await cur.fetchone()
+            tracked.last_checked = time.monotonic()
+            return True
+        except Exception as e:
+            print(f"Health check failed for pool {tracked.name}: {e}")
+            return False
+
+    async def close_pool(self, name):
+        tracked = self.pools.pop(name, None)
+        if tracked is not None:
+            print(tracked.summary())
+            tracked.pool.close()
+            await tracked.pool.wait_closed()
+
+    async def close_all(self):
+        for name in list(self.pools):
+            await self.close_pool(name)
+
+    def log_stats(self):
+        for tracked in self.pools.values():
+            print(tracked.summary())
+
+
+pool_manager = PoolManager()
+
+
+async def get_pool(config, name='db_config'):
+    return await pool_manager.get_pool(config, name)
+
+
+async def close_pools():
+    await pool_manager.close_all()
@@ -0,0 +1,131 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from metrics import LatencyHistogram
+
+# Blocking client calls (TvDatafeed.get_hist, BreezeConnect.place_order) run on
+# a dedicated thread pool per client so they never stall the event loop.
+# Every call is bounded by a timeout and a concurrency limit, retried with
+# exponential backoff and jitter, and timed into a per-call latency histogram.
+#
+# A timed-out call cannot be interrupted: its thread keeps running until the
+# client returns, and it keeps its concurrency slot until then, so retries and
+# new calls wait for a slot instead of piling up behind a hung worker. The
+# summary counts such calls while they are still running.
+
+DEFAULTS = {
+    'tvdatafeed': {'max_workers': 4, 'max_concurrency': 3, 'timeout': 30, 'retries': 2, 'backoff': 1.0},
+    # Orders are not retried: a timed-out place_order may still have gone through
+    'breeze': {'max_workers': 2, 'max_concurrency': 2, 'timeout': 10, 'retries': 0, 'backoff': 0.5},
+}
+
+
+class CallRejected(Exception):
+    pass
+
+
+class BlockingExecutor:
+    def __init__(self, name, max_workers=4, max_concurrency=None, timeout=30,
+                 retries=0, backoff=0.5, max_backoff=8.0):
+        self.name = name
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.max_concurrency = max_concurrency or max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.semaphore = None
+        self.latency = {}
+        self.failures = {}
+        self.abandoned = {}  # future of a timed-out call still running -> call name
+
+    def histogram(self, call_name):
+        if call_name not in self.latency:
+            self.latency[call_name] = LatencyHistogram(f'{self.name}.{call_name}')
+        return self.latency[call_name]
+
+    def finished(self, future):
+        # On the loop once the worker thread is done with the call
+        self.abandoned.pop(future, None)
+        self.semaphore.release()
+
+    def submit(self, loop, func):
+        # Takes a slot that is only given back when the thread returns
+        future = self.pool.submit(func)
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(self.finished, future)
+            except RuntimeError:
+                pass  # the loop has already closed
+
+        future.add_done_callback(done)
+        return future
+
+    def backoff_delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def call(self, func, *args, call_name=None, timeout=None, retries=None, accept=None, **kwargs):
+        # accept(result) -> False treats a returned value (e.g. None from
+        # get_hist) as a failure worth retrying
+        call_name = call_name or getattr(func, '__name__', 'call')
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        last_error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = self.backoff_delay(attempt - 1)
+                print(f"{self.name}.{call_name} failed ({last_error!r}), retry {attempt}/{retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            await self.semaphore.acquire()
+            try:
+                future = self.submit(loop, partial(func, *args, **kwargs))
+            except BaseException:
+                self.semaphore.release()
+                raise
+            try:
+                with self.histogram(call_name).time():
+                    result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+                if accept is not None and not accept(result):
+                    raise CallRejected(f"{call_name} returned {type(result).__name__}")
+                return result
+            except Exception as e:
+                if not future.done():
+                    self.abandoned[future] = call_name
+                self.failures[call_name] = self.failures.get(call_name, 0) + 1
+                last_error = e
+        raise last_error
+
+    def summary(self):
+        parts = [histogram.summary() for histogram in self.latency.values()]
+        parts += [f"{self.name}.{name}: {count} failed" for name, count in self.failures.items()]
+        running = {}
+        for name in self.abandoned.values():
+            running[name] = running.get(name, 0) + 1
+        parts += [f"{self.name}.{name}: {count} timed out, still running" for name, count in running.items()]
+        return '; '.join(parts) or f"{self.name}: no calls"
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+_executors = {}
+
+
+def get_executor(config, name):
+    # One executor per client name, configured from config["executors"][name]
+    if name not in _executors:
+        settings = {**DEFAULTS.get(name, {}), **config.get('executors', {}).get(name, {})}
+        _executors[name] = BlockingExecutor(name, **settings)
+    return _executors[name]
+
+
+def shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
@@ -0,0 +1,13 @@
+import asyncio
+
+# Runs one worker per symbol on the same event loop.
+
+
+async def run_per_symbol(workers, method):
+    # One failing symbol is reported without cancelling the others
+    results = await asyncio.gather(
+        *(getattr(worker, method)() for worker in workers), return_exceptions=True)
+    for worker, result in zip(workers, results):
+        if isinstance(result, Exception):
+            print(f"{worker.symbol}: {method} failed: {result}")
+    return results
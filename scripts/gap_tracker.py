@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+from market_calendar import SESSION_MINUTES, SESSION_OPEN
+
+OHLC_VALUE_COLUMNS = ['open', 'high', 'low', 'close', 'ohlc4']
+
+# Replaces the per-minute WITH RECURSIVE gap query with one bit per session
+# minute. The bitmap is seeded with a single range query and afterwards only the
+# minutes from the first gap onwards are re-read, so the cost stays flat as the
+# day progresses.
+
+
+def last_closed_minute(now=None):
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    return now.floor('min') - pd.Timedelta(minutes=1)
+
+
+def valid_rows(data):
+    # Same rule as the old query: a bar is bad when the first non-null price is 0
+    first_value = data[OHLC_VALUE_COLUMNS].bfill(axis=1).iloc[:, 0]
+    return (first_value.fillna(0) != 0).to_numpy()
+
+
+class SessionBitmap:
+    def __init__(self, session_date, minutes=SESSION_MINUTES, slot_minutes=1, open_time=SESSION_OPEN):
+        # One slot per bar; higher timeframes use slot_minutes > 1 and the last
+        # slot may be shorter than the rest
+        self.session_date = session_date
+        self.open = pd.Timestamp.combine(session_date, open_time)
+        self.minutes = minutes
+        self.slot_size = pd.Timedelta(minutes=slot_minutes)
+        self.valid = np.zeros(-(-minutes // slot_minutes), dtype=bool)
+
+    @property
+    def close(self):
+        return self.open + pd.Timedelta(minutes=self.minutes)
+
+    def slot(self, dt):
+        return int((pd.Timestamp(dt) - self.open) // self.slot_size)
+
+    def slot_start(self, slot):
+        return self.open + slot * self.slot_size
+
+    def mark(self, datetimes, valid):
+        offsets = (pd.DatetimeIndex(datetimes) - self.open) // self.slot_size
+        offsets = np.asarray(offsets, dtype=np.int64)
+        valid = np.asarray(valid, dtype=bool)
+        in_session = (offsets >= 0) & (offsets < len(self.valid))
+        self.valid[offsets[in_session]] = valid[in_session]
+
+    def first_invalid(self):
+        # Start of the first slot without a good bar, or the session close
+        invalid = np.flatnonzero(~self.valid)
+        return self.slot_start(int(invalid[0])) if len(invalid) else self.close
+
+    def missing_ranges(self, until):
+        # Inclusive (start, end) bar ranges of missing or zero bars whose slot
+        # has fully closed by the end of minute `until`
+        next_minute = pd.Timestamp(until) + pd.Timedelta(minutes=1)
+        last = len(self.valid) - 1 if next_minute >= self.close else self.slot(next_minute) - 1
+        if last < 0:
+            return []
+        missing = ~self.valid[:last + 1]
+        edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+        return [(self.slot_start(int(start)), self.slot_start(int(end)))
+                for start, end in zip(starts, ends)]
+
+    def num_missing(self, until):
+        return sum(int((end - start) // self.slot_size) + 1
+                   for start, end in self.missing_ranges(until))
+
+
+class GapTracker:
+    def __init__(self, table_name, slot_minutes=1, calendar=None):
+        self.table_name = table_name
+        self.slot_minutes = slot_minutes
+        self.calendar = calendar
+        self.bitmap = None
+
+    async def refresh(self, pool, now=None):
+        session_date = (pd.Timestamp.now() if now is None else pd.Timestamp(now)).date()
+        if self.bitmap is None or self.bitmap.session_date != session_date:
+            self.bitmap = self.session_bitmap(session_date)
+        # Bars before the first gap are already known good; only re-read the rest
+        start = self.bitmap.first_invalid()
+        if start >= self.bitmap.close:
+            return
+        query = f'''
+            SELECT datetime, open, high, low, close, ohlc4 FROM {self.table_name}
+            WHERE datetime >= %s AND datetime < %s
+        '''
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (start.to_pydatetime(), self.bitmap.close.to_pydatetime()))
+                rows = await cur.fetchall()
+        if rows:
+            self.record(pd.DataFrame(rows, columns=['datetime'] + OHLC_VALUE_COLUMNS))
+
+    def session_bitmap(self, session_date):
+        # Special sessions (muhurat etc.) get their own hours from the calendar
+        session = self.calendar.session(session_date) if self.calendar is not None else None
+        if session is None:
+            return SessionBitmap(session_date, slot_minutes=self.slot_minutes)
+        open_time, close_time = session
+        return SessionBitmap(session_date, int((close_time - open_time) // pd.Timedelta(minutes=1)),
+                             self.slot_minutes, open_time.time())
+
+    def record(self, data):
+        # Called with every frame written to the table
+        if self.bitmap is None or data.empty:
+            return
+        self.bitmap.mark(pd.to_datetime(data['datetime']), valid_rows(data))
+
+    def missing_ranges(self, until=None):
+        if self.bitmap is None:
+            return []
+        return self.bitmap.missing_ranges(last_closed_minute() if until is None else until)
+
+    def missing_slots(self, until=None):
+        # Start of every missing slot, for comparing one refresh with the next
+        return {start + i * self.bitmap.slot_size
+                for start, end in self.missing_ranges(until)
+                for i in range(int((end - start) // self.bitmap.slot_size) + 1)}
+
+    def num_missing(self, until=None):
+        if self.bitmap is None:
+            return 0
+        return self.bitmap.num_missing(last_closed_minute() if until is None else until)
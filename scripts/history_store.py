@@ -0,0 +1,395 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import asyncio
+from contextlib import asynccontextmanager
+import aiomysql
+import numpy as np
+import pandas as pd
+from db_pool import close_pools, get_pool
+from instruments import DEFAULT_SYMBOL
+from timeframes import indicator_table, ohlc_table
+
+# Local columnar copy of the OHLC and indicator tables, one directory per
+# trading day and one .npy file per column:
+#
+#   <path>/<table>/<YYYY-MM-DD>/datetime.npy, open.npy, ...
+#
+# Enabled by a "history_store" section in config.json ({"path": "data/history"},
+# relative to the project root). sync() streams rows from MySQL with a
+# server-side cursor, starting at the last stored day because that day may
+# still be filling up; older days are written once and never refetched unless
+# sync(since=...) asks for them (e.g. after a backfill). Fetched days are
+# staged in temporary directories next to their final place and swapped in
+# together once the fetch is done, so readers never see half a sync.
+#
+# Staleness: sync() only refetches from the last stored day, so the store
+# never notices a change to an older day by itself. Anything that rewrites
+# older rows (tvdata.py's full refetch, indicatordata_all.py's recompute and
+# backfill) calls invalidate_history(config, table, since); the next sync() of
+# that table refetches from `since` and drops stored days that no longer have
+# rows. Invalidation is a marker file, so writers need neither the store's lock
+# nor a connection.
+#
+# Opening thousands of small files costs more than reading them, so every day
+# before the last is also compacted into one .npy per column
+# (<table>/compact-*/, named by compact.json). load() maps the compacted
+# columns copy-on-write: a range inside them comes back as a DataFrame over
+# the mapping without copying, while a range that reaches the uncompacted
+# days (normally just the last one) is concatenated into one copy. Either way
+# years of bars open in milliseconds.
+#
+# Several processes sync the same table (both strategies, peaks.py). Two
+# flocks keep them apart without making readers wait on MySQL:
+#
+#   <table>/.sync.lock  exclusive for a whole sync(), so syncs run one at a
+#                       time; load() never takes it
+#   <table>/.lock       exclusive only while a sync swaps its staged days and
+#                       compacted generation in, shared while load() resolves
+#                       and opens the files
+#
+# Both are polled without blocking, so a strategy waiting for a lock keeps its
+# event loop running. A compacted generation is only deleted under the
+# exclusive .lock, so a reader that has opened it keeps a valid mapping.
+#
+# Integer columns stay int64 unless a day holds NULLs, in which case that day
+# is float64 and the concatenation upcasts, the same as a DataFrame built from
+# the MySQL rows.
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+config_path = os.path.join(project_root, 'config', 'config.json')
+
+FETCH_BATCH = 10000
+LOCK_POLL = 0.05
+
+
+def _column_array(values):
+    if values.dtype == object:
+        values = pd.to_numeric(values, errors='coerce')
+    if values.dtype == bool:
+        values = values.astype('int64')
+    return values.to_numpy()
+
+
+@asynccontextmanager
+async def _flock(path, name, operation):
+    # Polls instead of blocking so the event loop keeps running meanwhile
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, name), 'a') as f:
+        while True:
+            try:
+                fcntl.flock(f, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class HistoryStore:
+    def __init__(self, root, table):
+        self.table = table
+        self.path = os.path.join(root, table)
+        self.invalid_path = os.path.join(self.path, 'invalid')
+
+    def days(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path)
+                      if len(name) == 10 and os.path.isfile(os.path.join(self.path, name, 'datetime.npy')))
+
+    def columns(self):
+        days = self.days()
+        if not days:
+            return []
+        with open(os.path.join(self.path, days[-1], 'columns.json'), 'r') as f:
+            return json.load(f)
+
+    def stage_day(self, day, data):
+        # Columns in table order, written next to the day's directory;
+        # returns the staged directory for swap_day()
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f'{os.path.join(self.path, day)}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'datetime.npy'), pd.to_datetime(data['datetime']).to_numpy('datetime64[ns]'))
+        for column in data.columns:
+            if column != 'datetime':
+                np.save(os.path.join(tmp, f'{column}.npy'), _column_array(data[column]))
+        with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+            json.dump(list(data.columns), f)
+        return tmp
+
+    def swap_day(self, day, staged):
+        target = os.path.join(self.path, day)
+        old = f'{target}.old-{os.getpid()}'
+        if os.path.isdir(target):
+            os.rename(target, old)
+        os.rename(staged, target)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def write_day(self, day, data):
+        # The day directory is replaced atomically
+        self.swap_day(day, self.stage_day(day, data))
+
+    def read_day(self, day, columns=None):
+        return self.read_columns(os.path.join(self.path, day), columns)
+
+    @staticmethod
+    def read_columns(directory, columns=None):
+        if columns is None:
+            with open(os.path.join(directory, 'columns.json'), 'r') as f:
+                columns = json.load(f)
+        return {column: np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='c') for column in columns}
+
+    def compaction(self):
+        # {'dir': ..., 'through': last compacted day} or None
+        try:
+            with open(os.path.join(self.path, 'compact.json'), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set_compaction(self, compaction):
+        pointer = os.path.join(self.path, 'compact.json')
+        if compaction is None:
+            if os.path.exists(pointer):
+                os.remove(pointer)
+            return
+        tmp = f'{pointer}.tmp-{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(compaction, f)
+        os.replace(tmp, pointer)
+
+    def invalidate(self, since):
+        # Marks every stored day from `since` on as stale; one empty file per
+        # call, so concurrent writers never race on a shared file
+        day = pd.Timestamp(since).strftime('%Y-%m-%d')
+        os.makedirs(self.invalid_path, exist_ok=True)
+        open(os.path.join(self.invalid_path, f'{day}.{os.getpid()}.{time.time_ns()}'), 'w').close()
+
+    def invalidated(self):
+        # (earliest invalidated day or None, marker files it came from)
+        if not os.path.isdir(self.invalid_path):
+            return None, []
+        markers = os.listdir(self.invalid_path)
+        return (min(marker[:10] for marker in markers) if markers else None), markers
+
+    def build_compaction(self):
+        # Folds every day before the last into a new compacted generation and
+        # returns it for install_compaction(), or None when there is nothing
+        # new; called under the sync lock, readers keep using the current one
+        days = self.days()[:-1]
+        current = self.compaction()
+        through = current['through'] if current else None
+        pending = [day for day in days if through is None or day > through]
+        if not pending:
+            return None
+        columns = self.columns()
+        parts = {column: [] for column in columns}
+        if current is not None:
+            for column, values in self.read_columns(os.path.join(self.path, current['dir']), columns).items():
+                parts[column].append(values)
+        for day in pending:
+            for column, values in self.read_day(day, columns).items():
+                parts[column].append(values)
+
+        name = f'compact-{pending[-1]}-{os.getpid()}'
+        directory = os.path.join(self.path, name)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for column in columns:
+            np.save(os.path.join(directory, f'{column}.npy'), np.concatenate(parts[column]))
+        with open(os.path.join(directory, 'columns.json'), 'w') as f:
+            json.dump(columns, f)
+        return {'dir': name, 'through': pending[-1]}
+
+    def install_compaction(self, compaction):
+        # Called under the exclusive .lock
+        current = self.compaction()
+        self.set_compaction(compaction)
+        if current is not None and current['dir'] != (compaction or {}).get('dir'):
+            shutil.rmtree(os.path.join(self.path, current['dir']), ignore_errors=True)
+
+    async def compact(self):
+        built = self.build_compaction()
+        if built is None:
+            return False
+        async with _flock(self.path, '.lock', fcntl.LOCK_EX):
+            self.install_compaction(built)
+        return True
+
+    async def load(self, since=None, until=None, columns=None):
+        if not os.path.isdir(self.path):
+            return self._load(since, until, columns)
+        async with _flock(self.path, '.lock', fcntl.LOCK_SH):
+            return self._load(since, until, columns)
+
+    def _load(self, since=None, until=None, columns=None):
+        # Rows with since <= datetime < until as a DataFrame
+        since = pd.Timestamp(since) if since is not None else None
+        until = pd.Timestamp(until) if until is not None else None
+        first = since.strftime('%Y-%m-%d') if since is not None else None
+        last = until.strftime('%Y-%m-%d') if until is not None else None
+        compaction = self.compaction()
+        through = compaction['through'] if compaction else None
+
+        sources = []
+        if through is not None and (first is None or first <= through):
+            sources.append(os.path.join(self.path, compaction['dir']))
+        sources.extend(os.path.join(self.path, day) for day in self.days()
+                       if (through is None or day > through)
+                       and (first is None or day >= first) and (last is None or day <= last))
+        if not sources:
+            return pd.DataFrame(columns=columns) if columns else pd.DataFrame()
+        if columns is None:
+            columns = self.columns()
+        elif 'datetime' not in columns:
+            columns = ['datetime'] + list(columns)
+
+        parts = {column: [] for column in columns}
+        for directory in sources:
+            arrays = self.read_columns(directory, columns)
+            stamps = arrays['datetime']
+            start = np.searchsorted(stamps, since.to_datetime64()) if since is not None else 0
+            end = np.searchsorted(stamps, until.to_datetime64()) if until is not None else len(stamps)
+            if end > start:
+                for column in columns:
+                    parts[column].append(arrays[column][start:end])
+        if not parts['datetime']:
+            return pd.DataFrame({column: arrays[column][:0] for column in columns})
+        if len(parts['datetime']) == 1:
+            # A single source: columns stay on the copy-on-write mapping
+            return pd.DataFrame({column: parts[column][0] for column in columns}, copy=False)
+        return pd.DataFrame({column: np.concatenate(parts[column]) for column in columns})
+
+    async def sync(self, pool, since=None):
+        # Refetch from `since` (default: the last stored day, or an earlier
+        # invalidated one) and write every day that comes back; returns the
+        # number of rows fetched
+        async with _flock(self.path, '.sync.lock', fcntl.LOCK_EX):
+            return await self._sync(pool, since)
+
+    async def _sync(self, pool, since=None):
+        invalid, markers = self.invalidated()
+        days = self.days()
+        if since is not None:
+            since = pd.Timestamp(since).strftime('%Y-%m-%d')
+        elif days:
+            since = days[-1]
+        if since is not None and invalid is not None:
+            since = min(since, invalid)
+
+        staged = {}
+        try:
+            fetched = await self._fetch(pool, since, staged)
+            compaction = self.compaction()
+            async with _flock(self.path, '.lock', fcntl.LOCK_EX):
+                if since is not None and compaction and since <= compaction['through']:
+                    # Compacted days are about to be rewritten; rebuild them from the day files
+                    self.install_compaction(None)
+                for day, directory in staged.items():
+                    self.swap_day(day, directory)
+                # Days in the refetched range that came back empty were deleted upstream
+                for stale in self.days():
+                    if since is not None and stale >= since and stale not in staged:
+                        shutil.rmtree(os.path.join(self.path, stale), ignore_errors=True)
+            staged = {}
+        finally:
+            for directory in staged.values():
+                shutil.rmtree(directory, ignore_errors=True)
+        for marker in markers:
+            os.remove(os.path.join(self.invalid_path, marker))
+        await self.compact()
+        return fetched
+
+    async def _fetch(self, pool, since, staged):
+        # Streams rows from `since` into staged day directories ({day: dir});
+        # takes no lock on the stored days
+        query, args = f'SELECT * FROM `{self.table}`', None
+        if since is not None:
+            query, args = query + ' WHERE `datetime` >= %s', (since,)
+
+        fetched, pending, day = 0, [], None
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cur:
+                await cur.execute(query + ' ORDER BY `datetime`', args)
+                columns = [col[0] for col in cur.description]
+                position = columns.index('datetime')
+                while True:
+                    rows = await cur.fetchmany(FETCH_BATCH)
+                    if not rows:
+                        break
+                    fetched += len(rows)
+                    for row in rows:
+                        row_day = row[position].strftime('%Y-%m-%d')
+                        if row_day != day and pending:
+                            staged[day] = self.stage_day(day, pd.DataFrame(pending, columns=columns))
+                            pending = []
+                        day = row_day
+                        pending.append(row)
+        if pending:
+            staged[day] = self.stage_day(day, pd.DataFrame(pending, columns=columns))
+        return fetched
+
+
+def history_store(config, table):
+    # None when the store is not configured
+    settings = config.get('history_store')
+    if not settings:
+        return None
+    return HistoryStore(os.path.join(project_root, settings.get('path', os.path.join('data', 'history'))), table)
+
+
+def invalidate_history(config, table, since):
+    # For writers that rewrite rows older than the last stored day; a no-op
+    # when the store is not configured
+    store = history_store(config, table)
+    if store is not None:
+        store.invalidate(since)
+
+
+async def cached_history(config, pool, table, since=None, until=None, columns=None):
+    # Full-history reads go through the store when it is configured: sync the
+    # new rows, then load from disk. Returns None when it is not configured.
+    store = history_store(config, table)
+    if store is None:
+        return None
+    start = time.monotonic()
+    fetched = await store.sync(pool)
+    data = await store.load(since, until, columns)
+    print(f"Loaded {len(data)} rows of {table} from the history store "
+          f"({fetched} synced) in {(time.monotonic() - start) * 1000:.0f} ms")
+    return data
+
+
+async def main(config, tables):
+    if not config.get('history_store'):
+        print("No history_store section in config.json")
+        return
+    pool = await get_pool(config)
+    try:
+        for table in tables:
+            store = history_store(config, table)
+            start = time.monotonic()
+            fetched = await store.sync(pool)
+            synced = time.monotonic()
+            data = await store.load()
+            print(f"{table}: {fetched} rows synced in {synced - start:.1f}s, "
+                  f"{len(data)} rows over {len(store.days())} days loaded in {(time.monotonic() - synced) * 1000:.0f} ms")
+    finally:
+        await close_pools()
+
+
+if __name__ == "__main__":
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    # python history_store.py [table ...]; defaults to the 1m OHLC and indicator tables
+    tables = sys.argv[1:] or [ohlc_table('1m', DEFAULT_SYMBOL), indicator_table('1m', DEFAULT_SYMBOL)]
+    asyncio.run(main(config, tables))
@@ -1,12 +1,20 @@
 import os
+import sys
 import json
 import asyncio
-import aiomysql
 import pytz
 import pandas as pd
-import talib
-import numpy as np
-from datetime import datetime, time,timedelta
+from indicators import INDICATOR_COLUMNS, OHLC_COLUMNS, IncrementalIndicatorEngine
+from bars import Bars
+from bar_ring import attach_ring, create_ring, ring_since
+from bulk_writer import bulk_upsert
+from db_pool import close_pools, get_pool, pool_manager
+from gap_tracker import GapTracker, valid_rows
+from fanout import run_per_symbol
+from instruments import DEFAULT_SYMBOL, configured_symbols
+from market_calendar import market_calendar
+from metrics import LatencyHistogram, Throughput
+from timeframes import indicator_table, ohlc_table, timeframe_minutes
 
 # Get the absolute path of the project root
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -14,60 +22,33 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 config_path = os.path.join(project_root, 'config', 'config.json')
 
 IST = pytz.timezone('Asia/Kolkata')
+INDICATOR_TABLE_COLUMNS = OHLC_COLUMNS + INDICATOR_COLUMNS
 
 class IndicatorUpdate:
-    def __init__(self, config):
+    def __init__(self, config, timeframe='1m', symbol=DEFAULT_SYMBOL):
         self.config = config
+        self.calendar = market_calendar(config)
+        self.timeframe = timeframe
+        self.symbol = symbol
+        self.ohlc_table = ohlc_table(timeframe, symbol)
+        self.indicator_table = indicator_table(timeframe, symbol)
+        self.cycle_latency = LatencyHistogram(f'{symbol} {timeframe} indicators')
+        self.rows_written = Throughput(f'{symbol} {timeframe} indicators')
+        self.engine = IncrementalIndicatorEngine()
+        self.missing = None
+        # Gaps in the source bars: a backfill closing one behind the resume
+        # point means the incremental state never saw that bar
+        self.gaps = GapTracker(self.ohlc_table, slot_minutes=timeframe_minutes(timeframe),
+                               calendar=self.calendar)
+        self.ohlc_ring = None
+        self.indicator_ring = None
 
     async def get_mysql_pool(self):
-        db_config = self.config['db_config']
-        pool = await aiomysql.create_pool(
-            host=db_config['host'],
-            port=int(db_config['port']),
-            user=db_config['user'],
-            password=db_config['password'],
-            db=db_config['database'],
-            autocommit=True,
-            minsize=5,
-            maxsize=20
-        )
-        return pool
-
-    def is_market_open(self):
-        current_time = datetime.now(IST).time()
-        open_time = datetime.strptime('09:15', '%H:%M').time()
-        close_time = datetime.strptime('15:30', '%H:%M').time()
-        is_open = open_time <= current_time < close_time
-        print(f"Market open status: {is_open}")
-        return is_open
-
-    def is_business_day(self, date):
-        is_business = date.weekday() < 5 and date.strftime(
-            '%Y-%m-%d') not in self.config['holidays']
-        print(f"Date {date.strftime('%Y-%m-%d')} is business day: {is_business}")
-        return is_business
-
-    def get_sleep_duration(self):
-        current_datetime = datetime.now(IST)
-        current_time = current_datetime.time()
-        next_market_open_datetime = current_datetime.replace(
-            hour=9, minute=15, second=0, microsecond=0)
-
-        if current_time >= next_market_open_datetime.time():
-            next_market_open_datetime += timedelta(days=1)
-
-        while not self.is_business_day(next_market_open_datetime):
-            next_market_open_datetime += timedelta(days=1)
-
-        sleep_duration = (next_market_open_datetime -
-                          current_datetime).total_seconds()
-        print(
-            f"Sleep duration until next market open: {sleep_duration} seconds")
-        return sleep_duration
+        return await get_pool(self.config)
 
     async def create_tables_if_not_exists(self, pool):
-        create_table_query = '''
-            CREATE TABLE IF NOT EXISTS indicators_data (
+        create_table_query = f'''
+            CREATE TABLE IF NOT EXISTS {self.indicator_table} (
                 datetime DATETIME PRIMARY KEY,
                 open DOUBLE,
                 high DOUBLE,
@@ -99,189 +80,145 @@ class IndicatorUpdate:
                 await cur.execute(create_table_query)
                 print("Tables created if not exist")
     async def check_missing_or_duplicate_keys(self, pool):
-        now = pd.Timestamp.now()
-        market_open_time = datetime.strptime('09:15', '%H:%M').time()
-        market_close_time = datetime.strptime('15:30', '%H:%M').time()
-
-        period_now = pd.Period.now('1min')
-        open_time_datetime64 = pd.Timestamp.combine(now.date(), market_open_time)
-        close_time_datetime64 = pd.Timestamp.combine(now.date(), market_close_time)
-        period_now_datetime64 = period_now.start_time
-        previous_candle = (period_now - 1).start_time
-        sleep_duration = (now - previous_candle).total_seconds()
-        min_datetime = min(close_time_datetime64, previous_candle)
-
+        await self.gaps.refresh(pool)
+        num_issues = self.gaps.num_missing()
+        if num_issues:
+            print(
+                "Number of missing or duplicate datetime entries found:", num_issues)
+        else:
+            print("No gaps or duplicates found.")
+        return num_issues
+
+    def warmup_window(self):
+        # Longest indicator lookback plus a margin for ATR/VStop to settle
+        return self.engine.warmup + int(self.config.get('indicator_warmup_margin', 1500))
+
+    async def fetch_ohlctick_1mdata(self, pool, limit=None):
+        if limit is None:
+            query, args = f"SELECT * FROM {self.ohlc_table} ORDER BY datetime", None
+        else:
+            # Walks the datetime primary key backwards, so only `limit` rows are read
+            query = f'''
+                SELECT * FROM (
+                    SELECT * FROM {self.ohlc_table} ORDER BY datetime DESC LIMIT %s
+                ) AS recent ORDER BY datetime
+            '''
+            args = (limit,)
         async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                query = f"""
-                        WITH RECURSIVE datetime_sequence AS (
-                            SELECT '{open_time_datetime64}' AS dt
-                            UNION ALL
-                            SELECT DATE_ADD(dt, INTERVAL 1 MINUTE)
-                            FROM datetime_sequence
-                            WHERE dt < '{min_datetime}'
-                        )
-                        SELECT COUNT(*) AS num_issues
-                        FROM (
-                            SELECT ds.dt AS datetime_missing_or_duplicate
-                            FROM datetime_sequence ds
-                            LEFT JOIN (
-                                SELECT `datetime`, COUNT(*) AS cnt
-                                FROM indicators_data
-                                WHERE `datetime` >= '{open_time_datetime64}' AND `datetime` <= '{min_datetime}'
-                                GROUP BY `datetime`
-                            ) t ON ds.dt = t.`datetime`
-                            LEFT JOIN indicators_data id ON ds.dt = id.`datetime`
-                            WHERE t.`datetime` IS NULL 
-                               OR t.cnt > 1
-                               OR COALESCE(id.open, id.high, id.low, id.close, id.ohlc4) = 0
-                        ) AS issues;
-                        """
-                await cursor.execute(query)
-                result = await cursor.fetchone()
-                num_issues = result[0] if result else 0
-                if num_issues:
-                    print(
-                        "Number of missing or duplicate datetime entries found:", num_issues)
-                else:
-                    print("No gaps or duplicates found.")
-                return num_issues
-
+            async with conn.cursor() as cur:
+                await cur.execute(query, args)
+                result = await cur.fetchall()
+                columns = [col[0] for col in cur.description]
+        # Decoded straight into compact bars; the engine steps them without a frame
+        data = Bars.from_rows(result, columns)
+        print(f"Fetched OHLC data with {len(data)} rows")
+        return data
 
-    async def fetch_ohlctick_1mdata(self, pool):
-        query = "SELECT * FROM ohlctick_1mdata ORDER BY datetime"
+    async def fetch_ohlctick_1mdata_since(self, pool, since):
+        query = f"SELECT * FROM {self.ohlc_table} WHERE datetime >= %s ORDER BY datetime"
         async with pool.acquire() as conn:
             async with conn.cursor() as cur:
-                await cur.execute(query)
+                await cur.execute(query, (since,))
                 result = await cur.fetchall()
                 columns = [col[0] for col in cur.description]
-                data = pd.DataFrame(result, columns=columns)
-                data.sort_values(by='datetime', inplace=True)
-                print(f"Fetched OHLC data with {len(data)} rows")
-                return data
-
-    async def calculate_additional_indicators(self, data):
-        data['ohlc4_sma5'] = talib.SMA(data['ohlc4'], timeperiod=5)
-        data['highsma5'] = talib.SMA(data['high'], timeperiod=5)
-        data['lowsma5'] = talib.SMA(data['low'], timeperiod=5)
-        data['closesma26'] = talib.SMA(data['close'], timeperiod=26)
-        data['closesma5'] = talib.SMA(data['close'], timeperiod=5)
-        data['highsma5_off3'] = data['highsma5'].shift(3)
-        data['lowsma5_off3'] = data['lowsma5'].shift(3)
-
-        sma1 = talib.SMA(
-            talib.ROC(data['close'], timeperiod=20), timeperiod=20)
-        sma2 = talib.SMA(
-            talib.ROC(data['close'], timeperiod=30), timeperiod=20)
-        sma3 = talib.SMA(
-            talib.ROC(data['close'], timeperiod=40), timeperiod=20)
-        sma4 = talib.SMA(
-            talib.ROC(data['close'], timeperiod=60), timeperiod=30)
-        data['KST'] = (sma1 + sma2 * 2 + sma3 * 3 + sma4 * 4)
-        data['KST26'] = talib.SMA(data['KST'], timeperiod=26)
-
-        data['BuyCall'] = (data['KST'] > data['KST26']).astype(int)
-        data['BuyPut'] = (data['KST'] < data['KST26']).astype(int)
-
-        columns_to_round = ['ohlc4_sma5', 'highsma5', 'lowsma5',
-                            'closesma26', 'closesma5', 'highsma5_off3', 'lowsma5_off3', 'KST', 'KST26']
-        data[columns_to_round] = data[columns_to_round].round(2)
-        print("Calculated additional indicators")
+        data = Bars.from_rows(result, columns)
+        print(f"Fetched {len(data)} OHLC rows since {since}")
         return data
 
-    async def calculate_vstop(self, data):
-        data['ATR'] = talib.ATR(data['high'], data['low'],
-                                data['close'], timeperiod=252)
-        data['VStop2'] = np.nan
-        data['VStop3'] = np.nan
-        data['TrendUp2'] = True
-        data['TrendUp3'] = True
-        data['Max'] = data['close']
-        data['Min'] = data['close']
-
-        for i in range(252, len(data)):
-            src = data['close'].iloc[i]
-            atr_m2 = data['ATR'].iloc[i] * 2
-            atr_m3 = data['ATR'].iloc[i] * 3
-
-            data.at[i, 'Max'] = max(data['Max'].iloc[i-1], src)
-            data.at[i, 'Min'] = min(data['Min'].iloc[i-1], src)
-
-            if data['TrendUp2'].iloc[i-1]:
-                data.at[i, 'VStop2'] = max(data['VStop2'].iloc[i-1] if not np.isnan(
-                    data['VStop2'].iloc[i-1]) else src, data['Max'].iloc[i] - atr_m2)
-            else:
-                data.at[i, 'VStop2'] = min(data['VStop2'].iloc[i-1] if not np.isnan(
-                    data['VStop2'].iloc[i-1]) else src, data['Min'].iloc[i] + atr_m2)
-
-            data.at[i, 'TrendUp2'] = src >= data['VStop2'].iloc[i]
-
-            if data['TrendUp2'].iloc[i] != data['TrendUp2'].iloc[i-1]:
-                data.at[i, 'Max'] = src
-                data.at[i, 'Min'] = src
-                data.at[i, 'VStop2'] = data['Max'].iloc[i] - \
-                    atr_m2 if data['TrendUp2'].iloc[i] else data['Min'].iloc[i] + atr_m2
-
-            if data['TrendUp3'].iloc[i-1]:
-                data.at[i, 'VStop3'] = max(data['VStop3'].iloc[i-1] if not np.isnan(
-                    data['VStop3'].iloc[i-1]) else src, data['Max'].iloc[i] - atr_m3)
-            else:
-                data.at[i, 'VStop3'] = min(data['VStop3'].iloc[i-1] if not np.isnan(
-                    data['VStop3'].iloc[i-1]) else src, data['Min'].iloc[i] + atr_m3)
-
-            data.at[i, 'TrendUp3'] = src >= data['VStop3'].iloc[i]
-
-            if data['TrendUp3'].iloc[i] != data['TrendUp3'].iloc[i-1]:
-                data.at[i, 'Max'] = src
-                data.at[i, 'Min'] = src
-                data.at[i, 'VStop3'] = data['Max'].iloc[i] - \
-                    atr_m3 if data['TrendUp3'].iloc[i] else data['Min'].iloc[i] + atr_m3
-
-        columns_to_round = ['ATR', 'VStop2', 'VStop3']
-        data[columns_to_round] = data[columns_to_round].round(2)
+    def open_rings(self):
+        # 1m only: read bars from datasampling.py's ring and publish the new
+        # indicator rows for the strategies
+        if self.timeframe == '1m':
+            self.indicator_ring = create_ring(self.config, 'indicators', self.symbol, INDICATOR_TABLE_COLUMNS)
+
+    def ring_bars_since(self, since):
+        # OHLC rows since `since` from the ring, or None when the feed is not
+        # writing one, it no longer reaches back that far, or it is missing
+        # bars. Backfills (tvdata_update.py) only reach MySQL, so a ring slice
+        # with a hole or a zero bar may be missing a bar the table has.
+        if self.timeframe != '1m':
+            return None
+        self.ohlc_ring = attach_ring(self.config, 'ohlc', self.symbol, self.ohlc_ring)
+        data = ring_since(self.ohlc_ring, since)
+        if data is None:
+            return None
+        if (data.empty or data.datetimes[0] != since or not self.calendar.is_contiguous(data.datetimes)
+                or not valid_rows(data.to_frame()).all()):
+            print(f"Ring buffer is missing OHLC rows since {since}, reading from the database")
+            return None
+        print(f"Read {len(data)} OHLC rows since {since} from the ring buffer")
         return data
 
-    async def save_indicators_to_db(self, pool, data):
-        data = [[None if pd.isna(x) else x for x in row] for row in data]
-        non_zero_data = [row for row in data if any(
-            row[i] not in (0, None) for i in [1, 2, 3, 4])]
-        non_zero_data = non_zero_data[-min(len(non_zero_data), 10):]
-        # non_zero_data = non_zero_data[-min(len(non_zero_data), num_issues+10):]
+    async def rebuild_indicators(self, pool):
+        ohlc_data = await self.fetch_ohlctick_1mdata(pool, limit=self.warmup_window())
+        if len(ohlc_data) < self.engine.warmup:
+            print("Not enough data to calculate indicators")
+            self.engine.reset()
+            return None
+        return self.engine.rebuild(ohlc_data)
 
-        replace_query = '''
-            REPLACE INTO indicators_data (
-                datetime, open, high, low, close, ohlc4, ohlc4_sma5, highsma5, lowsma5, closesma26, closesma5, 
-                highsma5_off3, lowsma5_off3, KST, KST26, BuyCall, BuyPut, ATR, VStop2, VStop3, TrendUp2, TrendUp3, Max, Min
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        '''
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.executemany(replace_query, non_zero_data)
-                print(f"Inserted {len(non_zero_data)} rows into the database")
+    async def save_indicators_to_db(self, pool, data):
+        # Keep candles with at least one non-zero, non-null OHLC value
+        non_zero_data = data[(data[['open', 'high', 'low', 'close']].fillna(0) != 0).any(axis=1)]
+        non_zero_data = non_zero_data.tail(10)
+        # non_zero_data = non_zero_data.tail(num_issues+10)
+        if self.indicator_ring is not None:
+            self.indicator_ring.write(Bars.from_frame(non_zero_data[INDICATOR_TABLE_COLUMNS]))
+        written = await bulk_upsert(pool, self.indicator_table, non_zero_data, INDICATOR_TABLE_COLUMNS)
+        self.rows_written.add(written)
 
     async def get_signal(self):
         pool = await self.get_mysql_pool()  # Await the pool creation
         num_issues = await self.check_missing_or_duplicate_keys(pool)
-        print(f"num_issues:{num_issues}")
+        print(f"{self.symbol} num_issues:{num_issues}")
+        # OHLC bars that were missing last cycle and have been backfilled since
+        missing = self.gaps.missing_slots()
+        filled = self.missing - missing if self.missing is not None else set()
+        self.missing = missing
+        # A filled bar before the resume point was skipped by the incremental
+        # state; one after it is picked up by apply() below
+        history_changed = self.engine.is_ready and any(slot < self.engine.resume_from for slot in filled)
+        # await self.create_tables_if_not_exists(pool)
+        if history_changed or not self.engine.is_ready:
+            indicator_data = await self.rebuild_indicators(pool)
+        else:
+            # A bar backfilled this cycle is only in MySQL
+            ohlc_data = None if filled else self.ring_bars_since(self.engine.resume_from)
+            if ohlc_data is None:
+                ohlc_data = await self.fetch_ohlctick_1mdata_since(pool, self.engine.resume_from)
+            try:
+                indicator_data = self.engine.apply(ohlc_data)
+            except ValueError as e:
+                print(f"{e}, rebuilding indicator state")
+                indicator_data = await self.rebuild_indicators(pool)
+        if indicator_data is None:
+            return
+        await self.save_indicators_to_db(pool, indicator_data)
+
+    async def main(self):
         try:
-            # await self.create_tables_if_not_exists(pool)
-            ohlc_data = await self.fetch_ohlctick_1mdata(pool)
-            if len(ohlc_data) < 252:
-                print("Not enough data to calculate indicators")
-                return
+            await self.run_scheduled()
+        finally:
+            await close_pools()
 
-            # ohlc_data['ohlc4'] = ohlc_data[['open', 'high', 'low', 'close']].mean(axis=1)
-            indicator_data = await self.calculate_additional_indicators(ohlc_data)
-            indicator_data = await self.calculate_vstop(indicator_data)
-            await self.save_indicators_to_db(pool, indicator_data.to_numpy())
+    async def run_scheduled(self):
+        self.open_rings()
+        try:
+            await self.schedule()
         finally:
-            pool.close()  # Close the pool after usage
-            await pool.wait_closed()  # Wait until the pool is fully closed
+            for ring in (self.ohlc_ring, self.indicator_ring):
+                if ring is not None:
+                    ring.close()
+            self.ohlc_ring = self.indicator_ring = None
 
-    async def main(self):
+    async def schedule(self):
         while True:
-            if self.is_market_open() and self.is_business_day(datetime.now(IST)):
-                await self.get_signal()
+            if self.calendar.is_open():
+                seen = self.ohlc_ring.writes if self.ohlc_ring is not None else None
+                with self.cycle_latency.time():
+                    await self.get_signal()
+                print(f"{self.cycle_latency.summary()}; {self.rows_written.summary()}")
+                pool_manager.log_stats()
                 current_time = pd.Timestamp.now(IST)
                 period_now = pd.Period.now('1min')
                 # period_now_start = period_now.start_time.replace(tzinfo=IST)
@@ -291,12 +228,24 @@ class IndicatorUpdate:
                 # next_execution = (previous_finished + pd.Timedelta(seconds=6))
                 sleep_till = (next_execution - current_time).total_seconds()
                 if sleep_till > 0 and sleep_till < 63:
-                    await asyncio.sleep(sleep_till)
+                    if seen is not None:
+                        # Wake as soon as the feed publishes a bar; the
+                        # timer is the fallback when it goes quiet
+                        await self.ohlc_ring.wait(seen, sleep_till)
+                    else:
+                        await asyncio.sleep(sleep_till)
                 # await asyncio.sleep(60)
             else:
-                sleep_duration = self.get_sleep_duration()
+                sleep_duration = self.calendar.seconds_until_open()
                 await asyncio.sleep(sleep_duration)
 
+async def run_all(config, timeframe='1m'):
+    updaters = [IndicatorUpdate(config, timeframe, symbol) for symbol in configured_symbols(config)]
+    try:
+        await run_per_symbol(updaters, 'run_scheduled')
+    finally:
+        await close_pools()
+
 if __name__ == "__main__":
     with open(config_path, 'r') as f:
         config = json.load(f)
@@ -305,5 +254,5 @@ if __name__ == "__main__":
 #     with open('config.json') as config_file:
 #         config = json.load(config_file)
 
-    indicator_update = IndicatorUpdate(config)
-    asyncio.run(indicator_update.main())
+    timeframe = sys.argv[1] if len(sys.argv) > 1 else config.get('timeframe', '1m')
+    asyncio.run(run_all(config, timeframe))
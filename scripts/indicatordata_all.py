@@ -1,12 +1,18 @@
 import os
 import json
+import pickle
+import shutil
 import asyncio
-import aiomysql
+import argparse
 import pytz
-import pandas as pd
-import talib
 import numpy as np
-from datetime import datetime, timedelta
+import pandas as pd
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from indicators import INDICATOR_COLUMNS, OHLC_COLUMNS, IncrementalIndicatorEngine, compute_indicators, warmup_bars
+from bulk_writer import bulk_upsert
+from db_pool import close_pools, get_pool
+from history_store import cached_history, invalidate_history
 
 # Get the absolute path of the project root
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -15,54 +21,61 @@ config_path = os.path.join(project_root, 'config', 'config.json')
 
 
 IST = pytz.timezone('Asia/Kolkata')
+INDICATOR_TABLE_COLUMNS = OHLC_COLUMNS + INDICATOR_COLUMNS
+
+# --backfill recomputes indicators_data in day or month chunks instead of one
+# in-memory pass. The incremental indicator engine carries its state from one
+# chunk to the next, so a backfill of the whole table matches a full recompute
+# exactly, and writes go out in batch_size slices with a commit each. After every chunk the engine
+# state and the chunk end are checkpointed under data/backfill/, so a failed
+# run resumes where it stopped (--restart discards the checkpoints). The plan
+# records --chunk, --processes and --since, and a run with different ones
+# refuses to resume it. The rewritten days are invalidated in the history
+# store when the run ends, complete or not.
+#
+# A range that does not start at the first bar of the table, i.e. the first
+# one with --since and every range after the first with --processes N (N
+# contiguous ranges recomputed in parallel), starts from an engine warmed up
+# on only the warmup_window() bars before it, the same overlap IndicatorUpdate
+# rebuilds from. The recursive state (Wilder ATR-252, the VStop trend and
+# Max/Min) then converges to a full recompute rather than matching it: its
+# first rows can differ from one, most visibly in VStop until its next trend
+# flip.
+BACKFILL_DIR = os.path.join(project_root, 'data', 'backfill')
+CHUNK_FREQUENCIES = {'day': 'D', 'month': 'MS'}
+
+
+def chunk_bounds(first, last, chunk):
+    # [start, end) datetimes of every day or month chunk from first to last
+    start = first.normalize()
+    if chunk == 'month':
+        start = start.replace(day=1)
+    edges = [edge for edge in pd.date_range(start, last, freq=CHUNK_FREQUENCIES[chunk]) if edge > first]
+    edges = [first] + edges + [last + pd.Timedelta(minutes=1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def run_backfill_range(config, index, chunks):
+    # Entry point of a backfill worker process
+    async def run():
+        job = IndicatorAllData(config)
+        pool = await job.get_mysql_pool()
+        try:
+            await job.backfill_range(pool, index, chunks)
+        finally:
+            await close_pools()
+    asyncio.run(run())
+
 
 class IndicatorAllData:
     def __init__(self, config):
         self.config = config
+        self.batch_size = int(config.get('backfill', {}).get('batch_size', 5000))
+        self.checkpoint_dir = os.path.join(BACKFILL_DIR, 'indicators_data')
 
     async def get_mysql_pool(self):
-        db_config = self.config['db_config']
-        pool = await aiomysql.create_pool(
-            host=db_config['host'],
-            port=int(db_config['port']),
-            user=db_config['user'],
-            password=db_config['password'],
-            db=db_config['database'],
-            autocommit=True,
-            minsize=5,
-            maxsize=20
-        )
-        return pool
+        return await get_pool(self.config)
  
-    def is_market_open(self):
-        current_time = datetime.now(IST).time()
-        open_time = datetime.strptime('09:15', '%H:%M').time()
-        close_time = datetime.strptime('15:30', '%H:%M').time()
-        is_open = open_time <= current_time < close_time
-        print(f"Market open status: {is_open}")
-        return is_open
-
-    def is_business_day(self, date):
-        is_business = date.weekday() < 5 and date.strftime('%Y-%m-%d') not in self.config['holidays']
-        print(f"Date {date.strftime('%Y-%m-%d')} is business day: {is_business}")
-        return is_business
-
-    def get_sleep_duration(self):
-        current_datetime = datetime.now(IST)
-        current_time = current_datetime.time()
-        next_market_open_datetime = current_datetime.replace(
-            hour=9, minute=15, second=0, microsecond=0)
-
-        if current_time >= next_market_open_datetime.time():
-            next_market_open_datetime += timedelta(days=1)
-
-        while not self.is_business_day(next_market_open_datetime):
-            next_market_open_datetime += timedelta(days=1)
-
-        sleep_duration = (next_market_open_datetime - current_datetime).total_seconds()
-        print(f"Sleep duration until next market open: {sleep_duration} seconds")
-        return sleep_duration
-
     async def create_tables_if_not_exists(self, pool):
         create_table_query = '''
             CREATE TABLE IF NOT EXISTS indicators_data (
@@ -98,6 +111,10 @@ class IndicatorAllData:
                 print("Tables created if not exist")
 
     async def fetch_ohlctick_1mdata(self, pool):
+        data = await cached_history(self.config, pool, 'ohlctick_1mdata')
+        if data is not None:
+            print(f"Fetched OHLC data with {len(data)} rows")
+            return data
         query = "SELECT * FROM ohlctick_1mdata ORDER BY datetime"
         async with pool.acquire() as conn:
             async with conn.cursor() as cur:
@@ -109,109 +126,173 @@ class IndicatorAllData:
                 print(f"Fetched OHLC data with {len(data)} rows")
                 return data
 
-    async def calculate_additional_indicators(self, data):
-        data['ohlc4_sma5'] = talib.SMA(data['ohlc4'], timeperiod=5)
-        data['highsma5'] = talib.SMA(data['high'], timeperiod=5)
-        data['lowsma5'] = talib.SMA(data['low'], timeperiod=5)
-        data['closesma26'] = talib.SMA(data['close'], timeperiod=26)
-        data['closesma5'] = talib.SMA(data['close'], timeperiod=5)
-        data['highsma5_off3'] = data['highsma5'].shift(3)
-        data['lowsma5_off3'] = data['lowsma5'].shift(3)
-        
-        sma1 = talib.SMA(talib.ROC(data['close'], timeperiod=20), timeperiod=20)
-        sma2 = talib.SMA(talib.ROC(data['close'], timeperiod=30), timeperiod=20)
-        sma3 = talib.SMA(talib.ROC(data['close'], timeperiod=40), timeperiod=20)
-        sma4 = talib.SMA(talib.ROC(data['close'], timeperiod=60), timeperiod=30)
-        data['KST'] = (sma1 + sma2 * 2 + sma3 * 3 + sma4 * 4)
-        data['KST26'] = talib.SMA(data['KST'], timeperiod=26)
-
-        data['BuyCall'] = (data['KST'] > data['KST26']).astype(int)
-        data['BuyPut'] = (data['KST'] < data['KST26']).astype(int)
-
-        columns_to_round = ['ohlc4_sma5', 'highsma5', 'lowsma5',
-                            'closesma26', 'closesma5', 'highsma5_off3', 'lowsma5_off3', 'KST', 'KST26']
-        data[columns_to_round] = data[columns_to_round].round(2)
-        print("Calculated additional indicators")
-        return data
-
-    async def calculate_vstop(self, data):
-        data['ATR'] = talib.ATR(data['high'], data['low'], data['close'], timeperiod=252)
-        data['VStop2'] = np.nan
-        data['VStop3'] = np.nan
-        data['TrendUp2'] = True
-        data['TrendUp3'] = True
-        data['Max'] = data['close']
-        data['Min'] = data['close']
-
-        for i in range(252, len(data)):
-            src = data['close'].iloc[i]
-            atr_m2 = data['ATR'].iloc[i] * 2
-            atr_m3 = data['ATR'].iloc[i] * 3
-
-            data.at[i, 'Max'] = max(data['Max'].iloc[i-1], src)
-            data.at[i, 'Min'] = min(data['Min'].iloc[i-1], src)
-
-            if data['TrendUp2'].iloc[i-1]:
-                data.at[i, 'VStop2'] = max(data['VStop2'].iloc[i-1] if not np.isnan(data['VStop2'].iloc[i-1]) else src, data['Max'].iloc[i] - atr_m2)
-            else:
-                data.at[i, 'VStop2'] = min(data['VStop2'].iloc[i-1] if not np.isnan(data['VStop2'].iloc[i-1]) else src, data['Min'].iloc[i] + atr_m2)
-
-            data.at[i, 'TrendUp2'] = src >= data['VStop2'].iloc[i]
-
-            if data['TrendUp2'].iloc[i] != data['TrendUp2'].iloc[i-1]:
-                data.at[i, 'Max'] = src
-                data.at[i, 'Min'] = src
-                data.at[i, 'VStop2'] = data['Max'].iloc[i] - atr_m2 if data['TrendUp2'].iloc[i] else data['Min'].iloc[i] + atr_m2
-
-            if data['TrendUp3'].iloc[i-1]:
-                data.at[i, 'VStop3'] = max(data['VStop3'].iloc[i-1] if not np.isnan(data['VStop3'].iloc[i-1]) else src, data['Max'].iloc[i] - atr_m3)
-            else:
-                data.at[i, 'VStop3'] = min(data['VStop3'].iloc[i-1] if not np.isnan(data['VStop3'].iloc[i-1]) else src, data['Min'].iloc[i] + atr_m3)
+    async def save_indicators_to_db(self, pool, data):
+        # Keep candles with at least one non-zero, non-null OHLC value
+        non_zero_data = data[(data[['open', 'high', 'low', 'close']].fillna(0) != 0).any(axis=1)]
+        # non_zero_data = non_zero_data.tail(10)
+        await bulk_upsert(pool, 'indicators_data', non_zero_data, INDICATOR_TABLE_COLUMNS)
+        if not non_zero_data.empty:
+            invalidate_history(self.config, 'indicators_data', non_zero_data['datetime'].min())
 
-            data.at[i, 'TrendUp3'] = src >= data['VStop3'].iloc[i]
+    def warmup_window(self):
+        return warmup_bars() + int(self.config.get('indicator_warmup_margin', 1500))
 
-            if data['TrendUp3'].iloc[i] != data['TrendUp3'].iloc[i-1]:
-                data.at[i, 'Max'] = src
-                data.at[i, 'Min'] = src
-                data.at[i, 'VStop3'] = data['Max'].iloc[i] - atr_m3 if data['TrendUp3'].iloc[i] else data['Min'].iloc[i] + atr_m3
+    async def fetch_ohlc_bounds(self, pool, since=None):
+        query, args = "SELECT MIN(datetime), MAX(datetime) FROM ohlctick_1mdata", None
+        if since is not None:
+            query, args = query + " WHERE datetime >= %s", (since,)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, args)
+                first, last = await cur.fetchone()
+        if first is None:
+            return None, None
+        return pd.Timestamp(first), pd.Timestamp(last)
 
-        columns_to_round = ['ATR', 'VStop2', 'VStop3']
-        data[columns_to_round] = data[columns_to_round].round(2)
-        return data
+    async def fetch_ohlc_range(self, pool, start, end):
+        query = "SELECT * FROM ohlctick_1mdata WHERE datetime >= %s AND datetime < %s ORDER BY datetime"
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (start.to_pydatetime(), end.to_pydatetime()))
+                result = await cur.fetchall()
+                columns = [col[0] for col in cur.description]
+        return pd.DataFrame(result, columns=columns)
 
-    async def save_indicators_to_db(self, pool, data):
-        data = [[None if pd.isna(x) else x for x in row] for row in data]
-        non_zero_data = [row for row in data if any(row[i] not in (0, None) for i in [1, 2, 3, 4])]
-        # non_zero_data = non_zero_data[-min(len(non_zero_data), 10):]
-        
-        replace_query = '''
-            REPLACE INTO indicators_data (
-                datetime, open, high, low, close, ohlc4, ohlc4_sma5, highsma5, lowsma5, closesma26, closesma5, 
-                highsma5_off3, lowsma5_off3, KST, KST26, BuyCall, BuyPut, ATR, VStop2, VStop3, TrendUp2, TrendUp3, Max, Min
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    async def fetch_ohlc_before(self, pool, start, limit):
+        query = '''
+            SELECT * FROM (
+                SELECT * FROM ohlctick_1mdata WHERE datetime < %s ORDER BY datetime DESC LIMIT %s
+            ) AS recent ORDER BY datetime
         '''
         async with pool.acquire() as conn:
             async with conn.cursor() as cur:
-                await cur.executemany(replace_query, non_zero_data)
-                print(f"Inserted {len(non_zero_data)} rows into the database")
+                await cur.execute(query, (start.to_pydatetime(), limit))
+                result = await cur.fetchall()
+                columns = [col[0] for col in cur.description]
+        return pd.DataFrame(result, columns=columns)
+
+    async def write_indicator_rows(self, pool, data):
+        non_zero_data = data[(data[['open', 'high', 'low', 'close']].fillna(0) != 0).any(axis=1)]
+        written = 0
+        for offset in range(0, len(non_zero_data), self.batch_size):
+            written += await bulk_upsert(pool, 'indicators_data', non_zero_data.iloc[offset:offset + self.batch_size],
+                                         INDICATOR_TABLE_COLUMNS)
+        return written
+
+    def load_plan(self):
+        # (arguments the plan was made with, ranges of chunks) or (None, None)
+        try:
+            with open(os.path.join(self.checkpoint_dir, 'plan.json'), 'r') as f:
+                plan = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        if not isinstance(plan, dict):
+            # Written before the arguments were recorded
+            return {}, None
+        return plan['args'], [[(pd.Timestamp(start), pd.Timestamp(end)) for start, end in chunks]
+                              for chunks in plan['ranges']]
+
+    def save_plan(self, args, plan):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(os.path.join(self.checkpoint_dir, 'plan.json'), 'w') as f:
+            json.dump({'args': args,
+                       'ranges': [[(str(start), str(end)) for start, end in chunks] for chunks in plan]}, f, indent=1)
+
+    def checkpoint_path(self, index):
+        return os.path.join(self.checkpoint_dir, f'range-{index}.pkl')
+
+    def load_checkpoint(self, index):
+        try:
+            with open(self.checkpoint_path(index), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_checkpoint(self, index, done, engine):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self.checkpoint_path(index)
+        with open(f'{path}.tmp', 'wb') as f:
+            pickle.dump((done, engine.checkpoint()), f)
+        os.replace(f'{path}.tmp', path)
+
+    async def backfill_range(self, pool, index, chunks):
+        engine = IncrementalIndicatorEngine()
+        checkpoint = self.load_checkpoint(index)
+        if checkpoint is not None:
+            done, state = checkpoint
+            engine.restore(state)
+            print(f"Range {index}: resuming after {done}")
+        else:
+            done = None
+            warmup = await self.fetch_ohlc_before(pool, chunks[0][0], self.warmup_window())
+            if not warmup.empty:
+                engine.rebuild(warmup)
+
+        for start, end in chunks:
+            if done is not None and end <= done:
+                continue
+            data = await self.fetch_ohlc_range(pool, start, end)
+            written = await self.write_indicator_rows(pool, engine.extend(data)) if not data.empty else 0
+            self.save_checkpoint(index, end, engine)
+            print(f"Range {index}: {start} .. {end} recomputed, {written} rows written")
+
+    async def backfill(self, chunk='month', processes=1, since=None, restart=False):
+        pool = await self.get_mysql_pool()
+        try:
+            await self.create_tables_if_not_exists(pool)
+            if restart:
+                shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+            args = {'chunk': chunk, 'processes': processes, 'since': str(pd.Timestamp(since)) if since else None}
+            planned_args, plan = self.load_plan()
+            if planned_args is not None and planned_args != args:
+                # Chunk bounds and checkpoints only fit the arguments they were made with
+                print(f"An interrupted backfill in {self.checkpoint_dir} was started with {planned_args or 'other arguments'}, "
+                      f"not {args}; rerun with those arguments to resume it, or add --restart to discard it")
+                return
+            if plan is None:
+                first, last = await self.fetch_ohlc_bounds(pool, since)
+                if first is None:
+                    print("No OHLC data to backfill")
+                    return
+                chunks = chunk_bounds(first, last, chunk)
+                plan = [[chunks[i] for i in group]
+                        for group in np.array_split(np.arange(len(chunks)), min(processes, len(chunks)))]
+                self.save_plan(args, plan)
+            else:
+                print(f"Resuming the backfill planned in {self.checkpoint_dir}")
+
+            try:
+                if len(plan) == 1:
+                    await self.backfill_range(pool, 0, plan[0])
+                else:
+                    loop = asyncio.get_running_loop()
+                    with ProcessPoolExecutor(len(plan), mp_context=multiprocessing.get_context('spawn')) as executor:
+                        await asyncio.gather(*[loop.run_in_executor(executor, run_backfill_range, self.config, index, chunks)
+                                               for index, chunks in enumerate(plan)])
+            finally:
+                # Rewritten rows, complete or not, must not be served from the history store
+                invalidate_history(self.config, 'indicators_data', plan[0][0][0])
+        finally:
+            await close_pools()
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        print("Backfill complete")
 
     async def get_signal(self):
         pool = await self.get_mysql_pool()  # Await the pool creation
         try:
             await self.create_tables_if_not_exists(pool)
             ohlc_data = await self.fetch_ohlctick_1mdata(pool)
-            if len(ohlc_data) < 252:
+            if len(ohlc_data) < warmup_bars():
                 print("Not enough data to calculate indicators")
                 return
 
             # ohlc_data['ohlc4'] = ohlc_data[['open', 'high', 'low', 'close']].mean(axis=1)
-            indicator_data = await self.calculate_additional_indicators(ohlc_data)
-            indicator_data = await self.calculate_vstop(indicator_data)
+            indicator_data = compute_indicators(ohlc_data)
+            print("Calculated indicators")
             # print(indicator_data.columns)
-            await self.save_indicators_to_db(pool, indicator_data.to_numpy())
+            await self.save_indicators_to_db(pool, indicator_data)
         finally:
-            pool.close()  # Close the pool after usage
-            await pool.wait_closed()  # Wait until the pool is fully closed
+            await close_pools()
     
     async def main(self):
         await self.get_signal()
@@ -224,5 +305,18 @@ if __name__ == "__main__":
 #     with open('config.json') as config_file:
 #         config = json.load(config_file)
 
+    parser = argparse.ArgumentParser(description='Recompute indicators_data from ohlctick_1mdata')
+    parser.add_argument('--backfill', action='store_true', help='recompute in resumable chunks')
+    parser.add_argument('--chunk', choices=sorted(CHUNK_FREQUENCIES), default='month')
+    parser.add_argument('--processes', type=int, default=1, help='parallel recompute ranges')
+    parser.add_argument('--since', help='first datetime to recompute; the ATR/VStop state is warmed up on '
+                                        'the bars just before it, so early rows converge to a full recompute '
+                                        'rather than matching it')
+    parser.add_argument('--restart', action='store_true', help='discard an interrupted backfill')
+    args = parser.parse_args()
+
     indicator_alldata = IndicatorAllData(config)
-    asyncio.run(indicator_alldata.main())
+    if args.backfill:
+        asyncio.run(indicator_alldata.backfill(args.chunk, args.processes, args.since, args.restart))
+    else:
+        asyncio.run(indicator_alldata.main())
@@ -0,0 +1,7 @@
+from .registry import (ATR_PERIOD, INDICATORS, KST_ROC_PERIODS, KST_SMA_PERIODS, OHLC_COLUMNS, ROUNDED_COLUMNS,
+                       VSTOP_MULTIPLIERS, Indicator, atr_line, buy_signal, compute_indicators, kst_line,
+                       output_columns, resolve, warmup_bars)
+from .engine import IncrementalIndicatorEngine
+from .vstop import calculate_vstop, check_parity, vstop_arrays
+
+INDICATOR_COLUMNS = output_columns()
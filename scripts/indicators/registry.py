@@ -0,0 +1,150 @@
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+import pandas as pd
+import talib
+
+from .streaming import (ATRStream, BuySignalStream, KSTStream, LagStream,
+                        SMAStream, VStopStream)
+from .vstop import vstop_arrays
+
+OHLC_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'ohlc4']
+ATR_PERIOD = 252
+KST_ROC_PERIODS = (20, 30, 40, 60)
+KST_SMA_PERIODS = (20, 20, 20, 30)
+VSTOP_MULTIPLIERS = (2, 3)
+
+
+@dataclass(frozen=True)
+class Indicator:
+    name: str
+    inputs: Tuple[str, ...]       # raw OHLC columns or outputs of other indicators
+    outputs: Tuple[str, ...]
+    dtypes: Tuple[str, ...]
+    lookback: int                 # bars consumed before the first valid output
+    compute: Callable             # batch: DataFrame -> tuple of output arrays
+    stream: Callable              # factory for the O(1)-per-bar state
+    rounded: bool = True
+
+
+def _sma(column, period):
+    return lambda data: (talib.SMA(data[column], timeperiod=period),)
+
+
+def _shift(column, periods):
+    return lambda data: (data[column].shift(periods),)
+
+
+# The batch formulas take their periods as arguments so parameter sweeps
+# compute exactly what the registry does; the registry uses the defaults.
+
+def kst_line(close, roc_periods=KST_ROC_PERIODS, sma_periods=KST_SMA_PERIODS):
+    kst = None
+    for weight, (roc, sma) in enumerate(zip(roc_periods, sma_periods), start=1):
+        term = talib.SMA(talib.ROC(close, timeperiod=roc), timeperiod=sma)
+        kst = term if kst is None else kst + term * weight
+    return kst
+
+
+def buy_signal(kst, kst26):
+    return (kst > kst26).astype(int), (kst < kst26).astype(int)
+
+
+def atr_line(data, period=ATR_PERIOD):
+    return talib.ATR(data['high'], data['low'], data['close'], timeperiod=period)
+
+
+def _kst(data):
+    return (kst_line(data['close']),)
+
+
+def _buy_signal(data):
+    return buy_signal(data['KST'], data['KST26'])
+
+
+def _atr(data):
+    return (atr_line(data),)
+
+
+def _vstop(data):
+    return vstop_arrays(data['close'].to_numpy(), data['ATR'].to_numpy(), ATR_PERIOD, VSTOP_MULTIPLIERS)
+
+
+_KST_LOOKBACK = max(roc + sma - 1 for roc, sma in zip(KST_ROC_PERIODS, KST_SMA_PERIODS))
+
+# Registration order is dependency order and also the column order of
+# indicators_data.
+INDICATORS = {indicator.name: indicator for indicator in [
+    Indicator('ohlc4_sma5', ('ohlc4',), ('ohlc4_sma5',), ('float64',), 4,
+              _sma('ohlc4', 5), lambda: SMAStream('ohlc4', 5)),
+    Indicator('highsma5', ('high',), ('highsma5',), ('float64',), 4,
+              _sma('high', 5), lambda: SMAStream('high', 5)),
+    Indicator('lowsma5', ('low',), ('lowsma5',), ('float64',), 4,
+              _sma('low', 5), lambda: SMAStream('low', 5)),
+    Indicator('closesma26', ('close',), ('closesma26',), ('float64',), 25,
+              _sma('close', 26), lambda: SMAStream('close', 26)),
+    Indicator('closesma5', ('close',), ('closesma5',), ('float64',), 4,
+              _sma('close', 5), lambda: SMAStream('close', 5)),
+    Indicator('highsma5_off3', ('highsma5',), ('highsma5_off3',), ('float64',), 4 + 3,
+              _shift('highsma5', 3), lambda: LagStream('highsma5', 3)),
+    Indicator('lowsma5_off3', ('lowsma5',), ('lowsma5_off3',), ('float64',), 4 + 3,
+              _shift('lowsma5', 3), lambda: LagStream('lowsma5', 3)),
+    Indicator('KST', ('close',), ('KST',), ('float64',), _KST_LOOKBACK,
+              _kst, lambda: KSTStream(KST_ROC_PERIODS, KST_SMA_PERIODS)),
+    Indicator('KST26', ('KST',), ('KST26',), ('float64',), _KST_LOOKBACK + 25,
+              _sma('KST', 26), lambda: SMAStream('KST', 26)),
+    Indicator('BuySignal', ('KST', 'KST26'), ('BuyCall', 'BuyPut'), ('int64', 'int64'), _KST_LOOKBACK + 25,
+              _buy_signal, BuySignalStream, rounded=False),
+    Indicator('ATR', ('high', 'low', 'close'), ('ATR',), ('float64',), ATR_PERIOD,
+              _atr, lambda: ATRStream(ATR_PERIOD)),
+    Indicator('VStop', ('close', 'ATR'),
+              ('VStop2', 'VStop3', 'TrendUp2', 'TrendUp3', 'Max', 'Min'),
+              ('float64', 'float64', 'bool', 'bool', 'float64', 'float64'), ATR_PERIOD,
+              _vstop, lambda: VStopStream(ATR_PERIOD), rounded=False),
+]}
+
+_BY_OUTPUT = {output: indicator for indicator in INDICATORS.values() for output in indicator.outputs}
+
+# VStop2/VStop3 are rounded on output but Max/Min never were
+ROUNDED_COLUMNS = [output for indicator in INDICATORS.values() if indicator.rounded
+                   for output in indicator.outputs] + ['VStop2', 'VStop3']
+
+
+def resolve(names=None):
+    # Accepts indicator or column names and returns the registry entries needed,
+    # dependencies included, in computation order.
+    if names is None:
+        return list(INDICATORS.values())
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        indicator = INDICATORS.get(name) or _BY_OUTPUT.get(name)
+        if indicator is None:
+            if name in OHLC_COLUMNS:
+                continue
+            raise KeyError(f"Unknown indicator: {name}")
+        if indicator.name not in needed:
+            needed.add(indicator.name)
+            pending.extend(indicator.inputs)
+    return [indicator for indicator in INDICATORS.values() if indicator.name in needed]
+
+
+def output_columns(names=None):
+    return [output for indicator in resolve(names) for output in indicator.outputs]
+
+
+def warmup_bars(names=None):
+    return max((indicator.lookback for indicator in resolve(names)), default=0)
+
+
+def compute_indicators(data, names=None):
+    # Everything is computed unrounded (VStop and BuyCall/BuyPut depend on the
+    # raw ATR/KST values) and rounded once at the end, like the original scripts.
+    for indicator in resolve(names):
+        values = indicator.compute(data)
+        for output, dtype, value in zip(indicator.outputs, indicator.dtypes, values):
+            data[output] = pd.Series(value, index=data.index).astype(dtype)
+    rounded = [col for col in output_columns(names) if col in ROUNDED_COLUMNS]
+    data[rounded] = data[rounded].round(2)
+    return data
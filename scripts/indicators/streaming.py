@@ -0,0 +1,178 @@
+import math
+from collections import deque
+
+# O(1)-per-bar building blocks. The arithmetic mirrors talib's running-sum SMA,
+# ROC and Wilder ATR, so fed the same history they match the batch functions.
+
+
+class RollingSMA:
+    def __init__(self, period):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+
+    def update(self, value):
+        # Leading NaNs (e.g. SMA of ROC) are skipped the same way talib does
+        if math.isnan(value):
+            return math.nan
+        self.window.append(value)
+        self.total += value
+        if len(self.window) < self.period:
+            return math.nan
+        result = self.total / self.period
+        self.total -= self.window.popleft()
+        return result
+
+
+class RateOfChange:
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period + 1)
+
+    def update(self, value):
+        self.window.append(value)
+        if len(self.window) <= self.period:
+            return math.nan
+        previous = self.window[0]
+        if previous == 0:
+            return 0.0
+        return ((value / previous) - 1.0) * 100.0
+
+
+class Lag:
+    def __init__(self, periods):
+        self.window = deque([math.nan] * (periods + 1), maxlen=periods + 1)
+
+    def update(self, value):
+        self.window.append(value)
+        return self.window[0]
+
+
+class WilderATR:
+    def __init__(self, period):
+        self.period = period
+        self.prev_close = None
+        self.seed = RollingSMA(period)
+        self.value = math.nan
+
+    def update(self, high, low, close):
+        prev_close, self.prev_close = self.prev_close, close
+        if prev_close is None:
+            return math.nan
+
+        true_range = high - low
+        if abs(high - prev_close) > true_range:
+            true_range = abs(high - prev_close)
+        if abs(low - prev_close) > true_range:
+            true_range = abs(low - prev_close)
+
+        if math.isnan(self.value):
+            self.value = self.seed.update(true_range)
+            if not math.isnan(self.value):
+                self.seed = None
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+        return self.value
+
+
+class VStopState:
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.max = math.nan
+        self.min = math.nan
+        self.vstop2 = math.nan
+        self.vstop3 = math.nan
+        self.trend_up2 = True
+        self.trend_up3 = True
+
+    def update(self, src, atr):
+        index = self.count
+        self.count += 1
+        if index < self.start:
+            self.max = src
+            self.min = src
+            return self.vstop2, self.vstop3, self.trend_up2, self.trend_up3, self.max, self.min
+
+        atr_m2 = atr * 2
+        atr_m3 = atr * 3
+
+        self.max = max(self.max, src)
+        self.min = min(self.min, src)
+
+        prev_trend = self.trend_up2
+        if prev_trend:
+            self.vstop2 = max(self.vstop2 if not math.isnan(self.vstop2) else src, self.max - atr_m2)
+        else:
+            self.vstop2 = min(self.vstop2 if not math.isnan(self.vstop2) else src, self.min + atr_m2)
+        self.trend_up2 = src >= self.vstop2
+        if self.trend_up2 != prev_trend:
+            self.max = src
+            self.min = src
+            self.vstop2 = self.max - atr_m2 if self.trend_up2 else self.min + atr_m2
+
+        prev_trend = self.trend_up3
+        if prev_trend:
+            self.vstop3 = max(self.vstop3 if not math.isnan(self.vstop3) else src, self.max - atr_m3)
+        else:
+            self.vstop3 = min(self.vstop3 if not math.isnan(self.vstop3) else src, self.min + atr_m3)
+        self.trend_up3 = src >= self.vstop3
+        if self.trend_up3 != prev_trend:
+            self.max = src
+            self.min = src
+            self.vstop3 = self.max - atr_m3 if self.trend_up3 else self.min + atr_m3
+
+        return self.vstop2, self.vstop3, self.trend_up2, self.trend_up3, self.max, self.min
+
+
+# Adapters used by the registry: each takes the bar-so-far dict and returns a
+# tuple aligned with the indicator's outputs.
+
+class SMAStream:
+    def __init__(self, column, period):
+        self.column = column
+        self.sma = RollingSMA(period)
+
+    def update(self, row):
+        return (self.sma.update(row[self.column]),)
+
+
+class LagStream:
+    def __init__(self, column, periods):
+        self.column = column
+        self.lag = Lag(periods)
+
+    def update(self, row):
+        return (self.lag.update(row[self.column]),)
+
+
+class KSTStream:
+    def __init__(self, roc_periods, sma_periods):
+        self.rocs = [RateOfChange(period) for period in roc_periods]
+        self.smas = [RollingSMA(period) for period in sma_periods]
+
+    def update(self, row):
+        sma1, sma2, sma3, sma4 = (
+            sma.update(roc.update(row['close'])) for roc, sma in zip(self.rocs, self.smas))
+        return (sma1 + sma2 * 2 + sma3 * 3 + sma4 * 4,)
+
+
+class BuySignalStream:
+    def update(self, row):
+        return int(row['KST'] > row['KST26']), int(row['KST'] < row['KST26'])
+
+
+class ATRStream:
+    def __init__(self, period):
+        self.atr = WilderATR(period)
+
+    def update(self, row):
+        return (self.atr.update(row['high'], row['low'], row['close']),)
+
+
+class VStopStream:
+    def __init__(self, start):
+        self.state = VStopState(start)
+
+    def update(self, row):
+        return self.state.update(row['close'], row['ATR'])
@@ -0,0 +1,192 @@
+import sys
+import numpy as np
+import pandas as pd
+import talib
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Single-pass VStop over plain arrays. max/min are spelled out with the same
+# tie/NaN behaviour as Python's builtins so the compiled and interpreted
+# kernels both reproduce the original DataFrame loop bit for bit.
+
+
+def _vstop_kernel(close, atr, start, mult2, mult3, vstop2, vstop3, trend_up2, trend_up3, max_, min_):
+    n = len(close)
+    if start >= n or start < 1:
+        return
+    prev_max = max_[start - 1]
+    prev_min = min_[start - 1]
+    prev_vstop2 = vstop2[start - 1]
+    prev_vstop3 = vstop3[start - 1]
+    prev_trend2 = trend_up2[start - 1]
+    prev_trend3 = trend_up3[start - 1]
+
+    for i in range(start, n):
+        src = close[i]
+        atr_m2 = atr[i] * mult2
+        atr_m3 = atr[i] * mult3
+
+        cur_max = prev_max
+        if src > cur_max:
+            cur_max = src
+        cur_min = prev_min
+        if src < cur_min:
+            cur_min = src
+
+        base = prev_vstop2 if prev_vstop2 == prev_vstop2 else src
+        if prev_trend2:
+            cur_vstop2 = base
+            if cur_max - atr_m2 > cur_vstop2:
+                cur_vstop2 = cur_max - atr_m2
+        else:
+            cur_vstop2 = base
+            if cur_min + atr_m2 < cur_vstop2:
+                cur_vstop2 = cur_min + atr_m2
+        cur_trend2 = src >= cur_vstop2
+        if cur_trend2 != prev_trend2:
+            cur_max = src
+            cur_min = src
+            cur_vstop2 = cur_max - atr_m2 if cur_trend2 else cur_min + atr_m2
+
+        base = prev_vstop3 if prev_vstop3 == prev_vstop3 else src
+        if prev_trend3:
+            cur_vstop3 = base
+            if cur_max - atr_m3 > cur_vstop3:
+                cur_vstop3 = cur_max - atr_m3
+        else:
+            cur_vstop3 = base
+            if cur_min + atr_m3 < cur_vstop3:
+                cur_vstop3 = cur_min + atr_m3
+        cur_trend3 = src >= cur_vstop3
+        if cur_trend3 != prev_trend3:
+            cur_max = src
+            cur_min = src
+            cur_vstop3 = cur_max - atr_m3 if cur_trend3 else cur_min + atr_m3
+
+        max_[i] = cur_max
+        min_[i] = cur_min
+        vstop2[i] = cur_vstop2
+        vstop3[i] = cur_vstop3
+        trend_up2[i] = cur_trend2
+        trend_up3[i] = cur_trend3
+        prev_max, prev_min = cur_max, cur_min
+        prev_vstop2, prev_vstop3 = cur_vstop2, cur_vstop3
+        prev_trend2, prev_trend3 = cur_trend2, cur_trend3
+
+
+if njit is not None:
+    _compiled_kernel = njit(cache=True)(_vstop_kernel)
+else:
+    _compiled_kernel = None
+
+
+def vstop_arrays(close, atr, start=252, multipliers=(2, 3)):
+    # multipliers: ATR multiples of the VStop2 and VStop3 bands
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    atr = np.ascontiguousarray(atr, dtype=np.float64)
+    n = len(close)
+    vstop2 = np.full(n, np.nan)
+    vstop3 = np.full(n, np.nan)
+    trend_up2 = np.ones(n, dtype=np.bool_)
+    trend_up3 = np.ones(n, dtype=np.bool_)
+    max_ = close.copy()
+    min_ = close.copy()
+
+    if _compiled_kernel is not None:
+        _compiled_kernel(close, atr, start, float(multipliers[0]), float(multipliers[1]),
+                         vstop2, vstop3, trend_up2, trend_up3, max_, min_)
+        return vstop2, vstop3, trend_up2, trend_up3, max_, min_
+
+    # Python floats in lists are several times faster to walk than NumPy scalars
+    outputs = [vstop2.tolist(), vstop3.tolist(), trend_up2.tolist(),
+               trend_up3.tolist(), max_.tolist(), min_.tolist()]
+    _vstop_kernel(close.tolist(), atr.tolist(), start, float(multipliers[0]), float(multipliers[1]), *outputs)
+    return (np.array(outputs[0]), np.array(outputs[1]), np.array(outputs[2], dtype=np.bool_),
+            np.array(outputs[3], dtype=np.bool_), np.array(outputs[4]), np.array(outputs[5]))
+
+
+def calculate_vstop(data, atr_period=252):
+    data['ATR'] = talib.ATR(data['high'], data['low'], data['close'], timeperiod=atr_period)
+    (data['VStop2'], data['VStop3'], data['TrendUp2'], data['TrendUp3'],
+     data['Max'], data['Min']) = vstop_arrays(data['close'].to_numpy(), data['ATR'].to_numpy(), atr_period)
+
+    columns_to_round = ['ATR', 'VStop2', 'VStop3']
+    data[columns_to_round] = data[columns_to_round].round(2)
+    return data
+
+
+def calculate_vstop_rowwise(data, atr_period=252):
+    # The original per-row implementation, kept only as the parity reference
+    data['ATR'] = talib.ATR(data['high'], data['low'], data['close'], timeperiod=atr_period)
+    data['VStop2'] = np.nan
+    data['VStop3'] = np.nan
+    data['TrendUp2'] = True
+    data['TrendUp3'] = True
+    data['Max'] = data['close']
+    data['Min'] = data['close']
+
+    for i in range(atr_period, len(data)):
+        src = data['close'].iloc[i]
+        atr_m2 = data['ATR'].iloc[i] * 2
+        atr_m3 = data['ATR'].iloc[i] * 3
+
+        data.at[i, 'Max'] = max(data['Max'].iloc[i-1], src)
+        data.at[i, 'Min'] = min(data['Min'].iloc[i-1], src)
+
+        if data['TrendUp2'].iloc[i-1]:
+            data.at[i, 'VStop2'] = max(data['VStop2'].iloc[i-1] if not np.isnan(data['VStop2'].iloc[i-1]) else src, data['Max'].iloc[i] - atr_m2)
+        else:
+            data.at[i, 'VStop2'] = min(data['VStop2'].iloc[i-1] if not np.isnan(data['VStop2'].iloc[i-1]) else src, data['Min'].iloc[i] + atr_m2)
+
+        data.at[i, 'TrendUp2'] = src >= data['VStop2'].iloc[i]
+
+        if data['TrendUp2'].iloc[i] != data['TrendUp2'].iloc[i-1]:
+            data.at[i, 'Max'] = src
+            data.at[i, 'Min'] = src
+            data.at[i, 'VStop2'] = data['Max'].iloc[i] - atr_m2 if data['TrendUp2'].iloc[i] else data['Min'].iloc[i] + atr_m2
+
+        if data['TrendUp3'].iloc[i-1]:
+            data.at[i, 'VStop3'] = max(data['VStop3'].iloc[i-1] if not np.isnan(data['VStop3'].iloc[i-1]) else src, data['Max'].iloc[i] - atr_m3)
+        else:
+            data.at[i, 'VStop3'] = min(data['VStop3'].iloc[i-1] if not np.isnan(data['VStop3'].iloc[i-1]) else src, data['Min'].iloc[i] + atr_m3)
+
+        data.at[i, 'TrendUp3'] = src >= data['VStop3'].iloc[i]
+
+        if data['TrendUp3'].iloc[i] != data['TrendUp3'].iloc[i-1]:
+            data.at[i, 'Max'] = src
+            data.at[i, 'Min'] = src
+            data.at[i, 'VStop3'] = data['Max'].iloc[i] - atr_m3 if data['TrendUp3'].iloc[i] else data['Min'].iloc[i] + atr_m3
+
+    columns_to_round = ['ATR', 'VStop2', 'VStop3']
+    data[columns_to_round] = data[columns_to_round].round(2)
+    return data
+
+
+def check_parity(data, atr_period=252):
+    fast = calculate_vstop(data.copy(), atr_period)
+    reference = calculate_vstop_rowwise(data.reset_index(drop=True).copy(), atr_period)
+    mismatches = []
+    for col in ['ATR', 'VStop2', 'VStop3', 'TrendUp2', 'TrendUp3', 'Max', 'Min']:
+        a = fast[col].to_numpy(dtype=np.float64)
+        b = reference[col].to_numpy(dtype=np.float64)
+        if not np.array_equal(a, b, equal_nan=True):
+            mismatches.append(col)
+    return mismatches
+
+
+if __name__ == "__main__":
+    # python scripts/indicators/vstop.py [ohlc.csv] -- compares the kernel with the row loop
+    if len(sys.argv) > 1:
+        ohlc = pd.read_csv(sys.argv[1])
+    else:
+        rng = np.random.default_rng(7)
+        close = 50000 + np.cumsum(rng.normal(0, 20, 20000))
+        ohlc = pd.DataFrame({'close': close.round(2)})
+        ohlc['high'] = (close + rng.random(len(close)) * 15).round(2)
+        ohlc['low'] = (close - rng.random(len(close)) * 15).round(2)
+    mismatches = check_parity(ohlc)
+    print(f"VStop parity over {len(ohlc)} bars: {'OK' if not mismatches else mismatches}")
+    sys.exit(1 if mismatches else 0)
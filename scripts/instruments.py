@@ -0,0 +1,54 @@
+# Underlyings the scripts can run on. Every symbol gets its own set of tables;
+# BANKNIFTY keeps the original unprefixed names so existing databases work as
+# before, the others are prefixed (nifty_ohlctick_1mdata, ...).
+# config["symbols"] selects what runs and config["instruments"] may override any
+# field below per symbol.
+
+DEFAULT_SYMBOL = 'BANKNIFTY'
+
+INSTRUMENTS = {
+    'BANKNIFTY': {
+        'tv_symbol': 'BANKNIFTY',
+        'tv_exchange': 'NSE',
+        'feed_token': '4.1!NIFTY BANK',
+        'stock_code': 'CNXBAN',
+        'strike_step': 100,
+        'quantity': '15',
+    },
+    'NIFTY': {
+        'tv_symbol': 'NIFTY',
+        'tv_exchange': 'NSE',
+        'feed_token': '4.1!NIFTY 50',
+        'stock_code': 'NIFTY',
+        'strike_step': 50,
+        'quantity': '25',
+    },
+    'FINNIFTY': {
+        'tv_symbol': 'CNXFINANCE',
+        'tv_exchange': 'NSE',
+        'feed_token': '4.1!NIFTY FIN SERVICE',
+        'stock_code': 'NIFFIN',
+        'strike_step': 50,
+        'quantity': '25',
+    },
+}
+
+
+def configured_symbols(config):
+    return list(config.get('symbols', [DEFAULT_SYMBOL]))
+
+
+def instrument(config, symbol=DEFAULT_SYMBOL):
+    overrides = config.get('instruments', {}).get(symbol, {})
+    if symbol not in INSTRUMENTS and not overrides:
+        raise ValueError(f"Unknown symbol {symbol!r}, add it under config['instruments']")
+    return {**INSTRUMENTS.get(symbol, {}), **overrides, 'symbol': symbol}
+
+
+def feed_code(inst):
+    # Breeze reports the index name after the '!' of the subscription token
+    return inst['feed_token'].split('!', 1)[-1]
+
+
+def table_name(base, symbol=DEFAULT_SYMBOL):
+    return base if symbol == DEFAULT_SYMBOL else f'{symbol.lower()}_{base}'
@@ -0,0 +1,151 @@
+import json
+import pytz
+import numpy as np
+import pandas as pd
+from datetime import date, time
+
+IST = pytz.timezone('Asia/Kolkata')
+SESSION_OPEN = time(9, 15)
+SESSION_CLOSE = time(15, 30)
+SESSION_MINUTES = 375  # 09:15 .. 15:29
+
+# One trading calendar for every script, built once from config.json:
+#
+#   "holidays": ["2024-11-01", ...]                   weekdays without a session
+#   "special_sessions": {"2024-11-01": ["18:00", "19:00"]}
+#                                                    sessions outside the regular
+#                                                    hours (muhurat, Saturday
+#                                                    live sessions); they replace
+#                                                    the day's regular session,
+#                                                    holiday or not
+#
+# Every session from the first configured year to the end of the year after the
+# last one is precomputed into arrays of open and close minutes, with a dict from
+# date to session and, per calendar day, the first session on or after it. Each
+# query is a couple of lookups. Times are IST; naive datetimes are taken to be
+# IST wall time (the tables store them that way), aware ones are converted. A
+# session's close is exclusive: the last 1m bar of a regular session is 15:29.
+
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+
+def _local(dt):
+    dt = pd.Timestamp.now(IST) if dt is None else pd.Timestamp(dt)
+    if dt.tzinfo is not None:
+        dt = dt.tz_convert(IST).tz_localize(None)
+    return dt
+
+
+def _clock(value):
+    return value if isinstance(value, time) else time.fromisoformat(value)
+
+
+class MarketCalendar:
+    def __init__(self, holidays=(), special_sessions=None, first_year=None, last_year=None):
+        holidays = {pd.Timestamp(day).date() for day in holidays}
+        special = {pd.Timestamp(day).date(): (_clock(hours[0]), _clock(hours[1]))
+                   for day, hours in (special_sessions or {}).items()}
+        years = [day.year for day in holidays | special.keys()] + [date.today().year]
+        self.first_day = date(first_year or min(years), 1, 1)
+        self.last_day = date(last_year or max(years) + 1, 12, 31)
+
+        days = pd.date_range(self.first_day, self.last_day, freq='D')
+        sessions = []
+        for day in days.date:
+            if day in special:
+                sessions.append((day, *special[day]))
+            elif day.weekday() < 5 and day not in holidays:
+                sessions.append((day, SESSION_OPEN, SESSION_CLOSE))
+        self.days = [day for day, _, _ in sessions]
+        self.day_index = pd.DatetimeIndex(self.days)
+        self.opens = pd.DatetimeIndex([pd.Timestamp.combine(day, start) for day, start, _ in sessions])
+        self.closes = pd.DatetimeIndex([pd.Timestamp.combine(day, end) for day, _, end in sessions])
+        self.index = {day: i for i, day in enumerate(self.days)}
+        # next_session[k]: index of the first session on or after first_day + k days
+        self.next_session = np.searchsorted(pd.DatetimeIndex(self.days).to_numpy(), days.to_numpy())
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('holidays', ()), config.get('special_sessions'))
+
+    def _day_offset(self, day):
+        offset = (day - self.first_day).days
+        if not 0 <= offset < len(self.next_session):
+            raise ValueError(f"{day} is outside the market calendar ({self.first_day} .. {self.last_day})")
+        return offset
+
+    def session(self, day=None):
+        # (open, close) of the session on `day`'s date as naive IST Timestamps, or None
+        i = self.index.get(_local(day).date())
+        return None if i is None else (self.opens[i], self.closes[i])
+
+    def is_trading_day(self, day=None):
+        return _local(day).date() in self.index
+
+    def is_open(self, now=None):
+        now = _local(now)
+        i = self.index.get(now.date())
+        return i is not None and self.opens[i] <= now < self.closes[i]
+
+    def next_open(self, now=None):
+        # Open of the first session starting after `now`, IST-aware
+        now = _local(now)
+        i = self.next_session[self._day_offset(now.date())]
+        if i < len(self.opens) and self.opens[i] <= now:
+            i += 1
+        if i >= len(self.opens):
+            raise ValueError(f"No session after {now} in the market calendar")
+        return self.opens[i].tz_localize(IST)
+
+    def seconds_until_open(self, now=None):
+        now = _local(now)
+        return (self.next_open(now).tz_localize(None) - now).total_seconds()
+
+    def minute_index(self, dt=None):
+        # Minutes since the session open, or None outside a session
+        dt = _local(dt)
+        i = self.index.get(dt.date())
+        if i is None or not self.opens[i] <= dt < self.closes[i]:
+            return None
+        return int((dt - self.opens[i]) // ONE_MINUTE)
+
+    def is_contiguous(self, datetimes):
+        # True when consecutive minutes follow each other within a session, or
+        # go from a session's last minute to the next session's open
+        stamps = pd.DatetimeIndex(datetimes)
+        for i in np.flatnonzero(np.diff(stamps.asi8) != ONE_MINUTE.value):
+            previous, current = stamps[i], stamps[i + 1]
+            if self.minute_index(previous) != self.session_minutes(previous) - 1:
+                return False
+            try:
+                if self.next_open(previous).tz_localize(None) != current:
+                    return False
+            except ValueError:
+                return False
+        return True
+
+    def sessions(self, datetimes):
+        # (opens, closes) of the session on each datetime's date, vectorised;
+        # dates without a session get the regular hours
+        days = pd.DatetimeIndex(datetimes).normalize()
+        positions = self.day_index.get_indexer(days)
+        found = positions >= 0
+        regular = days + pd.Timedelta(hours=SESSION_OPEN.hour, minutes=SESSION_OPEN.minute)
+        opens = regular.where(~found, self.opens[np.where(found, positions, 0)])
+        closes = (regular + SESSION_MINUTES * ONE_MINUTE).where(~found, self.closes[np.where(found, positions, 0)])
+        return opens, closes
+
+    def session_minutes(self, day=None):
+        session = self.session(day)
+        return 0 if session is None else int((session[1] - session[0]) // ONE_MINUTE)
+
+
+_calendars = {}
+
+
+def market_calendar(config):
+    # Shared per distinct holiday/special-session configuration
+    key = json.dumps([config.get('holidays', []), config.get('special_sessions', {})], sort_keys=True)
+    if key not in _calendars:
+        _calendars[key] = MarketCalendar.from_config(config)
+    return _calendars[key]
@@ -0,0 +1,74 @@
+import math
+import time
+from collections import deque
+
+# Lightweight in-process metrics. Histogram buckets count samples per range in
+# milliseconds; percentiles come from a bounded window of recent samples.
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, math.inf)
+
+
+class LatencyHistogram:
+    def __init__(self, name, window=1000):
+        self.name = name
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.recent.append(ms)
+
+    def time(self):
+        return _Timer(self)
+
+    def percentile(self, q):
+        if not self.recent:
+            return math.nan
+        ordered = sorted(self.recent)
+        return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+    def summary(self):
+        if not self.count:
+            return f"{self.name}: no samples"
+        return (f"{self.name}: n={self.count} mean={self.total_ms / self.count:.1f}ms "
+                f"p50={self.percentile(50):.1f}ms p95={self.percentile(95):.1f}ms max={self.max_ms:.1f}ms")
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start)
+        return False
+
+
+class Throughput:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.started = time.monotonic()
+
+    def add(self, n):
+        self.count += n
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return f"{self.name}: {self.count} rows, {self.rate():.2f} rows/s"
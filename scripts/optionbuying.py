@@ -1,13 +1,23 @@
 import os
+import sys
 import json
 import asyncio
 import aiomysql
 import pytz
 import pandas as pd
 import numpy as np
-from datetime import datetime, time, timedelta
-from scipy.signal import find_peaks
+from datetime import datetime
 from breeze_connect import BreezeConnect
+from db_pool import close_pools, get_pool
+from executors import get_executor
+from fanout import run_per_symbol
+from history_store import cached_history
+from bar_ring import attach_ring, ring_since
+from instruments import DEFAULT_SYMBOL, configured_symbols, instrument
+from market_calendar import market_calendar
+from timeframes import indicator_table
+from peaks import PeakTroughTracker
+from signals import CrossoverTracker, trading_bot_events, trading_bot_masks, trading_bot_strike, trading_bot_triggers
 import logging
 
 # Get the absolute path of the project root
@@ -31,183 +41,63 @@ logging.basicConfig(
 IST = pytz.timezone('Asia/Kolkata')
 
 class TradingBot:
-    def __init__(self, config):
+    def __init__(self, config, api=None, timeframe='1m', symbol=DEFAULT_SYMBOL):
         self.config = config
-        self.api = BreezeConnect(api_key=config['api_key'])
-        self.api.generate_session(api_secret=config['secret_key'], session_token=config['api_session'])
+        self.calendar = market_calendar(config)
+        self.timeframe = timeframe
+        self.symbol = symbol
+        self.instrument = instrument(config, symbol)
+        self.indicator_table = indicator_table(timeframe, symbol)
+        self.tracker = CrossoverTracker(trading_bot_events, trading_bot_masks)
+        self.peaks = PeakTroughTracker.from_config(config)
+        if api is None:
+            api = BreezeConnect(api_key=config['api_key'])
+            api.generate_session(api_secret=config['secret_key'], session_token=config['api_session'])
+        self.api = api
+        self.ring = None
 
     async def get_mysql_pool(self):
-        db_config = self.config['db_config']
-        port = int(db_config['port'])
-        pool = await aiomysql.create_pool(
-            host=db_config['host'],
-            port=port,
-            user=db_config['user'],
-            password=db_config['password'],
-            db=db_config['database'],
-            autocommit=True,
-            minsize=5,
-            maxsize=20
-        )
-        return pool
-
-    def is_market_open(self):
-        current_time = datetime.now(IST).time()
-        open_time = datetime.strptime('09:15', '%H:%M').time()
-        close_time = datetime.strptime('15:30', '%H:%M').time()
-        is_open = open_time <= current_time < close_time
-        ## print(f"Market open status: {is_open}")
-        return is_open
-
-    def is_business_day(self, date):
-        is_business = date.weekday() < 5 and date.strftime(
-            '%Y-%m-%d') not in self.config['holidays']
-        ## print(f"Date {date.strftime('%Y-%m-%d')} is business day: {is_business}")
-        return is_business
-
-    def get_sleep_duration(self):
-        current_datetime = datetime.now(IST)
-        current_time = current_datetime.time()
-        next_market_open_datetime = current_datetime.replace(
-            hour=9, minute=15, second=0, microsecond=0)
-
-        if current_time >= next_market_open_datetime.time():
-            next_market_open_datetime += timedelta(days=1)
-
-        while not self.is_business_day(next_market_open_datetime):
-            next_market_open_datetime += timedelta(days=1)
-
-        sleep_duration = (next_market_open_datetime -
-                          current_datetime).total_seconds()
-        ## print(
-        ##     f"Sleep duration until next market open: {sleep_duration} seconds")
-        return sleep_duration
-
-    async def fetch_indicators_data(self, pool, table_name):
-        query = f'SELECT * FROM `{table_name}` ORDER BY `datetime`'
+        return await get_pool(self.config)
+
+    async def fetch_indicators_data(self, pool, table_name, since=None):
+        if since is None:
+            data = await cached_history(self.config, pool, table_name)
+            if data is not None:
+                return data
+            query, args = f'SELECT * FROM `{table_name}` ORDER BY `datetime`', None
+        else:
+            query, args = f'SELECT * FROM `{table_name}` WHERE `datetime` >= %s ORDER BY `datetime`', (since,)
         async with pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(query)
+                await cur.execute(query, args)
                 result = await cur.fetchall()
-                data = pd.DataFrame(result)
-                data['datetime'] = pd.to_datetime(data['datetime'])
-                data = data.sort_values(by='datetime', ascending=True)
-        return data
-
-    async def get_peak_trough(self, data):
+                columns = [col[0] for col in cur.description]
+        if not result:
+            return pd.DataFrame()
+        # float64 straight from the rows, as the signals were tuned on; NULL flags stay NaN
+        data = pd.DataFrame(result, columns=columns)
         data['datetime'] = pd.to_datetime(data['datetime'])
-        highs_array = data['highsma5'].to_numpy()
-        lows_array = data['lowsma5'].to_numpy()
-
-        peaks, properties_peaks = find_peaks(highs_array, prominence=True)
-        troughs, properties_troughs = find_peaks(-lows_array, prominence=True)
-
-        peak_df = pd.DataFrame({
-            'Datetime': data['datetime'].to_numpy()[peaks],
-            'PeakValue': highs_array[peaks],
-            'PeakProm': properties_peaks['prominences']
-        })
-        trough_df = pd.DataFrame({
-            'Datetime': data['datetime'].to_numpy()[troughs],
-            'TroughValue': lows_array[troughs],
-            'TroughProm': properties_troughs['prominences']
-        })
-
-        # peak_df_filtered = peak_df[peak_df['PeakProm'] > 80]
-        # trough_df_filtered = trough_df[trough_df['TroughProm'] > 80]
-
-        ##peak_sorted_df = peak_df_filtered.sort_values(by='Datetime', ascending=True)
-        ##trough_sorted_df = trough_df_filtered.sort_values(by='Datetime', ascending=True)
-
-        peak_sorted_df = peak_df.sort_values(by='Datetime', ascending=True)
-        trough_sorted_df = trough_df.sort_values(by='Datetime', ascending=True)
-
-        latest_peak_row = peak_sorted_df.iloc[-1] if not peak_sorted_df.empty else pd.Series()
-        latest_trough_row = trough_sorted_df.iloc[-1] if not trough_sorted_df.empty else pd.Series()
+        return data
 
-        return latest_peak_row, latest_trough_row, peak_sorted_df, trough_sorted_df
+    async def get_peak_trough(self):
+        # Latest confirmed peak/trough from the incremental tracker
+        return self.peaks.latest_peak_row(), self.peaks.latest_trough_row()
 
     async def get_strike_prices(self, latest_peak_row, latest_trough_row):
-        if latest_peak_row.empty or latest_trough_row.empty:
-            return None, None, None, None
-
-        latest_peak_prom = latest_peak_row['PeakProm']
-        latest_peak_value = latest_peak_row['PeakValue']
-        latest_peak_datetime = latest_peak_row['Datetime']
-        latest_trough_prom = latest_trough_row['TroughProm']
-        latest_trough_value = latest_trough_row['TroughValue']
-        latest_trough_datetime = latest_trough_row['Datetime']
-
-        strike_price_ce = int(
-            (latest_trough_value - latest_trough_value % 100) + 100)
-        strike_price_pe = int(
-            (latest_peak_value - latest_peak_value % 100) - 100)
-
-        max_peak_trough_datetime = max(latest_peak_datetime, latest_trough_datetime)
-        ##peak_trough_range = (latest_peak_value - latest_trough_value).round(2)
-
-        ##if max_peak_trough_datetime == latest_peak_datetime and peak_trough_range >= 70:
-        if max_peak_trough_datetime == latest_peak_datetime:
-            # if latest_peak_prom > latest_trough_prom:
-                ## return strike_price_pe, "put", max_peak_trough_datetime, peak_trough_range
-            return strike_price_pe, "put", max_peak_trough_datetime
-        ##elif max_peak_trough_datetime == latest_trough_datetime and peak_trough_range >= 70:
-        elif max_peak_trough_datetime == latest_trough_datetime:
-            # if latest_peak_prom < latest_trough_prom:
-                ## return strike_price_ce, "call", max_peak_trough_datetime, peak_trough_range
-            return strike_price_ce, "call", max_peak_trough_datetime
-
-        # return None, None, max_peak_trough_datetime, peak_trough_range
-        return None, None, max_peak_trough_datetime
+        return trading_bot_strike(latest_peak_row, latest_trough_row, self.instrument['strike_step'],
+                                  self.config.get('peak_trough', {}).get('min_range'))
 
     async def TrendUp2_cross(self, data):
-        TrendUp2crossover = (data['TrendUp2'] == 1) & (data['TrendUp2'].shift(1) == 0)
-        TrendUp2crossunder = (data['TrendUp2'] == 0) & (data['TrendUp2'].shift(1) == 1)
-        return data.loc[TrendUp2crossover], data.loc[TrendUp2crossunder]
+        masks = trading_bot_masks(data)
+        return data.loc[masks['trendup2_crossover']], data.loc[masks['trendup2_crossunder']]
 
     async def get_entry_trigger(self, latest_peak_row, latest_trough_row, TrendUp2crossover, TrendUp2crossunder):
         if latest_peak_row.empty or latest_trough_row.empty:
-            return None, None
-
-        latest_peak_datetime = latest_peak_row['Datetime']
-        latest_trough_datetime = latest_trough_row['Datetime']
-        latest_trendup2_crossover_datetime = TrendUp2crossover['datetime'].max() if not TrendUp2crossover.empty else pd.Timestamp.min
-        latest_trendup2_crossunder_datetime = TrendUp2crossunder['datetime'].max() if not TrendUp2crossunder.empty else pd.Timestamp.min
-        max_trendup2cross_datetime = max(latest_trendup2_crossover_datetime, latest_trendup2_crossunder_datetime)
-        max_peak_trough_datetime = max(latest_peak_datetime, latest_trough_datetime)
-
-        trendup2_crossunder_vstop2 = TrendUp2crossunder.iloc[-1]['VStop2'] if not TrendUp2crossunder.empty else float('inf')
-        trendup2_crossunder_highsma5 = TrendUp2crossunder.iloc[-1]['highsma5'] if not TrendUp2crossunder.empty else float('inf')
-        trendup2_crossunder_highsma5_off3 = TrendUp2crossunder.iloc[-1]['highsma5_off3'] if not TrendUp2crossunder.empty else float('inf')
-
-        trendup2_crossover_vstop2 = TrendUp2crossover.iloc[-1]['VStop2'] if not TrendUp2crossover.empty else -float('inf')
-        trendup2_crossover_lowsma5 = TrendUp2crossover.iloc[-1]['lowsma5'] if not TrendUp2crossover.empty else -float('inf')
-        trendup2_crossover_lowsma5_off3 = TrendUp2crossover.iloc[-1]['lowsma5_off3'] if not TrendUp2crossover.empty else -float('inf')
-
-        call_entry_trigger = None
-        put_entry_trigger = None
-
-        if not latest_peak_row.empty and not latest_trough_row.empty:
-            if (max_peak_trough_datetime == latest_peak_datetime) and (max_trendup2cross_datetime > max_peak_trough_datetime):
-                if not TrendUp2crossunder.empty and (max_trendup2cross_datetime == latest_trendup2_crossunder_datetime):
-                    if trendup2_crossunder_highsma5 < trendup2_crossunder_highsma5_off3 < trendup2_crossunder_vstop2:
-                        put_entry_trigger = trendup2_crossunder_highsma5_off3
-                        if trendup2_crossunder_highsma5 < trendup2_crossunder_vstop2:
-                            put_entry_trigger = trendup2_crossunder_highsma5
-                    else:
-                        put_entry_trigger = trendup2_crossunder_vstop2
-
-            elif (max_peak_trough_datetime == latest_trough_datetime) and (max_trendup2cross_datetime > max_peak_trough_datetime):
-                if not TrendUp2crossover.empty and (max_trendup2cross_datetime == latest_trendup2_crossover_datetime):
-                    if trendup2_crossover_lowsma5 > trendup2_crossover_lowsma5_off3 > trendup2_crossover_vstop2:
-                        call_entry_trigger = trendup2_crossover_lowsma5_off3
-                        if trendup2_crossover_lowsma5 > trendup2_crossover_vstop2:
-                            call_entry_trigger = trendup2_crossover_lowsma5
-                    else:
-                        call_entry_trigger = trendup2_crossover_vstop2
-
-        # return call_entry_trigger, put_entry_trigger
-        return call_entry_trigger, put_entry_trigger, max_trendup2cross_datetime
+            return None, None, None
+        return trading_bot_triggers(
+            latest_peak_row, latest_trough_row,
+            TrendUp2crossover.iloc[-1] if not TrendUp2crossover.empty else None,
+            TrendUp2crossunder.iloc[-1] if not TrendUp2crossunder.empty else None)
 
     async def place_order(self, option_type, strike_price, max_peak_trough_datetime, entry_trigger_price):
         if not strike_price or not option_type:
@@ -219,14 +109,15 @@ class TradingBot:
         # expiry_date = self.default_expiry_date  # Default expiry date
         expiry_date = self.config['expiry_date']
 
-        response = self.api.place_order(
-            stock_code="CNXBAN",
+        response = await get_executor(self.config, 'breeze').call(
+            self.api.place_order,
+            stock_code=self.instrument['stock_code'],
             exchange_code="NFO",
             product="options",
             action=transaction_type,
             order_type="market",
             stoploss="",
-            quantity="15",
+            quantity=self.instrument['quantity'],
             price="",
             validity="day",
             validity_date=datetime.now(pytz.timezone(
@@ -242,47 +133,90 @@ class TradingBot:
         logging.info(
             f"Order placed for {option_type} {strike_price} at price {entry_trigger_price}: {response}")
 
+    async def decide(self, last_row):
+        latest_peak_row, latest_trough_row = await self.get_peak_trough()
+        call_entry_trigger, put_entry_trigger, max_trendup2cross_datetime = trading_bot_triggers(
+            latest_peak_row, latest_trough_row,
+            self.tracker.latest.get('trendup2_crossover'), self.tracker.latest.get('trendup2_crossunder'))
+        logging.info("call_entry_trigger: %s", call_entry_trigger)
+        logging.info("put_entry_trigger: %s", put_entry_trigger)
+        logging.info("max_trendup2cross_datetime: %s",
+                     max_trendup2cross_datetime)
+
+        # strike_price, option_type, max_peak_trough_datetime, peak_trough_range = await self.get_strike_prices(latest_peak_row, latest_trough_row)
+        strike_price, option_type, max_peak_trough_datetime = await self.get_strike_prices(latest_peak_row, latest_trough_row)
+        logging.info("strike_price: %s", strike_price)
+        logging.info("option_type: %s", option_type)
+        logging.info("max_peak_trough_datetime: %s", max_peak_trough_datetime)
+        # logging.info("peak_trough_range: %s", peak_trough_range)
+
+        if option_type == 'call' and call_entry_trigger and strike_price is not None:
+            if (call_entry_trigger > last_row['low']):
+                await self.place_order(option_type, strike_price, max_peak_trough_datetime, call_entry_trigger)
+        elif option_type == 'put' and put_entry_trigger and strike_price is not None:
+            if (put_entry_trigger < last_row['high']):
+                await self.place_order(option_type, strike_price, max_peak_trough_datetime, put_entry_trigger)
+
+    def seed(self, data):
+        self.tracker.seed(data)
+        self.peaks.seed(data)
+
+    async def evaluate(self, data):
+        # Full-history evaluation; also (re)seeds the incremental tracker
+        self.seed(data)
+        if data.empty:
+            return
+        await self.decide(data.iloc[-1])
+
+    async def on_rows(self, rows):
+        # New or revised indicator rows, oldest first
+        records = rows.to_dict('records')
+        if not records:
+            return
+        self.tracker.apply(records)
+        self.peaks.apply(records)
+        await self.decide(records[-1])
+
+    def attach_ring(self):
+        # indicator_update.py's ring of new indicator rows, when it is running
+        if self.timeframe == '1m':
+            self.ring = attach_ring(self.config, 'indicators', self.symbol, self.ring)
+
     async def run(self):
-        table_name = "indicators_data"
+        table_name = self.indicator_table
         pool = await self.get_mysql_pool()
-        try:
+        if not self.tracker.is_seeded:
             data = await self.fetch_indicators_data(pool, table_name)
-            latest_peak_row, latest_trough_row, _, _ = await self.get_peak_trough(data)
-            TrendUp2crossover, TrendUp2crossunder = await self.TrendUp2_cross(data)
-            call_entry_trigger, put_entry_trigger, max_trendup2cross_datetime = await self.get_entry_trigger(latest_peak_row, latest_trough_row, TrendUp2crossover, TrendUp2crossunder)
-            logging.info("call_entry_trigger: %s", call_entry_trigger)
-            logging.info("put_entry_trigger: %s", put_entry_trigger)
-            logging.info("max_trendup2cross_datetime: %s",
-                         max_trendup2cross_datetime)
-
-            # strike_price, option_type, max_peak_trough_datetime, peak_trough_range = await self.get_strike_prices(latest_peak_row, latest_trough_row)
-            strike_price, option_type, max_peak_trough_datetime = await self.get_strike_prices(latest_peak_row, latest_trough_row)
-            logging.info("strike_price: %s", strike_price)
-            logging.info("option_type: %s", option_type)
-            logging.info("max_peak_trough_datetime: %s", max_peak_trough_datetime)
-            # logging.info("peak_trough_range: %s", peak_trough_range)
+            await self.evaluate(data)
+            return
+        # Only the rows inside the tracker's rewind window are read back
+        rows = ring_since(self.ring, self.tracker.resume_from)
+        if rows is not None:
+            rows = rows.to_frame()
+        else:
+            rows = await self.fetch_indicators_data(pool, table_name, since=self.tracker.resume_from)
+        try:
+            await self.on_rows(rows)
+        except ValueError as e:
+            logging.info(f"{e}, reseeding crossover and peak state")
+            self.tracker.reset()
+            await self.run()
 
-            if option_type == 'call' and call_entry_trigger and strike_price is not None:
-                if (call_entry_trigger > data['low'].iloc[-1]):
-                    await self.place_order(option_type, strike_price, max_peak_trough_datetime, call_entry_trigger)
-            elif option_type == 'put' and put_entry_trigger and strike_price is not None:
-                if (put_entry_trigger < data['high'].iloc[-1]):
-                    await self.place_order(option_type, strike_price, max_peak_trough_datetime, put_entry_trigger)
+    async def run_scheduled(self):
+        try:
+            await self.run_loop()
         finally:
-            pool.close()
-            await pool.wait_closed()
+            await close_pools()
 
-    async def run_scheduled(self):
-        
+    async def run_loop(self):
         while True:
             now = datetime.now(IST)
-            if self.is_market_open():
-                if self.is_business_day(datetime.now(IST)):
-                    # logging.info("Starting execution at: %s", now)
-                    await self.run()
-                    # logging.info("Execution completed at: %s", now)
-                else:
-                    print("Today is not a business day: %s", now)
+            if self.calendar.is_open():
+                # logging.info("Starting execution at: %s", now)
+                self.attach_ring()
+                seen = self.ring.writes if self.ring is not None else None
+                await self.run()
+                # logging.info("Execution completed at: %s", now)
 
                 current_time = datetime.now(IST)
                 period_now = pd.Period.now('1min')
@@ -291,15 +225,29 @@ class TradingBot:
                 next_execution = (next_period_start +  pd.Timedelta(seconds=8))
                 sleep_till = (next_execution - current_time).total_seconds()
                 if sleep_till > 0 and sleep_till < 64:
-                    await asyncio.sleep(sleep_till)
+                    if seen is not None:
+                        # Run again as soon as indicator_update.py publishes rows
+                        await self.ring.wait(seen, sleep_till)
+                    else:
+                        await asyncio.sleep(sleep_till)
             else:
                 print("Outside trading hours: %s", now)
-                sleep_duration = self.get_sleep_duration()
+                sleep_duration = self.calendar.seconds_until_open()
                 await asyncio.sleep(sleep_duration)
 
+async def run_all(config, timeframe='1m'):
+    # One BreezeConnect session is shared by every symbol's strategy
+    bots = [TradingBot(config, timeframe=timeframe, symbol=configured_symbols(config)[0])]
+    for symbol in configured_symbols(config)[1:]:
+        bots.append(TradingBot(config, api=bots[0].api, timeframe=timeframe, symbol=symbol))
+    try:
+        await run_per_symbol(bots, 'run_loop')
+    finally:
+        await close_pools()
+
 if __name__ == "__main__":
     with open(config_path, 'r') as f:
         config = json.load(f)
 
-    bot = TradingBot(config)
-    asyncio.run(bot.run_scheduled())
+    timeframe = sys.argv[1] if len(sys.argv) > 1 else config.get('timeframe', '1m')
+    asyncio.run(run_all(config, timeframe))
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import math
+import warnings
+import asyncio
+import aiomysql
+import numpy as np
+import pandas as pd
+from collections import deque
+from scipy.signal import find_peaks
+from db_pool import close_pools, get_pool
+from history_store import cached_history
+from instruments import DEFAULT_SYMBOL
+from timeframes import indicator_table
+
+# Online replacement for find_peaks(x, prominence=True) when only the latest
+# peak is used. Local maxima are confirmed as bars arrive with the same rules
+# as scipy (strict rise, plateaus reported at their midpoint, strict fall).
+# Prominence follows scipy's wlen semantics: bases are searched at most
+# wlen // 2 bars either side of the peak, so a peak's left base is final once
+# it is confirmed and its right base only moves until a higher bar or the end
+# of the window. Only peaks whose right base can still move are kept.
+#
+# min_prominence is find_peaks' `prominence` argument: the original call's
+# prominence=True keeps peaks with a prominence of at least 1.
+#
+# check_parity() streams a frame through the tracker and compares it with
+# find_peaks(..., wlen=window) on every prefix.
+
+DEFAULT_WINDOW = 751  # one 375-bar session either side of the peak
+
+
+def _number(value):
+    return math.nan if value is None else float(value)
+
+
+class PeakTracker:
+    def __init__(self, window=DEFAULT_WINDOW, min_prominence=1, margin=16):
+        self.half = int(window) // 2
+        self.min_prominence = min_prominence
+        # (index, datetime, value) of recent bars for the left-base search; the
+        # margin covers bars dropped again by a rewind
+        self.values = deque(maxlen=int(window) + margin)
+        self.count = 0
+        self.candidate = None  # (index, value) of a rise that may become a peak
+        self.open = []  # (index, datetime, value, left_min, right_min), oldest first
+        self.latest = None  # (index, datetime, value, prominence) of the last settled peak
+
+    def state(self):
+        return self.count, self.candidate, tuple(self.open), self.latest
+
+    def restore(self, state):
+        self.count, self.candidate, open_peaks, self.latest = state
+        self.open = list(open_peaks)
+        while self.values and self.values[-1][0] >= self.count:
+            self.values.pop()
+
+    def qualifies(self, prominence):
+        return prominence >= self.min_prominence
+
+    def settle(self, peak):
+        index, dt, value, left_min, right_min = peak
+        prominence = value - max(left_min, right_min)
+        if self.qualifies(prominence) and (self.latest is None or index > self.latest[0]):
+            self.latest = (index, dt, value, prominence)
+
+    def update(self, dt, value):
+        value = _number(value)
+        k = self.count
+        prev = self.values[-1][2] if self.values else math.nan
+        self.values.append((k, dt, value))
+        self.count += 1
+
+        still_open = []
+        for peak in self.open:
+            index, peak_dt, peak_value, left_min, right_min = peak
+            if k > index + self.half or not value <= peak_value:
+                self.settle(peak)
+            else:
+                still_open.append((index, peak_dt, peak_value, left_min, min(right_min, value)))
+        self.open = still_open
+
+        # Local maxima as in scipy's _local_maxima_1d
+        if self.candidate is not None:
+            start, start_value = self.candidate
+            if value == start_value:
+                return
+            self.candidate = None
+            if value < start_value:
+                self.confirm((start + k - 1) // 2, k)
+        if prev < value:
+            self.candidate = (k, value)
+
+    def confirm(self, index, last):
+        first = self.values[0][0]
+        _, dt, value = self.values[index - first]
+
+        left_min, i = value, index
+        lowest = max(index - self.half, first)
+        while i >= lowest and self.values[i - first][2] <= value:
+            left_min = min(left_min, self.values[i - first][2])
+            i -= 1
+
+        right_min, i = value, index
+        highest = min(index + self.half, last)
+        while i <= highest and self.values[i - first][2] <= value:
+            right_min = min(right_min, self.values[i - first][2])
+            i += 1
+
+        peak = (index, dt, value, left_min, right_min)
+        if i <= last:
+            # Bounded by a higher bar or the window already
+            self.settle(peak)
+        else:
+            self.open.append(peak)
+
+    def latest_peak(self):
+        # (datetime, value, prominence) of the most recent qualifying peak
+        latest = self.latest
+        for index, dt, value, left_min, right_min in reversed(self.open):
+            if latest is not None and index < latest[0]:
+                break
+            prominence = value - max(left_min, right_min)
+            if self.qualifies(prominence):
+                latest = (index, dt, value, prominence)
+                break
+        return latest[1:] if latest is not None else None
+
+
+class PeakTroughTracker:
+    # Latest peak of highsma5 and trough of lowsma5, in the row format of the
+    # original find_peaks frames
+    def __init__(self, window=DEFAULT_WINDOW, min_prominence=1, rewind=10):
+        self.window = window
+        self.min_prominence = min_prominence
+        self.rewind = rewind
+        self.peaks = PeakTracker(window, min_prominence)
+        self.troughs = PeakTracker(window, min_prominence)
+        self.snapshots = deque(maxlen=rewind)
+
+    @classmethod
+    def from_config(cls, config):
+        settings = config.get('peak_trough', {})
+        return cls(settings.get('window', DEFAULT_WINDOW), settings.get('min_prominence', 1))
+
+    @property
+    def resume_from(self):
+        return self.snapshots[0][0] if self.snapshots else None
+
+    def reset(self):
+        self.peaks = PeakTracker(self.window, self.min_prominence)
+        self.troughs = PeakTracker(self.window, self.min_prominence)
+        self.snapshots.clear()
+
+    def add(self, dt, high, low):
+        self.peaks.update(dt, high)
+        self.troughs.update(dt, -_number(low))
+
+    def seed(self, data):
+        self.reset()
+        settled = data.iloc[:-self.rewind] if len(data) > self.rewind else data.iloc[:0]
+        for dt, high, low in zip(settled['datetime'], settled['highsma5'], settled['lowsma5']):
+            self.add(dt, high, low)
+        self.apply(data.iloc[len(settled):].to_dict('records'))
+
+    def apply(self, rows):
+        # rows: dicts in datetime order, starting at or after resume_from
+        if not rows:
+            return
+        first = rows[0]['datetime']
+        if self.snapshots and first <= self.snapshots[-1][0]:
+            if first < self.snapshots[0][0]:
+                raise ValueError(f"Row {first} is older than the peak tracker's rewind window")
+            while self.snapshots and self.snapshots[-1][0] >= first:
+                _, peaks, troughs = self.snapshots.pop()
+                self.peaks.restore(peaks)
+                self.troughs.restore(troughs)
+        for row in rows:
+            self.snapshots.append((row['datetime'], self.peaks.state(), self.troughs.state()))
+            self.add(row['datetime'], row['highsma5'], row['lowsma5'])
+
+    def latest_peak_row(self):
+        peak = self.peaks.latest_peak()
+        if peak is None:
+            return pd.Series(dtype=object)
+        dt, value, prominence = peak
+        return pd.Series({'Datetime': dt, 'PeakValue': value, 'PeakProm': prominence})
+
+    def latest_trough_row(self):
+        trough = self.troughs.latest_peak()
+        if trough is None:
+            return pd.Series(dtype=object)
+        dt, value, prominence = trough
+        return pd.Series({'Datetime': dt, 'TroughValue': -value, 'TroughProm': prominence})
+
+
+def peak_trough_frames(data, window=None, min_prominence=1):
+    # The full-history computation the tracker replaces; window=None is
+    # find_peaks' unbounded prominence search
+    highs_array = data['highsma5'].to_numpy(dtype=float)
+    lows_array = data['lowsma5'].to_numpy(dtype=float)
+
+    peaks, properties_peaks = find_peaks(highs_array, prominence=min_prominence, wlen=window)
+    troughs, properties_troughs = find_peaks(-lows_array, prominence=min_prominence, wlen=window)
+
+    peak_df = pd.DataFrame({
+        'Datetime': data['datetime'].to_numpy()[peaks],
+        'PeakValue': highs_array[peaks],
+        'PeakProm': properties_peaks['prominences']
+    })
+    trough_df = pd.DataFrame({
+        'Datetime': data['datetime'].to_numpy()[troughs],
+        'TroughValue': lows_array[troughs],
+        'TroughProm': properties_troughs['prominences']
+    })
+    return peak_df, trough_df
+
+
+def _same(expected, row, value_column, prominence_column):
+    if expected.empty or row.empty:
+        return expected.empty and row.empty
+    expected = expected.iloc[-1]
+    return (pd.Timestamp(expected['Datetime']) == pd.Timestamp(row['Datetime'])
+            and expected[value_column] == row[value_column]
+            and np.isclose(expected[prominence_column], row[prominence_column]))
+
+
+def check_parity(data, window=DEFAULT_WINDOW, min_prominence=1, step=1):
+    # Stream data through the tracker and compare the latest peak/trough with
+    # find_peaks on the same prefix every `step` bars; returns the mismatches
+    data = data.reset_index(drop=True)
+    tracker = PeakTroughTracker(window, min_prominence)
+    mismatches = []
+    for i, (dt, high, low) in enumerate(zip(data['datetime'], data['highsma5'], data['lowsma5'])):
+        tracker.add(dt, high, low)
+        if (i + 1) % step and i != len(data) - 1:
+            continue
+        with warnings.catch_warnings():
+            # find_peaks warns about zero-prominence plateaus on short prefixes
+            warnings.simplefilter('ignore')
+            peak_df, trough_df = peak_trough_frames(data.iloc[:i + 1], window, min_prominence)
+        peak_row, trough_row = tracker.latest_peak_row(), tracker.latest_trough_row()
+        if not _same(peak_df, peak_row, 'PeakValue', 'PeakProm'):
+            mismatches.append((dt, 'peak', peak_df.tail(1).to_dict('records'), peak_row.to_dict()))
+        if not _same(trough_df, trough_row, 'TroughValue', 'TroughProm'):
+            mismatches.append((dt, 'trough', trough_df.tail(1).to_dict('records'), trough_row.to_dict()))
+    return mismatches
+
+
+async def load_indicator_history(config, table_name):
+    pool = await get_pool(config)
+    data = await cached_history(config, pool, table_name, columns=['highsma5', 'lowsma5'])
+    if data is not None:
+        return data
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(f'SELECT `datetime`, `highsma5`, `lowsma5` FROM `{table_name}` ORDER BY `datetime`')
+            result = await cur.fetchall()
+    data = pd.DataFrame(result, columns=['datetime', 'highsma5', 'lowsma5'])
+    data['datetime'] = pd.to_datetime(data['datetime'])
+    return data
+
+
+async def main(config, timeframe, symbol, step):
+    try:
+        data = await load_indicator_history(config, indicator_table(timeframe, symbol))
+    finally:
+        await close_pools()
+    settings = config.get('peak_trough', {})
+    mismatches = check_parity(data, settings.get('window', DEFAULT_WINDOW), settings.get('min_prominence', 1), step)
+    for mismatch in mismatches[:20]:
+        print(f"{mismatch[0]} {mismatch[1]}: find_peaks {mismatch[2]} tracker {mismatch[3]}")
+    print(f"{symbol} {timeframe}: {len(data)} rows checked every {step} bars, {len(mismatches)} mismatches")
+
+
+if __name__ == "__main__":
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    with open(os.path.join(project_root, 'config', 'config.json'), 'r') as f:
+        config = json.load(f)
+
+    # python peaks.py [timeframe] [symbol] [step]
+    timeframe = sys.argv[1] if len(sys.argv) > 1 else config.get('timeframe', '1m')
+    symbol = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SYMBOL
+    step = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    asyncio.run(main(config, timeframe, symbol, step))
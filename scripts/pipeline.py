@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import asyncio
+import pytz
+from datetime import timedelta
+from datasampling import Get1Mtickdata
+from indicator_update import IndicatorUpdate
+from db_pool import close_pools
+from metrics import LatencyHistogram
+from instruments import DEFAULT_SYMBOL
+from market_calendar import market_calendar
+from timeframes import ohlc_table
+
+# Get the absolute path of the project root
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Reference to config.json
+config_path = os.path.join(project_root, 'config', 'config.json')
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Single-process alternative to running datasampling.py, indicator_update.py and
+# a strategy script side by side. A bar from the Breeze feed flows through
+# asyncio queues into the incremental indicator engine and the strategy as soon
+# as it arrives; MySQL writes are queued to a background writer so they never
+# sit between candle close and the order decision.
+
+
+class StreamingPipeline:
+    def __init__(self, config, symbol=DEFAULT_SYMBOL, api=None):
+        self.config = config
+        self.calendar = market_calendar(config)
+        self.symbol = symbol
+        self.feed = Get1Mtickdata(config, api=api, symbols=[symbol])
+        self.indicators = IndicatorUpdate(config, symbol=symbol)
+        self.strategy = self.create_strategy(
+            config.get('streaming', {}).get('strategy', 'option_buying'))
+        self.loop = None
+        self.tick_queue = asyncio.Queue()
+        self.bar_queue = asyncio.Queue()
+        self.signal_queue = asyncio.Queue()
+        self.write_queue = asyncio.Queue()
+        # Receipt time of the bar the strategy is currently deciding on, so an
+        # order can be timed back to its candle close
+        self.evaluating = None
+        self.decision_latency = LatencyHistogram(f'{symbol} candle_to_decision')
+
+    def create_strategy(self, name):
+        # Imported lazily: each strategy module configures its own log file
+        if name == 'option_buying':
+            from obuying import OptionBuying
+            return OptionBuying(self.config, api=self.feed.api, symbol=self.symbol)
+        if name == 'trading_bot':
+            from optionbuying import TradingBot
+            return TradingBot(self.config, api=self.feed.api, symbol=self.symbol)
+        raise ValueError(f"Unknown streaming strategy: {name}")
+
+    def on_ticks(self, tick):
+        # Called on the Breeze websocket thread
+        self.loop.call_soon_threadsafe(self.tick_queue.put_nowait, (tick, time.monotonic()))
+
+    async def write(self, func, *args):
+        await self.write_queue.put((func, args))
+
+    async def writer(self, pool):
+        while True:
+            func, args = await self.write_queue.get()
+            try:
+                await func(pool, *args)
+            except Exception as e:
+                print(f"Error in background write {func.__name__}: {e}")
+            finally:
+                self.write_queue.task_done()
+
+    async def bar_stage(self):
+        while True:
+            tick, received = await self.tick_queue.get()
+            try:
+                tick_df = self.feed.build_tick_dataframe(tick)
+                if tick_df is None:
+                    continue
+                await self.write(self.feed.insert_tick_dataframe, ohlc_table('1m', self.symbol), tick_df)
+                for bar in tick_df.itertuples(index=False, name=None):
+                    await self.bar_queue.put((bar, received))
+            except Exception as e:
+                print(f"Error processing tick data: {e}")
+            finally:
+                self.tick_queue.task_done()
+
+    async def indicator_stage(self, pool):
+        engine = self.indicators.engine
+        while True:
+            bar, received = await self.bar_queue.get()
+            try:
+                last = engine.bars[-1][0] if engine.bars else None
+                if last is not None and bar[0] - last > timedelta(minutes=1) and bar[0].date() == last.date():
+                    print(f"Gap in streamed bars between {last} and {bar[0]}")
+                try:
+                    rows = engine.upsert(bar)
+                except ValueError as e:
+                    # Bar older than the rewind window: let pending writes
+                    # land, then rebuild from the database.
+                    print(f"{e}, rebuilding indicator state")
+                    await self.write_queue.join()
+                    rows = await self.indicators.rebuild_indicators(pool)
+                    if rows is None:
+                        continue
+                if not engine.is_ready:
+                    continue
+                await self.write(self.indicators.save_indicators_to_db, rows)
+                await self.signal_queue.put((rows, received))
+            except Exception as e:
+                print(f"Error updating indicators: {e}")
+            finally:
+                self.bar_queue.task_done()
+
+    def strategy_rows(self, rows):
+        # Same filter as save_indicators_to_db: all-zero or all-null candles never reach indicators_data
+        rows = rows[(rows[['open', 'high', 'low', 'close']].fillna(0) != 0).any(axis=1)]
+        return rows.astype({'TrendUp2': int, 'TrendUp3': int}).reset_index(drop=True)
+
+    async def strategy_stage(self, pool):
+        while True:
+            rows, received = await self.signal_queue.get()
+            self.evaluating = received
+            try:
+                try:
+                    await self.strategy.on_rows(self.strategy_rows(rows))
+                except ValueError as e:
+                    # Revision older than the strategy's rewind window
+                    print(f"{e}, reseeding strategy state")
+                    await self.write_queue.join()
+                    await self.load_history(pool)
+                latency = time.monotonic() - received
+                self.decision_latency.observe(latency)
+                print(f"Bar {rows['datetime'].iloc[-1]} evaluated {latency * 1000:.1f} ms after receipt")
+            except Exception as e:
+                print(f"Error evaluating strategy: {e}")
+            finally:
+                self.evaluating = None
+                self.signal_queue.task_done()
+
+    async def load_history(self, pool):
+        history = await self.strategy.fetch_indicators_data(pool, self.strategy.indicator_table)
+        self.strategy.seed(history)
+        print(f"Loaded {len(history)} indicator rows for the strategy")
+
+    def start_stages(self, pool):
+        self.loop = asyncio.get_running_loop()
+        return [
+            asyncio.create_task(self.writer(pool)),
+            asyncio.create_task(self.bar_stage()),
+            asyncio.create_task(self.indicator_stage(pool)),
+            asyncio.create_task(self.strategy_stage(pool)),
+        ]
+
+    async def drain(self):
+        # Wait until every queued bar has reached the strategy and its writes landed
+        for queue in (self.tick_queue, self.bar_queue, self.signal_queue, self.write_queue):
+            await queue.join()
+
+    async def run(self):
+        pool = await self.feed.get_mysql_pool()
+        await self.feed.create_tables_if_not_exists(pool)
+        await self.indicators.rebuild_indicators(pool)
+        await self.load_history(pool)
+        tasks = self.start_stages(pool)
+        try:
+            while True:
+                if self.calendar.is_open():
+                    await self.feed.connect_to_websocket(on_ticks=self.on_ticks)
+                    while self.calendar.is_open():
+                        await asyncio.sleep(1)
+                    await self.feed.disconnect_from_websocket()
+                else:
+                    sleep_duration = self.calendar.seconds_until_open()
+                    print(f"Market closed. Sleeping for {sleep_duration} seconds.")
+                    await asyncio.sleep(sleep_duration)
+        finally:
+            await self.write_queue.join()
+            for task in tasks:
+                task.cancel()
+            await close_pools()
+
+if __name__ == "__main__":
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    pipeline = StreamingPipeline(config, config.get('streaming', {}).get('symbol', DEFAULT_SYMBOL))
+    asyncio.run(pipeline.run())
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import aiomysql
+import pandas as pd
+from bar_aggregator import MinuteBarAggregator
+from db_pool import close_pools, get_pool, pool_manager
+from executors import get_executor, shutdown_executors
+from indicators import compute_indicators
+from instruments import DEFAULT_SYMBOL, feed_code, instrument, table_name
+from market_calendar import market_calendar
+from metrics import LatencyHistogram, Throughput
+from pipeline import StreamingPipeline
+from timeframes import ohlc_table
+
+# Plays recorded bars through the streaming pipeline without Breeze or market
+# hours. FakeBreeze stands in for BreezeConnect: subscriptions are recorded,
+# recorded candles are delivered through its on_ticks callback the way the
+# websocket delivers 1-minute candles, and place_order answers like a filled
+# market order. 1-second recordings are folded into minutes by the same
+# MinuteBarAggregator the 1s resampler uses, and each minute is released when
+# the second that closes it arrives.
+#
+# --speed 1 replays in real time, 10 ten times faster and max without any
+# pause; gaps between bars (overnight, missing minutes) are capped at
+# --max-gap seconds of replay time. The first --warmup minutes seed the
+# indicator engine and strategy without being timed.
+#
+# Writes go to an in-memory sink by default, so a CI run needs no database;
+# --db sends them to the configured db_config MySQL instead. Latency is
+# measured from the moment a candle is handed to the feed callback, i.e. its
+# close, to the strategy decision and to each place_order call.
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+config_path = os.path.join(project_root, 'config', 'config.json')
+
+ONE_MINUTE = pd.Timedelta(minutes=1)
+ONE_SECOND = pd.Timedelta(seconds=1)
+
+
+class FakeBreeze:
+    # Just enough of BreezeConnect for Get1Mtickdata and the strategies
+    def __init__(self, order_delay=0.0, on_order=None):
+        self.order_delay = order_delay
+        self.on_order = on_order
+        self.on_ticks = None
+        self.connected = False
+        self.subscriptions = []
+        self.orders = []
+
+    def generate_session(self, api_secret=None, session_token=None):
+        pass
+
+    def ws_connect(self):
+        self.connected = True
+
+    def ws_disconnect(self):
+        self.connected = False
+        return True
+
+    def subscribe_feeds(self, stock_token=None, interval=None, **kwargs):
+        self.subscriptions.append((stock_token, interval))
+        return {'message': f'Stock {stock_token} subscribed successfully'}
+
+    def unsubscribe_feeds(self, stock_token=None, interval=None, **kwargs):
+        if (stock_token, interval) in self.subscriptions:
+            self.subscriptions.remove((stock_token, interval))
+        return {'message': f'Stock {stock_token} unsubscribed successfully'}
+
+    def deliver(self, tick):
+        if not self.connected or self.on_ticks is None:
+            raise RuntimeError("Ticks delivered before the websocket was connected")
+        self.on_ticks(tick)
+
+    def place_order(self, **kwargs):
+        # Runs on the breeze executor thread, like the real call
+        if self.on_order is not None:
+            self.on_order(kwargs)
+        if self.order_delay:
+            time.sleep(self.order_delay)
+        order_id = f'REPLAY{len(self.orders) + 1:06d}'
+        self.orders.append({**kwargs, 'order_id': order_id})
+        return {'Success': {'order_id': order_id, 'message': 'Successfully Placed the order'},
+                'Status': 200, 'Error': None}
+
+
+class MemoryPool:
+    # Write sink with the acquire()/cursor()/execute()/commit() surface of the
+    # aiomysql pool; reads come back empty
+    def __init__(self):
+        self.statements = 0
+        self.rows = {}
+
+    def acquire(self):
+        return _MemoryContext(_MemoryConnection(self))
+
+    def record(self, query, args):
+        self.statements += 1
+        if query.startswith('INSERT INTO'):
+            table = query.split('`')[1]
+            columns = query[query.index('(') + 1:query.index(')')].count(',') + 1
+            self.rows[table] = self.rows.get(table, 0) + len(args or ()) // columns
+
+    def summary(self):
+        tables = ', '.join(f'{table}={rows}' for table, rows in sorted(self.rows.items()))
+        return f"memory sink: {self.statements} statements, rows written: {tables or 'none'}"
+
+
+class _MemoryContext:
+    def __init__(self, value):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _MemoryConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, cursor_class=None):
+        return _MemoryContext(_MemoryCursor(self.pool))
+
+    async def commit(self):
+        pass
+
+
+class _MemoryCursor:
+    description = []
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def execute(self, query, args=None):
+        self.pool.record(query.strip(), args)
+
+    async def fetchall(self):
+        return []
+
+    async def fetchone(self):
+        return None
+
+
+def minute_ticks(bars, stock_code):
+    # (release time, Breeze 1-minute candle) for every recorded minute
+    for dt, open, high, low, close in bars[['datetime', 'open', 'high', 'low', 'close']].itertuples(index=False):
+        yield dt + ONE_MINUTE, {
+            'interval': '1minute', 'exchange_code': 'NSE', 'stock_code': stock_code,
+            'datetime': dt.strftime('%Y-%m-%d %H:%M:%S'),
+            'open': str(open), 'high': str(high), 'low': str(low), 'close': str(close),
+        }
+
+
+def second_ticks(seconds, stock_code, calendar):
+    # Seconds are folded into minutes as they arrive; a minute is released with
+    # the first second after it, the last one when the recording ends
+    aggregator = MinuteBarAggregator(calendar)
+    values = seconds[['datetime', 'open', 'high', 'low', 'close', 'ohlc4']]
+    last = None
+    for row in values.itertuples(index=False):
+        last = row[0]
+        closed = aggregator.add(*row[:1], *(float(value) for value in row[1:]))
+        if closed:
+            for _, tick in minute_ticks(aggregator.to_frame(closed), stock_code):
+                yield last + ONE_SECOND, tick
+    partial = aggregator.partial()
+    if partial is not None:
+        for _, tick in minute_ticks(aggregator.to_frame([partial]), stock_code):
+            yield last + ONE_SECOND, tick
+
+
+def with_ohlc4(data):
+    if 'ohlc4' not in data.columns:
+        data['ohlc4'] = ((data['open'] + data['high'] + data['low'] + data['close']) / 4).round(2)
+    return data
+
+
+def is_second_data(data):
+    steps = data['datetime'].diff().dropna()
+    return not steps.empty and steps.median() < ONE_MINUTE
+
+
+def split_warmup(data, warmup, calendar):
+    # Minute bars for the first `warmup` minutes, and the recording after them
+    minutes = data['datetime'].dt.floor('min')
+    distinct = minutes.drop_duplicates()
+    if len(distinct) > warmup:
+        head, tail = data[minutes < distinct.iloc[warmup]], data[minutes >= distinct.iloc[warmup]]
+    else:
+        head, tail = data, data.iloc[:0]
+    if is_second_data(data):
+        aggregator = MinuteBarAggregator(calendar)
+        closed = aggregator.add_frame(head)
+        partial = aggregator.partial()
+        head = MinuteBarAggregator.to_frame(closed + ([partial] if partial is not None else []))
+    return head.reset_index(drop=True), tail.reset_index(drop=True)
+
+
+class Replay:
+    def __init__(self, config, data, symbol=DEFAULT_SYMBOL, speed=None, max_gap=60.0,
+                 warmup=None, order_delay=0.0):
+        self.config = config
+        self.data = with_ohlc4(data.sort_values(by='datetime', ignore_index=True))
+        self.symbol = symbol
+        self.speed = speed  # None replays as fast as possible
+        self.max_gap = max_gap
+        self.order_latency = LatencyHistogram(f'{symbol} candle_to_order')
+        self.api = FakeBreeze(order_delay, on_order=self.on_order)
+        self.pipeline = StreamingPipeline(config, symbol, api=self.api)
+        self.warmup = self.pipeline.indicators.warmup_window() if warmup is None else warmup
+        self.bars = Throughput(f'{symbol} replayed bars')
+
+    def on_order(self, order):
+        received = self.pipeline.evaluating
+        if received is not None:
+            self.order_latency.observe(time.monotonic() - received)
+
+    def seed(self, bars):
+        # Stand-in for rebuild_indicators/load_history, straight from the recording
+        if bars.empty:
+            return
+        pipeline = self.pipeline
+        pipeline.indicators.engine.rebuild(bars)
+        history = compute_indicators(bars[['datetime', 'open', 'high', 'low', 'close', 'ohlc4']].copy())
+        history = history.iloc[pipeline.indicators.engine.warmup:]
+        pipeline.strategy.seed(pipeline.strategy_rows(history))
+        print(f"Seeded the pipeline with {len(bars)} bars up to {bars['datetime'].iloc[-1]}")
+
+    def ticks(self, data):
+        stock_code = feed_code(instrument(self.config, self.symbol))
+        if is_second_data(self.data):
+            return second_ticks(data, stock_code, market_calendar(self.config))
+        return minute_ticks(data, stock_code)
+
+    async def play(self, data):
+        start, previous, offset = time.monotonic(), None, 0.0
+        for release, tick in self.ticks(data):
+            if self.speed is not None:
+                if previous is not None:
+                    offset += min((release - previous).total_seconds(), self.max_gap) / self.speed
+                previous = release
+                delay = start + offset - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.api.deliver(tick)
+            self.bars.add(1)
+            # Let the pipeline stages run between candles, as they would between websocket messages
+            await asyncio.sleep(0)
+
+    async def run(self, pool):
+        pipeline = self.pipeline
+        await pipeline.feed.create_tables_if_not_exists(pool)
+        warmup, recording = split_warmup(self.data, self.warmup, market_calendar(self.config))
+        self.seed(warmup)
+        tasks = pipeline.start_stages(pool)
+        try:
+            await pipeline.feed.connect_to_websocket(on_ticks=pipeline.on_ticks)
+            self.bars = Throughput(f'{self.symbol} replayed bars')
+            await self.play(recording)
+            await pipeline.drain()
+            await pipeline.feed.disconnect_from_websocket()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def report(self):
+        print(self.bars.summary())
+        print(self.pipeline.decision_latency.summary())
+        print(self.order_latency.summary())
+        print(f"{len(self.api.orders)} orders placed")
+        print(get_executor(self.config, 'breeze').summary())
+
+
+def load_file(path):
+    if path.endswith('.parquet'):
+        data = pd.read_parquet(path)  # needs pyarrow or fastparquet
+    elif path.endswith('.pkl'):
+        data = pd.read_pickle(path)
+    else:
+        data = pd.read_csv(path)
+    data['datetime'] = pd.to_datetime(data['datetime'])
+    return data
+
+
+async def load_db(config, table, since=None, until=None):
+    conditions, args = [], []
+    if since is not None:
+        conditions.append('`datetime` >= %s')
+        args.append(since)
+    if until is not None:
+        conditions.append('`datetime` < %s')
+        args.append(until)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    pool = await get_pool(config)
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(f'SELECT * FROM `{table}`{where} ORDER BY `datetime`', args or None)
+            result = await cur.fetchall()
+    data = pd.DataFrame(result, columns=['datetime', 'open', 'high', 'low', 'close', 'ohlc4'])
+    data['datetime'] = pd.to_datetime(data['datetime'])
+    return data
+
+
+def parse_speed(value):
+    return None if value == 'max' else float(value)
+
+
+async def main(config, args):
+    try:
+        if args.file:
+            data = load_file(args.file)
+        else:
+            table = table_name('ohlctick_1sdata', args.symbol) if args.seconds else ohlc_table('1m', args.symbol)
+            data = await load_db(config, table, args.since, args.until)
+        if data.empty:
+            print("No bars to replay")
+            return 1
+        replay = Replay(config, data, args.symbol, parse_speed(args.speed), args.max_gap,
+                        args.warmup, args.order_delay)
+        pool = await get_pool(config) if args.db else MemoryPool()
+        await replay.run(pool)
+        replay.report()
+        if args.db:
+            pool_manager.log_stats()
+        else:
+            print(pool.summary())
+    finally:
+        await close_pools()
+        shutdown_executors()
+
+    p95 = replay.pipeline.decision_latency.percentile(95)
+    if args.max_p95_ms is not None and p95 > args.max_p95_ms:
+        print(f"candle_to_decision p95 {p95:.1f}ms is above the {args.max_p95_ms}ms limit")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    parser = argparse.ArgumentParser(description='Replay recorded bars through the streaming pipeline')
+    parser.add_argument('--file', help='CSV, parquet or pickle recording of 1s or 1m OHLC bars')
+    parser.add_argument('--symbol', default=DEFAULT_SYMBOL)
+    parser.add_argument('--seconds', action='store_true', help='replay the 1s table instead of the 1m table')
+    parser.add_argument('--since', help='first datetime to load from MySQL')
+    parser.add_argument('--until', help='datetime to stop loading from MySQL (exclusive)')
+    parser.add_argument('--speed', default='max', help="1 for real time, 10 for ten times faster, or 'max'")
+    parser.add_argument('--max-gap', type=float, default=60.0, help='longest pause between bars, in recorded seconds')
+    parser.add_argument('--warmup', type=int, help='minutes used to seed the pipeline before timing starts')
+    parser.add_argument('--order-delay', type=float, default=0.0, help='seconds the fake broker takes per order')
+    parser.add_argument('--db', action='store_true', help='write to the configured MySQL instead of memory')
+    parser.add_argument('--max-p95-ms', type=float, help='exit non-zero above this candle-to-decision p95')
+    raise SystemExit(asyncio.run(main(config, parser.parse_args())))
@@ -0,0 +1,268 @@
+import copy
+import math
+from collections import deque
+import pandas as pd
+
+# Entry signals of the strategies as pure functions, in two forms that must
+# agree: vectorized masks over a whole indicator frame (history, backtests) and
+# a scalar check of one row against the previous one (live, one row per bar).
+# CrossoverTracker keeps the latest row of each signal so a new bar is
+# evaluated in constant time instead of re-scanning the table.
+
+OPTION_BUYING_SIGNALS = (
+    'sma_crossover', 'sma_crossunder',
+    'kst_crossover', 'kst_crossunder',
+    'vstop_crossover', 'vstop_crossunder',
+)
+TRADING_BOT_SIGNALS = ('trendup2_crossover', 'trendup2_crossunder')
+
+OPTION_BUYING_COLUMNS = [
+    'KST', 'KST26', 'highsma5_off3', 'ohlc4_sma5', 'lowsma5_off3', 'TrendUp2', 'TrendUp3', 'BuyCall', 'BuyPut'
+]
+
+
+def option_buying_masks(data):
+    if not all(col in data.columns for col in OPTION_BUYING_COLUMNS):
+        raise ValueError("Data must contain all required columns: 'KST', 'KST26', 'ohlc4_sma5', "
+                         "'highsma5_off3', 'lowsma5_off3', 'TrendUp2', 'TrendUp3','BuyCall','BuyPut'")
+    return {
+        'sma_crossover': (
+            (data['ohlc4_sma5'] > data['highsma5_off3']) &
+            (data['ohlc4_sma5'].shift(1) <= data['highsma5_off3'].shift(1)) & (data['TrendUp2'] == 1) &
+            ((data['BuyCall'] == 1) | (data['KST26'].diff() > 0))
+        ),
+        'sma_crossunder': (
+            (data['ohlc4_sma5'] < data['lowsma5_off3']) &
+            (data['ohlc4_sma5'].shift(1) >= data['lowsma5_off3'].shift(1)) & (data['TrendUp2'] == 0) &
+            ((data['BuyPut'] == 1) | (data['KST26'].diff() < 0))
+        ),
+        'kst_crossover': (
+            (data['BuyCall'] == 1) & (data['BuyCall'].shift(1) == 0) & (data['TrendUp2'] == 1) &
+            (data['ohlc4_sma5'] > data['highsma5_off3'])
+        ),
+        'kst_crossunder': (
+            (data['BuyPut'] == 1) & (data['BuyPut'].shift(1) == 0) & (data['TrendUp2'] == 0) &
+            (data['ohlc4_sma5'] < data['lowsma5_off3'])
+        ),
+        'vstop_crossover': (
+            (data['TrendUp2'] == 1) & (data['TrendUp3'] == 1) & (data['BuyCall'] == 1) &
+            ((data['TrendUp2'].shift(1) == 0) | (data['TrendUp3'].shift(1) == 0) | (data['BuyCall'].shift() == 0))
+        ),
+        'vstop_crossunder': (
+            (data['TrendUp2'] == 0) & (data['TrendUp3'] == 0) & (data['BuyPut'] == 1) &
+            ((data['TrendUp2'].shift(1) == 1) | (data['TrendUp3'].shift(1) == 1) | (data['BuyPut'].shift() == 0))
+        ),
+    }
+
+
+def trading_bot_masks(data):
+    return {
+        'trendup2_crossover': (data['TrendUp2'] == 1) & (data['TrendUp2'].shift(1) == 0),
+        'trendup2_crossunder': (data['TrendUp2'] == 0) & (data['TrendUp2'].shift(1) == 1),
+    }
+
+
+def _value(row, column):
+    # NULL/NaN compare False either way, like the shifted columns in the masks
+    value = row.get(column) if row is not None else None
+    return math.nan if value is None else float(value)
+
+
+def option_buying_events(prev, row):
+    ohlc4_sma5, prev_ohlc4_sma5 = _value(row, 'ohlc4_sma5'), _value(prev, 'ohlc4_sma5')
+    high_off3, prev_high_off3 = _value(row, 'highsma5_off3'), _value(prev, 'highsma5_off3')
+    low_off3, prev_low_off3 = _value(row, 'lowsma5_off3'), _value(prev, 'lowsma5_off3')
+    trend2, prev_trend2 = _value(row, 'TrendUp2'), _value(prev, 'TrendUp2')
+    trend3, prev_trend3 = _value(row, 'TrendUp3'), _value(prev, 'TrendUp3')
+    buy_call, prev_buy_call = _value(row, 'BuyCall'), _value(prev, 'BuyCall')
+    buy_put, prev_buy_put = _value(row, 'BuyPut'), _value(prev, 'BuyPut')
+    kst26_diff = _value(row, 'KST26') - _value(prev, 'KST26')
+    return {
+        'sma_crossover': (ohlc4_sma5 > high_off3 and prev_ohlc4_sma5 <= prev_high_off3 and trend2 == 1
+                          and (buy_call == 1 or kst26_diff > 0)),
+        'sma_crossunder': (ohlc4_sma5 < low_off3 and prev_ohlc4_sma5 >= prev_low_off3 and trend2 == 0
+                           and (buy_put == 1 or kst26_diff < 0)),
+        'kst_crossover': buy_call == 1 and prev_buy_call == 0 and trend2 == 1 and ohlc4_sma5 > high_off3,
+        'kst_crossunder': buy_put == 1 and prev_buy_put == 0 and trend2 == 0 and ohlc4_sma5 < low_off3,
+        'vstop_crossover': (trend2 == 1 and trend3 == 1 and buy_call == 1
+                            and (prev_trend2 == 0 or prev_trend3 == 0 or prev_buy_call == 0)),
+        'vstop_crossunder': (trend2 == 0 and trend3 == 0 and buy_put == 1
+                             and (prev_trend2 == 1 or prev_trend3 == 1 or prev_buy_put == 0)),
+    }
+
+
+def trading_bot_events(prev, row):
+    trend2, prev_trend2 = _value(row, 'TrendUp2'), _value(prev, 'TrendUp2')
+    return {
+        'trendup2_crossover': trend2 == 1 and prev_trend2 == 0,
+        'trendup2_crossunder': trend2 == 0 and prev_trend2 == 1,
+    }
+
+
+def option_buying_triggers(latest):
+    # latest: signal name -> most recent row where it fired
+    if any(name not in latest for name in OPTION_BUYING_SIGNALS):
+        return None, None
+    max_trigger_datetime = max(latest[name]['datetime'] for name in OPTION_BUYING_SIGNALS)
+
+    def call_trigger(row):
+        return row['ohlc4_sma5'] if row['close'] >= row['highsma5'] else row['VStop2']
+
+    def put_trigger(row):
+        return row['ohlc4_sma5'] if row['close'] <= row['lowsma5'] else row['VStop2']
+
+    call_entry_trigger, put_entry_trigger = None, None
+    for name in ('sma_crossover', 'kst_crossover', 'vstop_crossover'):
+        if max_trigger_datetime == latest[name]['datetime']:
+            call_entry_trigger = call_trigger(latest[name])
+    for name in ('sma_crossunder', 'kst_crossunder', 'vstop_crossunder'):
+        if max_trigger_datetime == latest[name]['datetime']:
+            put_entry_trigger = put_trigger(latest[name])
+    return call_entry_trigger, put_entry_trigger
+
+
+class CrossoverTracker:
+    def __init__(self, events, masks, rewind=10):
+        self.events = events
+        self.masks = masks
+        self.rewind = rewind
+        self.latest = {}
+        self.prev = None
+        # (datetime, prev, latest) before each of the last `rewind` rows, so a
+        # revised recent row can be replayed
+        self.snapshots = deque(maxlen=rewind)
+
+    @property
+    def is_seeded(self):
+        return self.prev is not None
+
+    @property
+    def resume_from(self):
+        return self.snapshots[0][0] if self.snapshots else None
+
+    def reset(self):
+        self.latest = {}
+        self.prev = None
+        self.snapshots.clear()
+
+    def seed(self, data):
+        self.reset()
+        if data.empty:
+            return
+        settled = data.iloc[:-self.rewind] if len(data) > self.rewind else data.iloc[:0]
+        if not settled.empty:
+            for name, mask in self.masks(settled).items():
+                if mask.any():
+                    self.latest[name] = settled.loc[mask].iloc[-1].to_dict()
+            self.prev = settled.iloc[-1].to_dict()
+        self.apply(data.iloc[len(settled):].to_dict('records'))
+
+    def apply(self, rows):
+        # rows: dicts in datetime order, starting at or after resume_from
+        if not rows:
+            return []
+        first = rows[0]['datetime']
+        if self.snapshots and first <= self.snapshots[-1][0]:
+            if first < self.snapshots[0][0]:
+                raise ValueError(f"Row {first} is older than the tracker's rewind window")
+            while self.snapshots and self.snapshots[-1][0] >= first:
+                _, self.prev, self.latest = self.snapshots.pop()
+        fired = []
+        for row in rows:
+            self.snapshots.append((row['datetime'], self.prev, copy.copy(self.latest)))
+            for name, hit in self.events(self.prev, row).items():
+                if hit:
+                    self.latest[name] = row
+                    fired.append((name, row['datetime']))
+            self.prev = row
+        return fired
+
+
+def _missing(row):
+    return row is None or len(row) == 0
+
+
+def option_buying_strike(call_entry_trigger, put_entry_trigger, step):
+    strike_price = None
+    option_type = None
+
+    if call_entry_trigger:
+        # Nearest higher strike for a call
+        strike_price = int((call_entry_trigger - call_entry_trigger % step) + step)
+        option_type = "call"
+
+    if put_entry_trigger:
+        # Nearest lower strike for a put
+        strike_price = int((put_entry_trigger - put_entry_trigger % step) - step)
+        if option_type is None:
+            option_type = "put"
+
+    return strike_price, option_type
+
+
+def trading_bot_strike(latest_peak_row, latest_trough_row, step, min_range=None):
+    # Put below the latest peak or call above the latest trough, whichever is
+    # newer; min_range skips swings smaller than that many points
+    if _missing(latest_peak_row) or _missing(latest_trough_row):
+        return None, None, None
+
+    latest_peak_value = latest_peak_row['PeakValue']
+    latest_peak_datetime = latest_peak_row['Datetime']
+    latest_trough_value = latest_trough_row['TroughValue']
+    latest_trough_datetime = latest_trough_row['Datetime']
+
+    strike_price_ce = int((latest_trough_value - latest_trough_value % step) + step)
+    strike_price_pe = int((latest_peak_value - latest_peak_value % step) - step)
+
+    max_peak_trough_datetime = max(latest_peak_datetime, latest_trough_datetime)
+    if min_range is not None and round(latest_peak_value - latest_trough_value, 2) < min_range:
+        return None, None, max_peak_trough_datetime
+    if max_peak_trough_datetime == latest_peak_datetime:
+        return strike_price_pe, "put", max_peak_trough_datetime
+    elif max_peak_trough_datetime == latest_trough_datetime:
+        return strike_price_ce, "call", max_peak_trough_datetime
+    return None, None, max_peak_trough_datetime
+
+
+def trading_bot_triggers(latest_peak_row, latest_trough_row, crossover_row, crossunder_row):
+    # Peak/trough rows carry 'Datetime'; crossover rows are indicator rows or None
+    if _missing(latest_peak_row) or _missing(latest_trough_row):
+        return None, None, None
+
+    latest_peak_datetime = latest_peak_row['Datetime']
+    latest_trough_datetime = latest_trough_row['Datetime']
+    crossover_datetime = crossover_row['datetime'] if crossover_row is not None else pd.Timestamp.min
+    crossunder_datetime = crossunder_row['datetime'] if crossunder_row is not None else pd.Timestamp.min
+    max_trendup2cross_datetime = max(crossover_datetime, crossunder_datetime)
+    max_peak_trough_datetime = max(latest_peak_datetime, latest_trough_datetime)
+
+    crossunder_vstop2 = crossunder_row['VStop2'] if crossunder_row is not None else float('inf')
+    crossunder_highsma5 = crossunder_row['highsma5'] if crossunder_row is not None else float('inf')
+    crossunder_highsma5_off3 = crossunder_row['highsma5_off3'] if crossunder_row is not None else float('inf')
+
+    crossover_vstop2 = crossover_row['VStop2'] if crossover_row is not None else -float('inf')
+    crossover_lowsma5 = crossover_row['lowsma5'] if crossover_row is not None else -float('inf')
+    crossover_lowsma5_off3 = crossover_row['lowsma5_off3'] if crossover_row is not None else -float('inf')
+
+    call_entry_trigger = None
+    put_entry_trigger = None
+
+    if (max_peak_trough_datetime == latest_peak_datetime) and (max_trendup2cross_datetime > max_peak_trough_datetime):
+        if crossunder_row is not None and (max_trendup2cross_datetime == crossunder_datetime):
+            if crossunder_highsma5 < crossunder_highsma5_off3 < crossunder_vstop2:
+                put_entry_trigger = crossunder_highsma5_off3
+                if crossunder_highsma5 < crossunder_vstop2:
+                    put_entry_trigger = crossunder_highsma5
+            else:
+                put_entry_trigger = crossunder_vstop2
+
+    elif (max_peak_trough_datetime == latest_trough_datetime) and (max_trendup2cross_datetime > max_peak_trough_datetime):
+        if crossover_row is not None and (max_trendup2cross_datetime == crossover_datetime):
+            if crossover_lowsma5 > crossover_lowsma5_off3 > crossover_vstop2:
+                call_entry_trigger = crossover_lowsma5_off3
+                if crossover_lowsma5 > crossover_vstop2:
+                    call_entry_trigger = crossover_lowsma5
+            else:
+                call_entry_trigger = crossover_vstop2
+
+    return call_entry_trigger, put_entry_trigger, max_trendup2cross_datetime
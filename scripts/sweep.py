@@ -0,0 +1,300 @@
+import os
+import json
+import math
+import random
+import asyncio
+import argparse
+import itertools
+import aiomysql
+import numpy as np
+import pandas as pd
+import talib
+from collections import OrderedDict
+from multiprocessing import Pool, shared_memory
+from backtest import STRATEGIES, backtest
+from db_pool import close_pools, get_pool
+from history_store import cached_history
+from indicators import (ATR_PERIOD, KST_ROC_PERIODS, KST_SMA_PERIODS, ROUNDED_COLUMNS, VSTOP_MULTIPLIERS,
+                        atr_line, buy_signal, kst_line, vstop_arrays)
+from instruments import DEFAULT_SYMBOL, instrument
+from peaks import DEFAULT_WINDOW
+from timeframes import ohlc_table
+
+# Grid or random search over the strategy constants. The OHLC history is put
+# in shared memory once and every worker process maps it instead of receiving
+# a pickled copy per task. Indicators are computed in stages keyed by only the
+# parameters each stage depends on (the 5-bar SMAs do not change when the ATR
+# period does), and each worker keeps an LRU cache of stage outputs. Tasks are
+# ordered so consecutive combinations share their expensive stages.
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+config_path = os.path.join(project_root, 'config', 'config.json')
+
+OHLC_FIELDS = ('open', 'high', 'low', 'close', 'ohlc4')
+
+DEFAULT_PARAMS = {
+    'sma_fast': 5,
+    'sma_slow': 26,
+    'roc_periods': KST_ROC_PERIODS,
+    'atr_period': ATR_PERIOD,
+    'vstop_multipliers': VSTOP_MULTIPLIERS,
+    'min_prominence': 1,
+    'min_range': None,
+}
+
+DEFAULT_GRID = {
+    'sma_fast': [3, 5, 8],
+    'sma_slow': [20, 26, 34],
+    'roc_periods': [(10, 15, 20, 30), (20, 30, 40, 60)],
+    'atr_period': [126, 252],
+    'vstop_multipliers': [(1.5, 2.5), (2, 3), (2.5, 3.5)],
+    'min_prominence': [1, 80],
+    'min_range': [None, 70],
+}
+
+# Parameters only the peak/trough strategy reads
+PEAK_PARAMS = ('min_prominence', 'min_range')
+
+
+def _fast_smas(data, params):
+    period = params['sma_fast']
+    highsma = talib.SMA(data['high'], timeperiod=period)
+    lowsma = talib.SMA(data['low'], timeperiod=period)
+    return {
+        'ohlc4_sma5': talib.SMA(data['ohlc4'], timeperiod=period),
+        'highsma5': highsma,
+        'lowsma5': lowsma,
+        'highsma5_off3': highsma.shift(3),
+        'lowsma5_off3': lowsma.shift(3),
+    }
+
+
+def _kst(data, params):
+    return {'KST': kst_line(data['close'], params['roc_periods'], KST_SMA_PERIODS)}
+
+
+def _kst_signal(data, params):
+    kst26 = talib.SMA(data['KST'], timeperiod=params['sma_slow'])
+    buy_call, buy_put = buy_signal(data['KST'], kst26)
+    return {'KST26': kst26, 'BuyCall': buy_call, 'BuyPut': buy_put}
+
+
+def _atr(data, params):
+    return {'ATR': atr_line(data, params['atr_period'])}
+
+
+def _vstop(data, params):
+    vstop2, vstop3, trend_up2, trend_up3, _, _ = vstop_arrays(
+        data['close'].to_numpy(), data['ATR'].to_numpy(), params['atr_period'], params['vstop_multipliers'])
+    return {'VStop2': vstop2, 'VStop3': vstop3, 'TrendUp2': trend_up2.astype(int), 'TrendUp3': trend_up3.astype(int)}
+
+
+# (name, parameters the outputs depend on, compute) in dependency order
+STAGES = [
+    ('fast_sma', ('sma_fast',), _fast_smas),
+    ('kst', ('roc_periods',), _kst),
+    ('kst_signal', ('roc_periods', 'sma_slow'), _kst_signal),
+    ('atr', ('atr_period',), _atr),
+    ('vstop', ('atr_period', 'vstop_multipliers'), _vstop),
+]
+STAGE_ORDER = ('roc_periods', 'atr_period', 'vstop_multipliers', 'sma_slow', 'sma_fast')
+
+
+class StageCache:
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        value = compute()
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return value
+
+
+def indicator_frame(ohlc, params, cache=None):
+    # Signal columns for one parameter set, rounded like indicators_data and
+    # starting at the first bar where every indicator is warmed up
+    cache = cache or StageCache(0)
+    data = dict(ohlc.items())
+    for name, depends, compute in STAGES:
+        key = (name,) + tuple(params[p] for p in depends)
+        data.update(cache.get(key, lambda: compute(data, params)))
+    frame = pd.DataFrame(data)
+    rounded = [col for col in frame.columns if col in ROUNDED_COLUMNS]
+    frame[rounded] = frame[rounded].round(2)
+    ready = frame[['highsma5_off3', 'KST26', 'VStop2']].notna().all(axis=1).to_numpy()
+    start = int(ready.argmax()) if ready.any() else len(frame)
+    return frame.iloc[start:].reset_index(drop=True)
+
+
+class SharedOHLC:
+    # OHLC columns as contiguous float64 rows of one shared block plus the
+    # datetimes as int64 nanoseconds
+    def __init__(self, data):
+        n = len(data)
+        self.values = shared_memory.SharedMemory(create=True, size=max(1, len(OHLC_FIELDS) * n * 8))
+        self.times = shared_memory.SharedMemory(create=True, size=max(1, n * 8))
+        values = np.ndarray((len(OHLC_FIELDS), n), dtype=np.float64, buffer=self.values.buf)
+        for i, field in enumerate(OHLC_FIELDS):
+            values[i] = data[field].to_numpy(dtype=np.float64)
+        np.ndarray((n,), dtype=np.int64, buffer=self.times.buf)[:] = data['datetime'].to_numpy('datetime64[ns]').view(np.int64)
+        self.spec = (self.values.name, self.times.name, n)
+
+    def close(self):
+        for block in (self.values, self.times):
+            block.close()
+            block.unlink()
+
+
+def attach_ohlc(spec):
+    values_name, times_name, n = spec
+    values = shared_memory.SharedMemory(name=values_name)
+    times = shared_memory.SharedMemory(name=times_name)
+    columns = np.ndarray((len(OHLC_FIELDS), n), dtype=np.float64, buffer=values.buf)
+    ohlc = {'datetime': pd.Series(np.ndarray((n,), dtype=np.int64, buffer=times.buf).view('datetime64[ns]'))}
+    for i, field in enumerate(OHLC_FIELDS):
+        ohlc[field] = pd.Series(columns[i], copy=False)
+    return ohlc, (values, times)
+
+
+_worker = {}
+
+
+def _init_worker(spec, strategy, step, window, cost, cache_size):
+    ohlc, blocks = attach_ohlc(spec)
+    _worker.update(ohlc=ohlc, blocks=blocks, strategy=strategy, step=step, window=window,
+                   cost=cost, cache=StageCache(cache_size))
+
+
+def _run_combination(params):
+    try:
+        frame = indicator_frame(_worker['ohlc'], params, _worker['cache'])
+        summary, _ = backtest(frame, _worker['strategy'], _worker['step'], _worker['window'],
+                              params['min_prominence'], params['min_range'], _worker['cost'])
+    except Exception as e:
+        summary = {'error': repr(e)}
+    return {**params, **summary, 'pid': os.getpid(),
+            'cache_hits': _worker['cache'].hits, 'cache_misses': _worker['cache'].misses}
+
+
+def parameter_grid(grid, strategy):
+    grid = {**{name: [value] for name, value in DEFAULT_PARAMS.items()}, **grid}
+    if strategy != 'trading_bot':
+        # Peak filters do not change option_buying results
+        grid.update({name: [DEFAULT_PARAMS[name]] for name in PEAK_PARAMS})
+    names = list(grid)
+    values = [[tuple(v) if isinstance(v, list) else v for v in grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def order_for_cache(combinations):
+    return sorted(combinations, key=lambda params: tuple(str(params[name]) for name in STAGE_ORDER))
+
+
+def run_sweep(ohlc, strategy, step, grid=None, samples=None, seed=0, processes=None,
+              window=DEFAULT_WINDOW, cost=0.0, cache_size=32):
+    combinations = parameter_grid(grid or DEFAULT_GRID, strategy)
+    if samples is not None and samples < len(combinations):
+        combinations = random.Random(seed).sample(combinations, samples)
+    combinations = order_for_cache(combinations)
+    processes = processes or os.cpu_count() or 1
+    chunksize = max(1, math.ceil(len(combinations) / (processes * 4)))
+
+    shared = SharedOHLC(ohlc)
+    try:
+        with Pool(processes, _init_worker, (shared.spec, strategy, step, window, cost, cache_size)) as pool:
+            results = list(pool.imap_unordered(_run_combination, combinations, chunksize=chunksize))
+    finally:
+        shared.close()
+    return pd.DataFrame(results)
+
+
+def rank_results(results, metric='total_points'):
+    ascending = metric == 'max_drawdown'
+    ranked = results.sort_values(by=metric, ascending=ascending, na_position='last', ignore_index=True)
+    ranked.insert(0, 'rank', range(1, len(ranked) + 1))
+    return ranked
+
+
+def load_ohlc_file(path):
+    data = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+    data['datetime'] = pd.to_datetime(data['datetime'])
+    if 'ohlc4' not in data.columns:
+        data['ohlc4'] = ((data['open'] + data['high'] + data['low'] + data['close']) / 4).round(2)
+    return data.sort_values(by='datetime', ignore_index=True)
+
+
+async def load_ohlc_db(config, table_name, since=None, until=None):
+    # Same validity rule as the indicator scripts: all-zero candles are skipped
+    pool = await get_pool(config)
+    data = await cached_history(config, pool, table_name, since, until)
+    if data is not None:
+        return data[(data[['open', 'high', 'low', 'close']] != 0).any(axis=1)].reset_index(drop=True)
+    query = f'SELECT * FROM `{table_name}` WHERE (open <> 0 OR high <> 0 OR low <> 0 OR close <> 0)'
+    args = []
+    if since is not None:
+        query += ' AND `datetime` >= %s'
+        args.append(since)
+    if until is not None:
+        query += ' AND `datetime` < %s'
+        args.append(until)
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(query + ' ORDER BY `datetime`', args or None)
+            result = await cur.fetchall()
+    data = pd.DataFrame(result)
+    if not data.empty:
+        data['datetime'] = pd.to_datetime(data['datetime'])
+    return data
+
+
+async def load_ohlc(config, args):
+    if args.file:
+        return load_ohlc_file(args.file)
+    try:
+        return await load_ohlc_db(config, ohlc_table(args.timeframe, args.symbol), args.since, args.until)
+    finally:
+        await close_pools()
+
+
+if __name__ == "__main__":
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    parser = argparse.ArgumentParser(description='Parameter sweep of a strategy over OHLC history')
+    parser.add_argument('strategy', choices=STRATEGIES)
+    parser.add_argument('--file', help='CSV or parquet OHLC export (datetime, open, high, low, close[, ohlc4])')
+    parser.add_argument('--timeframe', default=config.get('timeframe', '1m'))
+    parser.add_argument('--symbol', default=DEFAULT_SYMBOL)
+    parser.add_argument('--since')
+    parser.add_argument('--until')
+    parser.add_argument('--random', type=int, help='sample this many combinations instead of the full grid')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--cost', type=float, default=0.0, help='cost per position change, in points')
+    parser.add_argument('--rank', default='total_points',
+                        choices=['total_points', 'avg_points', 'win_rate', 'profit_factor', 'max_drawdown'])
+    parser.add_argument('--out', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    ohlc = asyncio.run(load_ohlc(config, args))
+    if ohlc.empty:
+        raise SystemExit("No OHLC rows to sweep")
+    sweep_config = config.get('sweep', {})
+    results = run_sweep(ohlc, args.strategy, instrument(config, args.symbol)['strike_step'],
+                        grid=sweep_config.get('grid'), samples=args.random, seed=args.seed,
+                        processes=args.processes, window=config.get('peak_trough', {}).get('window', DEFAULT_WINDOW),
+                        cost=args.cost, cache_size=sweep_config.get('cache_size', 32))
+    ranked = rank_results(results, args.rank)
+    ranked.to_csv(args.out, index=False)
+    print(ranked.drop(columns=['pid', 'cache_hits', 'cache_misses']).head(10).to_string(index=False))
+    print(f"{len(ranked)} combinations over {len(ohlc)} bars written to {args.out}")
@@ -0,0 +1,59 @@
+import pandas as pd
+from gap_tracker import valid_rows
+from instruments import DEFAULT_SYMBOL, table_name
+
+# Bar size in minutes. Buckets are aligned to the open of the day's session in
+# the market calendar and end at its close, so on a regular day the last 1h bar
+# (15:15-15:29) is only 15 minutes long; special sessions get their own hours.
+TIMEFRAMES = {
+    '1m': 1,
+    '3m': 3,
+    '5m': 5,
+    '15m': 15,
+    '1h': 60,
+}
+
+
+def timeframe_minutes(timeframe):
+    if timeframe not in TIMEFRAMES:
+        raise ValueError(f"Unknown timeframe {timeframe!r}, expected one of {list(TIMEFRAMES)}")
+    return TIMEFRAMES[timeframe]
+
+
+def ohlc_table(timeframe='1m', symbol=DEFAULT_SYMBOL):
+    timeframe_minutes(timeframe)
+    return table_name(f'ohlctick_{timeframe}data', symbol)
+
+
+def indicator_table(timeframe='1m', symbol=DEFAULT_SYMBOL):
+    # 1m keeps the original table name so existing deployments are unaffected
+    timeframe_minutes(timeframe)
+    base = 'indicators_data' if timeframe == '1m' else f'indicators_{timeframe}data'
+    return table_name(base, symbol)
+
+
+def bucket_starts(datetimes, minutes, calendar):
+    datetimes = pd.DatetimeIndex(datetimes)
+    opens, _ = calendar.sessions(datetimes)
+    size = pd.Timedelta(minutes=minutes)
+    return opens + ((datetimes - opens) // size) * size
+
+
+def bucket_ends(starts, minutes, calendar):
+    starts = pd.DatetimeIndex(starts)
+    _, closes = calendar.sessions(starts)
+    ends = starts + pd.Timedelta(minutes=minutes)
+    return ends.where(ends < closes, closes)
+
+
+def rollup(data, minutes, calendar):
+    # 1-minute bars -> N-minute bars. Zero-filled minutes are skipped so a gap
+    # never drags the low of a bucket to 0; buckets without data are left out.
+    bars = data[valid_rows(data)]
+    buckets = bucket_starts(pd.to_datetime(bars['datetime']), minutes, calendar)
+    grouped = bars.groupby(buckets.values, sort=True)
+    rolled = grouped.agg(open=('open', 'first'), high=('high', 'max'),
+                         low=('low', 'min'), close=('close', 'last'))
+    rolled['ohlc4'] = ((rolled['open'] + rolled['high'] + rolled['low'] + rolled['close']) / 4).round(2)
+    rolled.index.name = 'datetime'
+    return rolled.reset_index()
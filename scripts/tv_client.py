@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from tvDatafeed import TvDatafeed
+from executors import get_executor
+
+# Long-lived TradingView access shared by every script in the process.
+#
+# TvDatafeed objects keep their socket on the instance and are not safe to share
+# between threads, so each executor thread lazily builds one session and reuses
+# it for every later call. A call that raises or comes back empty drops that
+# thread's session; the executor's retry then reconnects on a fresh one.
+#
+# Concurrent requests for the same symbol/exchange/interval share one in-flight
+# fetch: TradingView always returns the latest n bars, so a pending request for
+# at least as many bars answers a smaller one too.
+
+
+class TvClient:
+    def __init__(self, config):
+        self.config = config
+        self.local = threading.local()
+        self.inflight = {}
+        self.sessions_created = 0
+        self.coalesced = 0
+
+    def session(self):
+        tv = getattr(self.local, 'tv', None)
+        if tv is None:
+            tv = TvDatafeed()  # Use without login
+            self.local.tv = tv
+            self.sessions_created += 1
+        return tv
+
+    def reset(self):
+        self.local.tv = None
+
+    def fetch(self, symbol, exchange, interval, n_bars):
+        # Runs on an executor thread
+        try:
+            data = self.session().get_hist(symbol=symbol, exchange=exchange,
+                                           interval=interval, n_bars=n_bars)
+        except Exception:
+            self.reset()
+            raise
+        if data is None:
+            self.reset()
+        return data
+
+    async def get_hist(self, symbol, exchange, interval, n_bars):
+        key = (symbol, exchange, interval)
+        pending = self.inflight.get(key)
+        if pending is not None and pending[0] >= n_bars:
+            self.coalesced += 1
+            data = await asyncio.shield(pending[1])
+            return data.tail(n_bars) if data is not None else None
+
+        task = asyncio.ensure_future(get_executor(self.config, 'tvdatafeed').call(
+            self.fetch, symbol, exchange, interval, n_bars,
+            call_name='get_hist', accept=lambda result: result is not None))
+        self.inflight[key] = (n_bars, task)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self.inflight.get(key, (None, None))[1] is task:
+                del self.inflight[key]
+
+    def summary(self):
+        return f"tvdatafeed: {self.sessions_created} sessions opened, {self.coalesced} requests coalesced"
+
+
+_client = None
+
+
+def get_tv_client(config):
+    global _client
+    if _client is None:
+        _client = TvClient(config)
+    return _client
@@ -1,11 +1,17 @@
 import os
-from tvDatafeed import TvDatafeed, Interval
+from tvDatafeed import Interval
 import pandas as pd
 import json
 import asyncio
-import aiomysql
 import pytz
-from datetime import datetime, time, timedelta
+from bulk_writer import OHLC_COLUMNS, bulk_upsert
+from db_pool import close_pools, get_pool
+from tv_client import get_tv_client
+from fanout import run_per_symbol
+from history_store import invalidate_history
+from instruments import DEFAULT_SYMBOL, configured_symbols, instrument
+from metrics import Throughput
+from timeframes import ohlc_table
 
 # Get the absolute path of the project root
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -14,31 +20,23 @@ config_path = os.path.join(project_root, 'config', 'config.json')
 
 
 class TvDataAll:
-    def __init__(self, config):
+    def __init__(self, config, symbol=DEFAULT_SYMBOL):
         self.config = config
+        self.symbol = symbol
+        self.instrument = instrument(config, symbol)
+        self.table_name = ohlc_table('1m', symbol)
+        self.rows_written = Throughput(f'{symbol} history')
         self.tv_username = config['tvdatafeed']['username']
         self.tv_password = config['tvdatafeed']['password']
 
     async def get_mysql_pool(self):
-        db_config = self.config['db_config']
-        port = int(db_config['port'])
-        pool = await aiomysql.create_pool(
-            host=db_config['host'],
-            port=port,
-            user=db_config['user'],
-            password=db_config['password'],
-            db=db_config['database'],
-            autocommit=True,
-            minsize=5,
-            maxsize=20
-        )
-        return pool
+        return await get_pool(self.config)
 
     async def create_tables_if_not_exists(self, pool):
         async with pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                create_table_query = '''
-                CREATE TABLE IF NOT EXISTS ohlctick_1mdata (
+                create_table_query = f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
                     datetime DATETIME PRIMARY KEY,
                     open FLOAT,
                     high FLOAT,
@@ -51,28 +49,20 @@ class TvDataAll:
             await conn.commit()
 
     async def save_indicators_to_db(self, pool, data):
-        # Handle NaN values and filter rows with zeroes in specified columns
-        data = [[None if pd.isna(x) else x for x in row] for row in data]
-        non_zero_data = [
-            row for row in data if all(row[i] != 0 for i in [1, 2, 3, 4])
-        ]
-
-        replace_query = '''
-            REPLACE INTO ohlctick_1mdata (
-                datetime, open, high, low, close, ohlc4
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-        '''
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.executemany(replace_query, non_zero_data)
-                print(f"Inserted {len(non_zero_data)} rows into the database")
+        # Skip candles with a zero in any OHLC column
+        non_zero_data = data[(data[['open', 'high', 'low', 'close']] != 0).all(axis=1)]
+        written = await bulk_upsert(pool, self.table_name, non_zero_data, OHLC_COLUMNS)
+        self.rows_written.add(written)
+        if written:
+            # The refetch rewrites days the history store already holds
+            invalidate_history(self.config, self.table_name, non_zero_data['datetime'].min())
+        print(self.rows_written.summary())
 
     async def fetch_tv_data(self):
-        # tv = TvDatafeed(self.tv_username, self.tv_password)
-        tv = TvDatafeed()  # uncomment if using without login
         try:
-            data = tv.get_hist(symbol='BANKNIFTY', exchange='NSE',
-                               interval=Interval.in_1_minute, n_bars=1000)
+            data = await get_tv_client(self.config).get_hist(
+                self.instrument['tv_symbol'], self.instrument['tv_exchange'],
+                Interval.in_1_minute, 1000)
             dataf = pd.DataFrame(data)
             dataf.index = pd.to_datetime(dataf.index, errors='coerce')
             dataf.reset_index(inplace=True)
@@ -96,17 +86,29 @@ class TvDataAll:
             tick_df = dataf[selected_columns]
             return tick_df
         except Exception as e:
-            print(f"Error fetching TV data: {e}")
+            print(f"Error fetching TV data for {self.symbol}: {e}")
             return pd.DataFrame()
 
-    async def run(self):
+    async def load(self):
         pool = await self.get_mysql_pool()
         await self.create_tables_if_not_exists(pool)
         tick_df = await self.fetch_tv_data()
         if not tick_df.empty:
-            await self.save_indicators_to_db(pool, tick_df.to_numpy())
-        pool.close()
-        await pool.wait_closed()
+            await self.save_indicators_to_db(pool, tick_df)
+
+    async def run(self):
+        try:
+            await self.load()
+        finally:
+            await close_pools()
+
+
+async def run_all(config):
+    loaders = [TvDataAll(config, symbol) for symbol in configured_symbols(config)]
+    try:
+        await run_per_symbol(loaders, 'load')
+    finally:
+        await close_pools()
 
 
 if __name__ == "__main__":
@@ -117,5 +119,4 @@ if __name__ == "__main__":
 #     with open('config.json') as config_file:
 #         config = json.load(config_file)
 
-    tvdata = TvDataAll(config)
-    asyncio.run(tvdata.run())
+    asyncio.run(run_all(config))
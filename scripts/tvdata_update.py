@@ -1,12 +1,20 @@
 import os
-from tvDatafeed import TvDatafeed, Interval
+from tvDatafeed import Interval
 import pandas as pd
 import json
 import pytz
 import asyncio
-import aiomysql
 import numpy as np
-from datetime import datetime, time, timedelta
+from bars import Bars
+from bulk_writer import OHLC_COLUMNS, bulk_upsert
+from db_pool import close_pools, get_pool, pool_manager
+from gap_tracker import GapTracker, valid_rows
+from tv_client import get_tv_client
+from fanout import run_per_symbol
+from instruments import DEFAULT_SYMBOL, configured_symbols, instrument
+from market_calendar import market_calendar
+from metrics import LatencyHistogram, Throughput
+from timeframes import ohlc_table
 
 # Get the absolute path of the project root
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -16,42 +24,28 @@ config_path = os.path.join(project_root, 'config', 'config.json')
 IST = pytz.timezone('Asia/Kolkata')
 
 class TvDataUpdate:
-    def __init__(self, config):
+    def __init__(self, config, symbol=DEFAULT_SYMBOL):
         self.config = config
+        self.calendar = market_calendar(config)
+        self.symbol = symbol
+        self.instrument = instrument(config, symbol)
+        self.table_name = ohlc_table('1m', symbol)
         self.tv_username = config['tvdatafeed']['username']
         self.tv_password = config['tvdatafeed']['password']
+        self.gaps = GapTracker(self.table_name, calendar=self.calendar)
+        # Missing minutes a fetch reaching back past them could not fill (a
+        # halted minute TradingView has no bar for either); not asked for again
+        self.unfillable = set()
+        self.backfill_latency = LatencyHistogram(f'{symbol} tv_backfill')
+        self.rows_written = Throughput(f'{symbol} backfilled')
 
     async def get_mysql_pool(self):
-        db_config = self.config['db_config']
-        port = int(db_config['port'])
-        pool = await aiomysql.create_pool(
-            host=db_config['host'],
-            port=port,
-            user=db_config['user'],
-            password=db_config['password'],
-            db=db_config['database'],
-            autocommit=True,
-            minsize=5,
-            maxsize=20
-        )
-        return pool
-
-    async def fetch_ohlctick_data(self, pool):
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                query = 'SELECT * FROM ohlctick_1mdata ORDER BY datetime'
-                await cur.execute(query)
-                data = await cur.fetchall()
-                df = pd.DataFrame(
-                    data, columns=['datetime', 'open', 'high', 'low', 'close', 'ohlc4'])
-                df['datetime'] = pd.to_datetime(df['datetime'])
-                df.sort_values(by='datetime', inplace=True)
-                return df
+        return await get_pool(self.config)
 
     async def create_tables_if_not_exists(self, pool):
         async with pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                create_table_query = '''CREATE TABLE IF NOT EXISTS ohlctick_1mdata (
+                create_table_query = f'''CREATE TABLE IF NOT EXISTS {self.table_name} (
                 datetime DATETIME,
                 open FLOAT,
                 high FLOAT,
@@ -64,90 +58,81 @@ class TvDataUpdate:
             await conn.commit()
 
     async def check_missing_or_duplicate_keys(self, pool):
-        now = pd.Timestamp.now()
-        market_open_time = datetime.strptime('09:15', '%H:%M').time()
-        market_close_time = datetime.strptime('15:30', '%H:%M').time()
-
-        # Create Period object for the current minute
-        period_now = pd.Period.now('1min')
-
-        # Get the start time and end time of the market in datetime64 format
-        open_time_datetime64 = pd.Timestamp.combine(now.date(), market_open_time)
-        close_time_datetime64 = pd.Timestamp.combine(now.date(), market_close_time)
-
-        # Get the start time of the current period
-        period_now_datetime64 = period_now.start_time
-        previous_candle = (period_now - 1).start_time
-
-        # Calculate the sleep duration
-        sleep_duration = (now - previous_candle).total_seconds()
-        min_datetime = min(close_time_datetime64, previous_candle)
-        
-
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                query = f"""
-                    WITH RECURSIVE datetime_sequence AS (
-                        SELECT '{open_time_datetime64}' AS dt
-                        UNION ALL
-                        SELECT DATE_ADD(dt, INTERVAL 1 MINUTE)
-                        FROM datetime_sequence
-                        WHERE dt < '{min_datetime}'
-                    )
-                    SELECT COUNT(*) AS num_issues
-                    FROM (
-                        SELECT ds.dt AS datetime_missing_or_duplicate
-                        FROM datetime_sequence ds
-                        LEFT JOIN (
-                            SELECT `datetime`, COUNT(*) AS cnt
-                            FROM ohlctick_1mdata
-                            WHERE `datetime` >= '{open_time_datetime64}' AND `datetime` <= '{min_datetime}'
-                            GROUP BY `datetime`
-                        ) t ON ds.dt = t.`datetime`
-                        LEFT JOIN ohlctick_1mdata id ON ds.dt = id.`datetime`
-                        WHERE t.`datetime` IS NULL 
-                           OR t.cnt > 1
-                           OR COALESCE(id.open, id.high, id.low, id.close, id.ohlc4) = 0
-                    ) AS issues;
-                    """
-
-                await cursor.execute(query)
-                result = await cursor.fetchone()
-                num_issues = result[0] if result else 0
-                if num_issues:
-                    print("Number of missing or duplicate datetime entries found:", num_issues)
-                else:
-                    print("No gaps or duplicates found.")
-                return num_issues
+        await self.gaps.refresh(pool)
+        num_issues = self.gaps.num_missing()
+        if num_issues:
+            print(f"{self.symbol}: number of missing or duplicate datetime entries found:", num_issues)
+        else:
+            print(f"{self.symbol}: no gaps or duplicates found.")
+        return num_issues
 
     async def insert_tick_dataframe(self, pool, tick_df):
-        # past_tick_df = tick_df.iloc[:-1]
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    insert_query = '''REPLACE INTO ohlctick_1mdata (datetime, open, high, low, close, ohlc4)
-                    VALUES (%s, %s, %s, %s, %s, %s)'''
-                    records = tick_df.to_dict(orient='records')
-                    # records = past_tick_df.to_dict(orient='records')
-                    for record in records:
-                        await cursor.execute(insert_query, (
-                            record['datetime'], record['open'], record['high'],
-                            record['low'], record['close'], record['ohlc4']
-                        ))
-                    await conn.commit()
-                    print(
-                        f"Successfully inserted/updated {len(records)} rows into the database.")
-                except Exception as e:
-                    print(f"Error inserting data into database: {e}")
-                    await conn.rollback()
-
-    async def fetch_tv_data(self):
-        tv = TvDatafeed()  # Use without login
         try:
-            pool = await self.get_mysql_pool()
-            num_issues = await self.check_missing_or_duplicate_keys(pool)
-            data = tv.get_hist(symbol='BANKNIFTY', exchange='NSE',
-                               interval=Interval.in_1_minute, n_bars=num_issues+100)
+            written = await bulk_upsert(pool, self.table_name, tick_df, OHLC_COLUMNS)
+            self.rows_written.add(written)
+            self.gaps.record(tick_df)
+        except Exception as e:
+            print(f"Error inserting data into database: {e}")
+
+    def bars_to_cover(self, ranges):
+        # TradingView only serves the latest n bars, so the oldest gap decides
+        # the request size and every later gap is covered by the same fetch
+        earliest = ranges[0][0]
+        return int((pd.Timestamp.now().floor('min') - earliest) // pd.Timedelta(minutes=1)) + 2
+
+    def fillable_ranges(self):
+        # Missing ranges without the minutes an earlier fetch could not fill
+        session_date = self.gaps.bitmap.session_date if self.gaps.bitmap is not None else None
+        self.unfillable = {minute for minute in self.unfillable if minute.date() == session_date}
+        minutes = sorted(self.gaps.missing_slots() - self.unfillable)
+        ranges = []
+        for minute in minutes:
+            if ranges and minute - ranges[-1][1] == pd.Timedelta(minutes=1):
+                ranges[-1][1] = minute
+            else:
+                ranges.append([minute, minute])
+        return [tuple(bounds) for bounds in ranges]
+
+    def record_unfilled(self, ranges, bars, gap_bars):
+        # Minutes inside the span the fetch returned that came back without a
+        # usable bar; minutes past its last bar may simply not be published yet
+        filled = set(pd.DatetimeIndex(gap_bars.datetimes[valid_rows(gap_bars.to_frame())]))
+        covered_from, covered_to = pd.Timestamp(bars.datetimes.min()), pd.Timestamp(bars.datetimes.max())
+        for start, end in ranges:
+            for minute in pd.date_range(max(start, covered_from), min(end, covered_to), freq='min'):
+                if minute not in filled:
+                    self.unfillable.add(minute)
+
+    def select_ranges(self, bars, ranges):
+        datetimes = bars.datetimes
+        mask = np.zeros(len(bars), dtype=bool)
+        for start, end in ranges:
+            mask |= (datetimes >= pd.Timestamp(start).to_datetime64()) & (datetimes <= pd.Timestamp(end).to_datetime64())
+        return bars[mask]
+
+    async def backfill_gaps(self, pool):
+        ranges = self.fillable_ranges()
+        if not ranges:
+            if self.unfillable:
+                print(f"{self.symbol}: {len(self.unfillable)} missing minutes are not available from TradingView")
+            return
+        with self.backfill_latency.time():
+            bars = await self.fetch_tv_data(self.bars_to_cover(ranges))
+            if bars.empty:
+                return
+            gap_bars = self.select_ranges(bars, ranges)
+            print(f"{self.symbol}: filling {len(gap_bars)} bars across {len(ranges)} gaps from {ranges[0][0]}")
+            if not gap_bars.empty:
+                await self.insert_tick_dataframe(pool, gap_bars.to_frame())
+            self.record_unfilled(ranges, bars, gap_bars)
+        print(f"{self.backfill_latency.summary()}; {self.rows_written.summary()}")
+        print(get_tv_client(self.config).summary())
+
+    async def fetch_tv_data(self, n_bars):
+        try:
+            data = await get_tv_client(self.config).get_hist(
+                self.instrument['tv_symbol'], self.instrument['tv_exchange'],
+                Interval.in_1_minute, n_bars)
             dataf = pd.DataFrame(data)
             dataf.index = pd.to_datetime(dataf.index, errors='coerce')
             dataf.reset_index(inplace=True)
@@ -165,57 +150,28 @@ class TvDataUpdate:
                 dataf['ohlc4'] = dataf['ohlc4'].round(2)
             else:
                 print("Missing expected columns. Available columns:", dataf.columns)
-                return pd.DataFrame()
-            selected_columns = ['datetime', 'open',
-                                'high', 'low', 'close', 'ohlc4']
-            tick_df = dataf[selected_columns]
-            return tick_df
+                return Bars.from_rows([], OHLC_COLUMNS)
+            return Bars.from_frame(dataf[OHLC_COLUMNS])
         except Exception as e:
-            print(f"Error fetching TV data: {e}")
-            return pd.DataFrame()
-
-    def is_market_open(self):
-        now = pd.Timestamp.now()
-        market_open_time = now.replace(
-            hour=9, minute=15, second=0, microsecond=0)
-        market_close_time = now.replace(
-            hour=15, minute=30, second=0, microsecond=0)
-        return market_open_time <= now <= market_close_time
-
-    def is_business_day(self, date):
-        is_business = date.weekday() < 5 and date.strftime(
-            '%Y-%m-%d') not in self.config['holidays']
-        print(f"Date {date.strftime('%Y-%m-%d')} is business day: {is_business}")
-        return is_business
-
-    def get_sleep_duration(self):
-        current_datetime = datetime.now(IST)
-        current_time = current_datetime.time()
-        next_market_open_datetime = current_datetime.replace(
-            hour=9, minute=15, second=0, microsecond=0)
-
-        if current_time >= next_market_open_datetime.time():
-            next_market_open_datetime += timedelta(days=1)
-
-        while not self.is_business_day(next_market_open_datetime):
-            next_market_open_datetime += timedelta(days=1)
-
-        sleep_duration = (next_market_open_datetime -
-                          current_datetime).total_seconds()
-        # print(f"Sleep duration until next market open: {sleep_duration} seconds")
-        return sleep_duration
+            print(f"Error fetching TV data for {self.symbol}: {e}")
+            return Bars.from_rows([], OHLC_COLUMNS)
 
     async def run(self):
+        try:
+            await self.run_loop()
+        finally:
+            await close_pools()
+
+    async def run_loop(self):
         pool = await self.get_mysql_pool()
         try:
             while True:
-                if self.is_market_open() and self.is_business_day(datetime.now(IST)):
-                    while self.is_market_open():
+                if self.calendar.is_open():
+                    while self.calendar.is_open():
                         num_issues = await self.check_missing_or_duplicate_keys(pool)
                         if num_issues:
-                            tick_df = await self.fetch_tv_data()
-                            if not tick_df.empty:
-                                await self.insert_tick_dataframe(pool, tick_df)
+                            await self.backfill_gaps(pool)
+                        pool_manager.log_stats()
                         current_time = pd.Timestamp.now(IST)
                         period_now = pd.Period.now('1min')
                         period_now_start_time = period_now.start_time.replace(tzinfo=IST)
@@ -226,15 +182,21 @@ class TvDataUpdate:
                         if sleep_duration > 0 and sleep_duration < 59:
                             await asyncio.sleep(sleep_duration)
                 else:
-                    time_until_open = self.get_sleep_duration()
+                    time_until_open = self.calendar.seconds_until_open()
                     # time_until_open = (next_market_open - now).total_seconds()
                     print(f"Market closed. Sleeping for {time_until_open} seconds.")
                     await asyncio.sleep(time_until_open)
         except KeyboardInterrupt:
             print("Process interrupted")
-        finally:
-            pool.close()
-            await pool.wait_closed()
+
+
+async def run_all(config):
+    # One updater per configured symbol, all on this loop and sharing the pool
+    updaters = [TvDataUpdate(config, symbol) for symbol in configured_symbols(config)]
+    try:
+        await run_per_symbol(updaters, 'run_loop')
+    finally:
+        await close_pools()
 
 if __name__ == "__main__":
     with open(config_path, 'r') as f:
@@ -244,5 +206,4 @@ if __name__ == "__main__":
 #     with open('config.json') as config_file:
 #         config = json.load(config_file)
 
-    tvdata_update = TvDataUpdate(config)
-    asyncio.run(tvdata_update.run())
+    asyncio.run(run_all(config))